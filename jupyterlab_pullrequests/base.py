@@ -1,14 +1,38 @@
+import functools
+import sys
+import typing
 from typing import List, NamedTuple, Optional
 
-import entrypoints
-from traitlets import Enum, Unicode, default
+from traitlets import Bool, Dict, Enum, Float, Int, Unicode, default
 from traitlets.config import Configurable
 
-# Supported third-party services
-MANAGERS = {}
+if typing.TYPE_CHECKING:
+    from importlib.metadata import EntryPoint
 
-for entry in entrypoints.get_group_all("jupyterlab_pullrequests.manager_v1"):
-    MANAGERS[entry.name] = entry
+MANAGERS_GROUP = "jupyterlab_pullrequests.manager_v1"
+
+
+@functools.lru_cache(maxsize=None)
+def get_managers() -> typing.Dict[str, "EntryPoint"]:
+    """Get the supported third-party services.
+
+    The installed distributions are only scanned for the manager entry
+    points on first call.
+
+    Returns:
+        The manager factory entry point by provider name
+    """
+    if sys.version_info >= (3, 8):
+        from importlib import metadata
+    else:
+        import importlib_metadata as metadata
+
+    entry_points = metadata.entry_points()
+    if hasattr(entry_points, "select"):
+        group = entry_points.select(group=MANAGERS_GROUP)
+    else:
+        group = entry_points.get(MANAGERS_GROUP, [])
+    return {entry.name: entry for entry in group}
 
 
 class CommentReply(NamedTuple):
@@ -64,9 +88,87 @@ class PRConfig(Configurable):
         else:
             return "https://api.github.com"
 
-    provider = Enum(
-        MANAGERS.keys(),
-        default_value="github",
+    provider = Unicode(
+        "github",
+        config=True,
+        help="The source control provider; the name of a registered manager (github or gitlab).",
+    )
+
+    comment_queue = Bool(
+        False,
+        config=True,
+        help="Whether to acknowledge the posted comments immediately and send them in the background from a local durable queue.",
+    )
+
+    warm_up = Bool(
+        False,
+        config=True,
+        help="Whether to create the manager and validate the access token in the background at server start instead of on the first request.",
+    )
+
+    request_deadline = Float(
+        0,
+        config=True,
+        help="Maximal duration in seconds of a read request; past it, the pending provider requests are cancelled and 504 is returned. 0 for no limit.",
+    )
+
+    poll_interval = Int(
+        60,
+        config=True,
+        help="Interval in seconds between two polls of a pull request status to push its updates.",
+    )
+
+    stale_while_revalidate = Dict(
+        {"prs": 0, "files": 0, "threads": 0},
+        config=True,
+        help="Age in seconds up to which a cached pull requests list ('prs'), files list ('files') or discussions ('threads') is served while it is revalidated in the background; 0 to disable.",
+    )
+
+    max_concurrent_fetches = Int(
+        8,
+        config=True,
+        help="Maximal number of file contents fetched concurrently from the versioning service.",
+    )
+
+    max_concurrent_fetches_per_pr = Int(
+        4,
+        config=True,
+        help="Maximal number of file contents fetched concurrently for a single pull request.",
+    )
+
+    max_file_size = Int(
+        20 * 1024 * 1024,
+        config=True,
+        help="Size in bytes above which file contents are not downloaded unless explicitly requested.",
+    )
+
+    max_output_size = Int(
+        100 * 1024,
+        config=True,
+        help="Size in bytes above which notebook outputs are replaced by stubs when requested; the outputs are then fetched individually.",
+    )
+
+    offload_executor = Enum(
+        ["none", "thread", "process"],
+        "thread",
+        config=True,
+        help="Pool running the CPU-bound tasks (notebook diffs, line mappings) with a large input off the event loop: 'none', 'thread' or 'process'. JSON decoding and encoding hold the GIL; so they run in worker processes unless it is 'none'.",
+    )
+
+    offload_workers = Int(
+        2,
+        config=True,
+        help="Number of workers of each pool running the CPU-bound tasks.",
+    )
+
+    offload_threshold = Int(
+        1024 * 1024,
+        config=True,
+        help="Input size in bytes from which a CPU-bound task runs in the pool instead of the event loop.",
+    )
+
+    loop_lag_threshold = Float(
+        0,
         config=True,
-        help="The source control provider.",
+        help="Duration in seconds from which an event loop stall is reported with the running handler or manager function and its stack; 0 to disable the event loop watchdog.",
     )
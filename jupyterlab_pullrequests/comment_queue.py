@@ -0,0 +1,284 @@
+"""
+Durable queue delivering the posted comments in the background.
+"""
+import asyncio
+import http
+import json
+import sqlite3
+import time
+import uuid
+from typing import TYPE_CHECKING, Dict, List, Optional, Union
+
+import tornado
+
+from .base import CommentReply, NewComment
+from .log import get_logger
+
+if TYPE_CHECKING:
+    from .managers.manager import PullRequestsManager
+
+# Maximal delay in seconds between two delivery attempts
+MAX_RETRY_DELAY = 300
+# Delay in seconds after which the delivered comments are removed from the queue
+SENT_RETENTION = 24 * 60 * 60
+# Prefix of the queued comment IDs
+QUEUED_PREFIX = "queued-"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS comments (
+    id TEXT PRIMARY KEY,
+    base_url TEXT NOT NULL,
+    pr_id TEXT NOT NULL,
+    body TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    comment TEXT,
+    error TEXT,
+    created REAL NOT NULL
+)
+"""
+
+
+class CommentQueue:
+    """Queue acknowledging the comments immediately and posting them in the background.
+
+    The comments are stored in a SQLite database; so they survive a server
+    restart. They are delivered by a single worker, in order for each pull
+    request; failed deliveries are retried with an exponential backoff unless
+    the provider rejects the comment (client error). The delivery is at least
+    once: a comment being sent when the server stops is sent again on restart.
+
+    A reply may target a queued comment; its target is replaced by the
+    discussion of the delivered comment.
+
+    Each queued comment has a ``status``:
+
+    - pending: waiting to be sent
+    - sending: being sent
+    - sent: delivered; ``comment`` is the comment created by the provider
+    - failed: rejected or too many attempts; ``error`` describes the reason
+
+    Args:
+        manager: Pull requests manager
+        path: SQLite database path
+        max_attempts: Maximal number of delivery attempts
+        retry_delay: Delay in seconds before the first retry; it doubles at each attempt
+    """
+
+    def __init__(
+        self,
+        manager: "PullRequestsManager",
+        path: str,
+        max_attempts: int = 10,
+        retry_delay: float = 2,
+    ) -> None:
+        self._manager = manager
+        self._max_attempts = max_attempts
+        self._retry_delay = retry_delay
+        self._connection = sqlite3.connect(path, isolation_level=None)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.execute(SCHEMA)
+        # Comments interrupted by a server stop are sent again
+        self._connection.execute(
+            "UPDATE comments SET status = 'pending' WHERE status = 'sending' AND base_url = ?",
+            (self._base_url,),
+        )
+        self._connection.execute(
+            "DELETE FROM comments WHERE status = 'sent' AND created < ?",
+            (time.time() - SENT_RETENTION,),
+        )
+        self._wake_up = asyncio.Event()
+        self._task = None  # type: Optional[asyncio.Future]
+
+    @property
+    def _base_url(self) -> str:
+        # The queue may be shared by servers connected to different providers
+        return self._manager.base_api_url
+
+    def add(
+        self, pr_id: str, body: Union[CommentReply, NewComment]
+    ) -> Dict[str, Union[str, int, dict, None]]:
+        """Queue a comment.
+
+        Args:
+            pr_id: pull request ID endpoint
+            body: Comment body
+        Returns:
+            The queued comment
+        """
+        data = {"type": "reply" if isinstance(body, CommentReply) else "new"}
+        data.update(body._asdict())
+        comment_id = f"{QUEUED_PREFIX}{uuid.uuid4().hex}"
+        now = time.time()
+        self._connection.execute(
+            "INSERT INTO comments (id, base_url, pr_id, body, status, next_attempt, created)"
+            " VALUES (?, ?, ?, ?, 'pending', ?, ?)",
+            (comment_id, self._base_url, pr_id, json.dumps(data), now, now),
+        )
+        self.start()
+        return self.get(comment_id)
+
+    def get(self, comment_id: str) -> Optional[Dict[str, Union[str, int, dict, None]]]:
+        """Get a queued comment.
+
+        Args:
+            comment_id: The queued comment ID
+        Returns:
+            The queued comment; None if unknown
+        """
+        row = self._connection.execute(
+            "SELECT * FROM comments WHERE id = ?", (comment_id,)
+        ).fetchone()
+        return None if row is None else CommentQueue._row_to_comment(row)
+
+    def get_comments(self, pr_id: str) -> List[Dict[str, Union[str, int, dict, None]]]:
+        """Get the queued comments of a pull request.
+
+        Args:
+            pr_id: pull request ID endpoint
+        Returns:
+            The queued comments in delivery order
+        """
+        rows = self._connection.execute(
+            "SELECT * FROM comments WHERE base_url = ? AND pr_id = ? ORDER BY rowid",
+            (self._base_url, pr_id),
+        ).fetchall()
+        return [CommentQueue._row_to_comment(row) for row in rows]
+
+    def start(self) -> None:
+        """Start the delivery worker if needed."""
+        self._wake_up.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    def stop(self) -> None:
+        """Stop the delivery worker."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            self._wake_up.clear()
+            # Only the oldest undelivered comment of each pull request may be sent
+            row = self._connection.execute(
+                "SELECT * FROM comments AS c WHERE base_url = ? AND status = 'pending'"
+                " AND NOT EXISTS (SELECT 1 FROM comments WHERE base_url = c.base_url"
+                " AND pr_id = c.pr_id AND status IN ('pending', 'sending')"
+                " AND rowid < c.rowid)"
+                " ORDER BY next_attempt, rowid LIMIT 1",
+                (self._base_url,),
+            ).fetchone()
+            if row is None:
+                await self._wake_up.wait()
+                continue
+
+            delay = row["next_attempt"] - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wake_up.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self._deliver(row)
+
+    async def _deliver(self, row: sqlite3.Row) -> None:
+        data = json.loads(row["body"])
+        if data.pop("type") == "reply":
+            body = CommentReply(**data)
+        else:
+            body = NewComment(**data)
+
+        if isinstance(body, CommentReply) and str(body.inReplyTo).startswith(
+            QUEUED_PREFIX
+        ):
+            in_reply_to = self._get_discussion(body.inReplyTo)
+            if in_reply_to is None:
+                self._connection.execute(
+                    "UPDATE comments SET status = 'failed', error = ? WHERE id = ?",
+                    (f"Replied comment {body.inReplyTo} was not delivered.", row["id"]),
+                )
+                return
+            body = body._replace(inReplyTo=in_reply_to)
+            self._connection.execute(
+                "UPDATE comments SET body = ? WHERE id = ?",
+                (json.dumps({"type": "reply", **body._asdict()}), row["id"]),
+            )
+
+        self._connection.execute(
+            "UPDATE comments SET status = 'sending', attempts = attempts + 1 WHERE id = ?",
+            (row["id"],),
+        )
+        try:
+            comment = await self._manager.post_comment(row["pr_id"], body)
+        except asyncio.CancelledError:
+            self._connection.execute(
+                "UPDATE comments SET status = 'pending' WHERE id = ?", (row["id"],)
+            )
+            raise
+        except Exception as e:
+            attempts = row["attempts"] + 1
+            reason = e.reason if isinstance(e, tornado.web.HTTPError) else str(e)
+            retry = attempts < self._max_attempts and not (
+                isinstance(e, tornado.web.HTTPError)
+                and 400 <= e.status_code < 500
+                and e.status_code != http.HTTPStatus.TOO_MANY_REQUESTS
+            )
+            get_logger().warning(
+                f"Failed to post queued comment {row['id']} (attempt {attempts}): {reason}"
+            )
+            self._connection.execute(
+                "UPDATE comments SET status = ?, next_attempt = ?, error = ? WHERE id = ?",
+                (
+                    "pending" if retry else "failed",
+                    time.time()
+                    + min(self._retry_delay * 2 ** (attempts - 1), MAX_RETRY_DELAY),
+                    reason,
+                    row["id"],
+                ),
+            )
+        else:
+            self._connection.execute(
+                "UPDATE comments SET status = 'sent', comment = ?, error = NULL WHERE id = ?",
+                (json.dumps(comment), row["id"]),
+            )
+            self._manager.invalidate_cached("threads", row["pr_id"])
+
+    def _get_discussion(self, comment_id: str) -> Optional[Union[str, int]]:
+        """Get the discussion of a delivered queued comment.
+
+        Args:
+            comment_id: The queued comment ID
+        Returns:
+            The ID to reply to the comment; None if the comment was not delivered
+        """
+        row = self._connection.execute(
+            "SELECT * FROM comments WHERE id = ? AND status = 'sent'", (comment_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        data = json.loads(row["body"])
+        if data["type"] == "reply":
+            # Its target was resolved when it was delivered
+            return data["inReplyTo"]
+        comment = json.loads(row["comment"])
+        # GitLab replies to the discussion, GitHub to the first comment
+        return comment.get("inReplyTo") or comment["id"]
+
+    @staticmethod
+    def _row_to_comment(row: sqlite3.Row) -> Dict[str, Union[str, int, dict, None]]:
+        data = json.loads(row["body"])
+        data.pop("type")
+        data.update(
+            {
+                "id": row["id"],
+                "pullRequestId": row["pr_id"],
+                "status": row["status"],
+                "attempts": row["attempts"],
+                "comment": None if row["comment"] is None else json.loads(row["comment"]),
+                "error": row["error"],
+            }
+        )
+        return data
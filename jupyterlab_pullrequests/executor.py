@@ -0,0 +1,155 @@
+"""
+Executor running the CPU-bound tasks off the event loop.
+"""
+import concurrent.futures
+import json
+import time
+from typing import Any, Callable, TypeVar
+
+import tornado.ioloop
+
+from .metrics import CPU_TASK_DURATION_SECONDS
+
+T = TypeVar("T")
+
+
+def estimate_size(data: Any, limit: int) -> int:
+    """Estimate the JSON encoded size of data.
+
+    The estimation stops as soon as it exceeds ``limit``; so it stays cheap
+    for large payloads.
+
+    Args:
+        data: JSON serializable data
+        limit: Size in bytes from which the estimation stops
+    Returns:
+        The estimated size in bytes
+    """
+    size = 0
+    stack = [data]
+    while stack and size < limit:
+        item = stack.pop()
+        if isinstance(item, str):
+            size += len(item) + 2
+        elif isinstance(item, dict):
+            size += 2 + sum(len(str(key)) + 4 for key in item)
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple)):
+            size += 2 + len(item)
+            stack.extend(item)
+        else:
+            size += 8
+    return size
+
+
+def encode_json(data: Any) -> bytes:
+    """Encode data in UTF-8 JSON.
+
+    The bytes are sent as is in the response; so a worker process returns
+    them without the costly unpickling of a large string.
+
+    Args:
+        data: JSON serializable data
+    Returns:
+        The JSON document
+    """
+    return json.dumps(data).encode("utf-8")
+
+
+class TaskExecutor:
+    """Run the CPU-bound tasks with a large input in a pool.
+
+    Small tasks run inline as the hop to the pool would cost more than the
+    task itself. A thread pool frees the event loop for pure Python tasks
+    (e.g. difflib) as they release the GIL regularly.
+
+    The JSON encoder and decoder hold the GIL for the whole document; so
+    they run in a process pool whatever ``kind`` is, unless it is "none". The
+    event loop then only pays for pickling the task input and output; that is
+    a copy for the large strings (file contents, diffs) making the large
+    documents. It stays proportional to the number of objects; but the
+    provider listings are paginated so their pages are small.
+
+    The pools are created on first use. The time spent by each task is
+    recorded in ``CPU_TASK_DURATION_SECONDS``.
+
+    Args:
+        kind: "none" to run all tasks inline, "thread" or "process"
+        max_workers: Pools size
+        threshold: Input size in bytes from which a task is sent to a pool
+    """
+
+    def __init__(self, kind: str, max_workers: int, threshold: int) -> None:
+        self._kind = kind
+        self._max_workers = max_workers
+        self._threshold = threshold
+        # Pools by kind
+        self._pools = {}  # Dict[str, concurrent.futures.Executor]
+
+    async def run(
+        self, task: str, size: int, func: Callable[..., T], *args, holds_gil: bool = False
+    ) -> T:
+        """Run a function inline or in a pool depending on its input size.
+
+        Args:
+            task: Task name for the metrics
+            size: Input size in bytes
+            func: Function to run; it must be picklable for a process pool
+            args: Function arguments
+            holds_gil: Whether the function holds the GIL; it then runs in a process pool
+        Returns:
+            The function result
+        """
+        start = time.perf_counter()
+        if self._kind == "none" or size < self._threshold:
+            executor = "inline"
+        elif holds_gil:
+            executor = "process"
+        else:
+            executor = self._kind
+        try:
+            if executor == "inline":
+                return func(*args)
+            return await tornado.ioloop.IOLoop.current().run_in_executor(
+                self._get_pool(executor), func, *args
+            )
+        finally:
+            CPU_TASK_DURATION_SECONDS.labels(task, executor).observe(
+                time.perf_counter() - start
+            )
+
+    async def dumps(self, task: str, data: Any) -> bytes:
+        """Encode data in JSON; in a worker process if it is large.
+
+        Args:
+            task: Task name for the metrics
+            data: JSON serializable data
+        Returns:
+            The UTF-8 JSON document
+        """
+        return await self.run(
+            task, estimate_size(data, self._threshold), encode_json, data, holds_gil=True
+        )
+
+    async def loads(self, task: str, data: bytes) -> Any:
+        """Decode JSON data; in a worker process if it is large.
+
+        Args:
+            task: Task name for the metrics
+            data: JSON document
+        Returns:
+            The decoded data
+        """
+        return await self.run(task, len(data), json.loads, data, holds_gil=True)
+
+    def _get_pool(self, kind: str) -> concurrent.futures.Executor:
+        if kind not in self._pools:
+            if kind == "process":
+                self._pools[kind] = concurrent.futures.ProcessPoolExecutor(
+                    self._max_workers
+                )
+            else:
+                self._pools[kind] = concurrent.futures.ThreadPoolExecutor(
+                    self._max_workers, thread_name_prefix="jupyterlab_pullrequests"
+                )
+        return self._pools[kind]
@@ -1,37 +1,101 @@
 """
 Module with all of the individual handlers, which return the results to the frontend.
 """
+import asyncio
+import functools
+import hashlib
 import json
 import logging
+import mimetypes
+import os
 import traceback
 from http import HTTPStatus
-from typing import Optional
+from typing import TYPE_CHECKING, AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
 
 import tornado
 import tornado.escape as escape
 import traitlets
+from jupyter_core.paths import jupyter_runtime_dir
 from jupyter_server.base.handlers import APIHandler
 from jupyter_server.utils import url_path_join
+from tornado.httputil import url_concat
 
-from .base import MANAGERS, CommentReply, NewComment, PRConfig
+from .base import CommentReply, NewComment, PRConfig, get_managers
 from .log import get_logger
-from .managers.manager import PullRequestsManager
+from .poller import PullRequestPollers
+
+if TYPE_CHECKING:  # Heavy modules are imported on first use only
+    from importlib.metadata import EntryPoint
+
+    from .comment_queue import CommentQueue
+    from .managers.manager import PullRequestsManager
 
 NAMESPACE = "pullrequests"
+# Interval in seconds between two keep-alive messages on the events stream
+KEEP_ALIVE_INTERVAL = 15
+# Comment queue database in the Jupyter runtime directory
+COMMENT_QUEUE_FILENAME = "jupyterlab_pullrequests_comments.db"
 
 # -----------------------------------------------------------------------------
 # /pullrequests/prs/user Handler
 # -----------------------------------------------------------------------------
 
 
+def cancellable(
+    method: Callable[..., Awaitable[None]]
+) -> Callable[..., Awaitable[None]]:
+    """Run a read-only handler method in a task that is cancelled when the
+    client disconnects or when the request deadline is over.
+
+    Cancelling the task abandons the provider requests it waits for; the
+    requests shared with other handlers keep running (see
+    ``PullRequestsManager._coalesce``). An expired deadline is reported as
+    504 Gateway Timeout.
+    """
+
+    @functools.wraps(method)
+    async def wrapper(self: "PullRequestsAPIHandler", *args, **kwargs) -> None:
+        self._request_task = asyncio.ensure_future(method(self, *args, **kwargs))
+        try:
+            await asyncio.wait_for(self._request_task, self._deadline or None)
+        except asyncio.TimeoutError as e:
+            raise tornado.web.HTTPError(
+                status_code=HTTPStatus.GATEWAY_TIMEOUT,
+                reason=f"Request not completed within {self._deadline} seconds.",
+            ) from e
+        except asyncio.CancelledError:
+            if not self._request_task.cancelled() or not self._disconnected:
+                raise
+            self._jp_log.debug(f"Request cancelled by the client: {self.request.uri}")
+        finally:
+            self._request_task = None
+
+    return wrapper
+
+
 class PullRequestsAPIHandler(APIHandler):
     """
     Base handler for PullRequest specific API handlers
     """
 
-    def initialize(self, manager: PullRequestsManager, logger: logging.Logger):
+    def initialize(
+        self,
+        manager: "PullRequestsManager",
+        logger: logging.Logger,
+        deadline: float = 0,
+    ):
         self._jp_log = logger
         self._manager = manager
+        # Maximal duration in seconds of the cancellable methods; 0 for no limit
+        self._deadline = deadline
+        self._request_task = None  # type: Optional[asyncio.Future]
+        self._disconnected = False
+
+    def on_connection_close(self):
+        self._disconnected = True
+        if self._request_task is not None:
+            # Stop fetching the abandoned response
+            self._request_task.cancel()
 
     def write_error(self, status_code, **kwargs):
         """
@@ -51,6 +115,116 @@ class PullRequestsAPIHandler(APIHandler):
                 reply["error"] = "".join(traceback.format_exception(*exc_info))
         self.finish(json.dumps(reply))
 
+    def check_validator(self, validator: Optional[str]) -> bool:
+        """Set the response ETag from a validator of its content.
+
+        If the client copy matches, a 304 response is sent so the content
+        does not need to be computed.
+
+        Args:
+            validator: The content validator; None if unknown
+        Returns:
+            Whether the 304 response has been sent
+        """
+        if validator is None:
+            return False
+        digest = hashlib.sha256(
+            f"{self.request.uri}\n{validator}".encode("utf-8")
+        ).hexdigest()
+        self.set_header("Etag", f'"{digest}"')
+        if self.check_etag_header():
+            self.set_status(304)
+            self.finish()
+            return True
+        return False
+
+    def get_page_range(self) -> Optional[Tuple[int, int]]:
+        """Get the requested range of items.
+
+        The range is set by the optional parameters 'limit', the maximal number
+        of items, and 'cursor', the opaque position of the first item provided
+        by the Link header of the previous range.
+
+        Returns:
+            The index of the first item and the maximal number of items;
+            None if all items are requested
+        """
+        if self.get_query_argument("limit", None) is None:
+            return None
+        limit = get_request_int_value(self, "limit")
+        if limit <= 0:
+            raise tornado.web.HTTPError(
+                status_code=HTTPStatus.BAD_REQUEST,
+                reason=f"Invalid parameter 'limit'. Expected a positive integer, received '{limit}'.",
+            )
+        cursor = self.get_query_argument("cursor", "0")
+        if not cursor.isdigit():
+            raise tornado.web.HTTPError(
+                status_code=HTTPStatus.BAD_REQUEST,
+                reason=f"Invalid parameter 'cursor', received '{cursor}'.",
+            )
+        return int(cursor), limit
+
+    async def finish_json(self, data):
+        """Send data encoded in JSON.
+
+        Large data, like file contents, are encoded off the event loop.
+        """
+        self.finish(await self._manager.executor.dumps("encode", data))
+
+    def send_cached(self, result: list, age: float):
+        """Send a cached answer being revalidated.
+
+        The answer is marked as stale with the headers 'Age' and 'X-Stale'
+        so the frontend can request it again later.
+        """
+        self.set_header("Age", str(int(age)))
+        self.set_header("X-Stale", "1")
+        self.finish(json.dumps(result))
+
+    async def send_page(self, items: list, next_start: Optional[int]):
+        """Send a range of items.
+
+        The link to the next range is set in the Link header as rel="next".
+        """
+        if next_start is not None:
+            params = {
+                name: self.get_query_argument(name)
+                for name in self.request.query_arguments
+            }
+            params["cursor"] = str(next_start)
+            next_url = url_concat(self.request.path, params)
+            self.set_header("Link", f'<{next_url}>; rel="next"')
+
+        if get_request_bool_value(self, "stream"):
+
+            async def single_page():
+                yield items
+
+            await self.stream_pages(single_page())
+        else:
+            self.finish(json.dumps(items))
+
+    async def stream_pages(self, pages: AsyncIterator[list]):
+        """Send the items as newline-delimited JSON, flushing after each page.
+
+        Errors occurring after the first page cannot change the response status;
+        they are sent as a last line {"error": str}.
+        """
+        self.set_header("Content-Type", "application/x-ndjson")
+        started = False
+        try:
+            async for page in pages:
+                self.write("".join(json.dumps(item) + "\n" for item in page))
+                await self.flush()
+                started = True
+        except tornado.web.HTTPError as e:
+            if not started:
+                raise e
+            self._jp_log.error(f"Failed to stream the response: {e.reason}")
+            self.write(json.dumps({"error": e.reason}) + "\n")
+        self.finish()
+
 
 class ListPullRequestsUserHandler(PullRequestsAPIHandler):
     """
@@ -58,9 +232,14 @@ class ListPullRequestsUserHandler(PullRequestsAPIHandler):
     Takes parameter 'filter' with following options
         - 'created' returns all pull requests authenticated user has created
         - 'assigned' returns all pull requests assigned to authenticated user
+    Takes optional parameter 'stream' to send newline-delimited JSON as the
+    pull requests are received
+    Takes optional parameters 'limit' and 'cursor' to get a range of the pull
+    requests (see PullRequestsAPIHandler.get_page_range)
     """
 
-    def validate_request(self, pr_filter):
+    @staticmethod
+    def validate_request(pr_filter):
         if not (pr_filter == "created" or pr_filter == "assigned"):
             raise tornado.web.HTTPError(
                 status_code=HTTPStatus.BAD_REQUEST,
@@ -68,14 +247,33 @@ class ListPullRequestsUserHandler(PullRequestsAPIHandler):
             )
 
     @tornado.web.authenticated
+    @cancellable
     async def get(self):
 
         pr_filter = get_request_attr_value(self, "filter")
         self.validate_request(pr_filter)  # handler specific validation
 
-        current_user = await self._manager.get_current_user()
-        prs = await self._manager.list_prs(current_user["username"], pr_filter)
-        self.finish(json.dumps(prs))
+        page_range = self.get_page_range()
+        if page_range is not None:
+            start, limit = page_range
+            current_user = await self._manager.get_current_user()
+            await self.send_page(
+                *await self._manager.get_prs_page(
+                    current_user["username"], pr_filter, limit, start
+                )
+            )
+        elif get_request_bool_value(self, "stream"):
+            current_user = await self._manager.get_current_user()
+            await self.stream_pages(
+                self._manager.iter_prs(current_user["username"], pr_filter)
+            )
+        else:
+            cached = self._manager.get_cached("prs", pr_filter)
+            if cached is not None:
+                self.send_cached(*cached)
+                return
+            prs = await self._manager.fetch_cached("prs", pr_filter)
+            self.finish(json.dumps(prs))
 
 
 # -----------------------------------------------------------------------------
@@ -87,13 +285,94 @@ class ListPullRequestsFilesHandler(PullRequestsAPIHandler):
     """
     Returns array of a pull request's files
     Takes parameter 'id' with the id of the pull request
+    Takes optional parameter 'stream' to send newline-delimited JSON as the
+    files are received
+    Takes optional parameters 'limit' and 'cursor' to get a range of the files
+    (see PullRequestsAPIHandler.get_page_range)
+    """
+
+    @tornado.web.authenticated
+    @cancellable
+    async def get(self):
+        pr_id = get_request_attr_value(self, "id")
+        page_range = self.get_page_range()
+        stream = get_request_bool_value(self, "stream")
+        if page_range is None and not stream:
+            cached = self._manager.get_cached("files", pr_id)
+            if cached is not None:
+                self.send_cached(*cached)
+                return
+
+        validator = await self._manager.get_files_validator(pr_id)
+        if self.check_validator(validator):
+            return
+        if page_range is not None:
+            start, limit = page_range
+            await self.send_page(
+                *await self._manager.get_files_page(pr_id, limit, start)
+            )
+        elif stream:
+            await self.stream_pages(self._manager.iter_files(pr_id))
+        else:
+            files = await self._manager.fetch_cached("files", pr_id, validator=validator)
+            self.finish(json.dumps(files))
+
+
+# -----------------------------------------------------------------------------
+# /pullrequests/prs/events Handler
+# -----------------------------------------------------------------------------
+
+
+class PullRequestsEventsHandler(PullRequestsAPIHandler):
+    """
+    Stream the updates of a pull request as server-sent events
+    Takes parameter 'id' with the id of the pull request
+    The events are 'status', 'head', 'state', 'comments' and 'error'; their
+    data is a JSON object (see PullRequestPoller).
     """
 
+    def initialize(
+        self,
+        manager: "PullRequestsManager",
+        logger: logging.Logger,
+        pollers: PullRequestPollers,
+        deadline: float = 0,
+    ):
+        super().initialize(manager, logger, deadline)
+        self._pollers = pollers
+        self._queue = None
+
+    def on_connection_close(self):
+        super().on_connection_close()
+        if self._queue is not None:
+            # Stop the stream
+            self._queue.put_nowait(None)
+
     @tornado.web.authenticated
     async def get(self):
         pr_id = get_request_attr_value(self, "id")
-        files = await self._manager.list_files(pr_id)
-        self.finish(json.dumps(files))
+
+        self.set_header("Content-Type", "text/event-stream")
+        self.set_header("Cache-Control", "no-cache")
+        self._queue = self._pollers.subscribe(pr_id)
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(
+                        self._queue.get(), KEEP_ALIVE_INTERVAL
+                    )
+                except asyncio.TimeoutError:
+                    self.write(": keep-alive\n\n")
+                else:
+                    if event is None:
+                        break
+                    self.write(f"event: {event['type']}\ndata: {json.dumps(event)}\n\n")
+                await self.flush()
+        except tornado.iostream.StreamClosedError:
+            pass
+        finally:
+            self._pollers.unsubscribe(pr_id, self._queue)
+            self._queue = None
 
 
 # -----------------------------------------------------------------------------
@@ -104,13 +383,185 @@ class ListPullRequestsFilesHandler(PullRequestsAPIHandler):
 class PullRequestsFileContentHandler(PullRequestsAPIHandler):
     """
     Returns base and head content
+    Takes optional parameter 'mode' with following options
+        - 'full' (default) returns the whole base and head contents
+        - 'patch' returns only the diff hunks
+        - 'notebook' returns only the changed cells of a notebook
+    Takes optional parameter 'outputs' with following options (for 'notebook' mode)
+        - 'full' (default) returns all cell outputs
+        - 'stub' replaces large outputs by stubs to be fetched through files/output
+    Takes optional parameter 'force' to download binary or too large files
+    Takes optional parameter 'refs' to return references to be fetched through
+    files/raw instead of the contents (for 'full' mode)
     """
 
+    @staticmethod
+    def validate_request(mode, filename, outputs):
+        if mode not in ("full", "patch", "notebook"):
+            raise tornado.web.HTTPError(
+                status_code=HTTPStatus.BAD_REQUEST,
+                reason=f"Invalid parameter 'mode'. Expected value 'full', 'patch' or 'notebook', received '{mode}'.",
+            )
+        if mode == "notebook" and not filename.endswith(".ipynb"):
+            raise tornado.web.HTTPError(
+                status_code=HTTPStatus.BAD_REQUEST,
+                reason=f"Invalid parameter 'mode'. Mode 'notebook' requires a notebook, received '{filename}'.",
+            )
+        if outputs not in ("full", "stub"):
+            raise tornado.web.HTTPError(
+                status_code=HTTPStatus.BAD_REQUEST,
+                reason=f"Invalid parameter 'outputs'. Expected value 'full' or 'stub', received '{outputs}'.",
+            )
+        if outputs == "stub" and mode != "notebook":
+            raise tornado.web.HTTPError(
+                status_code=HTTPStatus.BAD_REQUEST,
+                reason="Invalid parameter 'outputs'. Outputs can only be stubbed in 'notebook' mode.",
+            )
+
+    @staticmethod
+    async def get_content(
+        manager: "PullRequestsManager",
+        pr_id: str,
+        filename: str,
+        mode: str,
+        outputs: str,
+        refs: bool,
+        force: bool,
+    ) -> dict:
+        PullRequestsFileContentHandler.validate_request(mode, filename, outputs)
+
+        if mode == "patch":
+            return await manager.get_file_patch(pr_id, filename)
+        elif mode == "notebook":
+            return await manager.get_notebook_diff(
+                pr_id, filename, stub_outputs=outputs == "stub"
+            )
+        elif refs:
+            return await manager.get_file_references(pr_id, filename)
+        else:
+            return await manager.get_file_diff(pr_id, filename, force=force)
+
     @tornado.web.authenticated
+    @cancellable
+    async def get(self):
+        content = await self.get_content(
+            self._manager,
+            get_request_attr_value(self, "id"),
+            get_request_attr_value(self, "filename"),
+            self.get_query_argument("mode", "full"),
+            self.get_query_argument("outputs", "full"),
+            get_request_bool_value(self, "refs"),
+            get_request_bool_value(self, "force"),
+        )
+        await self.finish_json(content)
+
+
+# -----------------------------------------------------------------------------
+# /pullrequests/files/raw Handler
+# -----------------------------------------------------------------------------
+
+
+class PullRequestsFileRawHandler(PullRequestsAPIHandler):
+    """
+    Returns the raw content of a file at a given commit
+    Takes parameters 'repo', 'sha' and 'path' as in the references returned
+    by files/content
+    """
+
+    @tornado.web.authenticated
+    @cancellable
+    async def get(self):
+        repo = get_request_attr_value(self, "repo")
+        sha = get_request_attr_value(self, "sha")
+        path = get_request_attr_value(self, "path")
+
+        # The content at a commit never changes; it can be cached forever
+        self.set_header("Cache-Control", "private, max-age=31536000, immutable")
+        if self.check_validator(f"{repo}\n{sha}\n{path}"):
+            return
+
+        content = await self._manager.get_file_raw(repo, sha, path)
+
+        # Never let the browser render active content from the Jupyter origin
+        content_type = mimetypes.guess_type(path)[0]
+        if (
+            content_type is None
+            or not content_type.startswith("image/")
+            or content_type == "image/svg+xml"
+        ):
+            try:
+                content.decode("utf-8")
+                content_type = "text/plain; charset=utf-8"
+            except UnicodeDecodeError:
+                content_type = "application/octet-stream"
+        self.set_header("Content-Type", content_type)
+        self.set_header("X-Content-Type-Options", "nosniff")
+        self.set_header("Content-Security-Policy", "sandbox")
+        self.finish(content)
+
+
+# -----------------------------------------------------------------------------
+# /pullrequests/files/output Handler
+# -----------------------------------------------------------------------------
+
+
+class PullRequestsNotebookOutputHandler(PullRequestsAPIHandler):
+    """
+    Returns a notebook output replaced by a stub in files/content
+    Takes parameter 'hash' with the hash of the stubbed output
+    """
+
+    @tornado.web.authenticated
+    @cancellable
     async def get(self):
         pr_id = get_request_attr_value(self, "id")
         filename = get_request_attr_value(self, "filename")
-        content = await self._manager.get_file_diff(pr_id, filename)
+        output_hash = get_request_attr_value(self, "hash")
+
+        # The output is identified by its content hash; it can be cached forever
+        if self.request.headers.get("If-None-Match", "") == f'"{output_hash}"':
+            self.set_status(304)
+            self.finish()
+            return
+
+        output = await self._manager.get_notebook_output(pr_id, filename, output_hash)
+        self.set_header("ETag", f'"{output_hash}"')
+        self.set_header("Cache-Control", "private, max-age=31536000, immutable")
+        await self.finish_json(output)
+
+
+# -----------------------------------------------------------------------------
+# /pullrequests/files/context Handler
+# -----------------------------------------------------------------------------
+
+
+class PullRequestsFileContextHandler(PullRequestsAPIHandler):
+    """
+    Returns a range of lines of the base or head content
+    Takes parameters 'side' ('base' or 'head'), 'start' and 'end' (1-based, included)
+    """
+
+    @staticmethod
+    def validate_request(side):
+        if side not in ("base", "head"):
+            raise tornado.web.HTTPError(
+                status_code=HTTPStatus.BAD_REQUEST,
+                reason=f"Invalid parameter 'side'. Expected value 'base' or 'head', received '{side}'.",
+            )
+
+    @tornado.web.authenticated
+    @cancellable
+    async def get(self):
+        pr_id = get_request_attr_value(self, "id")
+        filename = get_request_attr_value(self, "filename")
+        side = get_request_attr_value(self, "side")
+        self.validate_request(side)
+        start = get_request_int_value(self, "start")
+        end = get_request_int_value(self, "end")
+
+        content = await self._manager.get_file_context(
+            pr_id, filename, side, start, end
+        )
         self.finish(json.dumps(content))
 
 
@@ -122,13 +573,38 @@ class PullRequestsFileContentHandler(PullRequestsAPIHandler):
 class PullRequestsFileCommentsHandler(PullRequestsAPIHandler):
     """
     Handle comments
+    A posted comment with the key 'pending' set to true is added to the
+    pending review of the pull request (see PullRequestsReviewHandler)
+    If the comment queue is enabled, a posted comment is acknowledged with
+    status 202 and sent in the background (see PullRequestsCommentQueueHandler)
     """
 
+    def initialize(
+        self,
+        manager: "PullRequestsManager",
+        logger: logging.Logger,
+        comment_queue: Optional["CommentQueue"] = None,
+        deadline: float = 0,
+    ):
+        super().initialize(manager, logger, deadline)
+        self._comment_queue = comment_queue
+
     @tornado.web.authenticated
+    @cancellable
     async def get(self):
         pr_id = get_request_attr_value(self, "id")
         filename = self.get_query_argument("filename", None)
-        content = await self._manager.get_threads(pr_id, filename)
+        cached = self._manager.get_cached("threads", pr_id, filename)
+        if cached is not None:
+            self.send_cached(*cached)
+            return
+
+        validator = await self._manager.get_threads_validator(pr_id, filename)
+        if self.check_validator(validator):
+            return
+        content = await self._manager.fetch_cached(
+            "threads", pr_id, filename, validator=validator
+        )
         self.finish(json.dumps(content))
 
     @tornado.web.authenticated
@@ -147,12 +623,256 @@ class PullRequestsFileCommentsHandler(PullRequestsAPIHandler):
             raise tornado.web.HTTPError(
                 status_code=HTTPStatus.BAD_REQUEST, reason=f"Missing POST key: {e}"
             )
-        result = await self._manager.post_comment(pr_id, body)
+        if data.get("pending", False):
+            result = self._manager.add_pending_comment(pr_id, body)
+            self.set_status(201)
+        elif self._comment_queue is not None:
+            result = self._comment_queue.add(pr_id, body)
+            self.set_status(202)
+        else:
+            result = await self._manager.post_comment(pr_id, body)
+            self._manager.invalidate_cached("threads", pr_id)
+            self.set_status(201)
 
-        self.set_status(201)
         self.finish(json.dumps(result))
 
 
+# -----------------------------------------------------------------------------
+# /pullrequests/files/comments/queue Handler
+# -----------------------------------------------------------------------------
+
+
+class PullRequestsCommentQueueHandler(PullRequestsAPIHandler):
+    """
+    Returns the delivery status of the queued comments
+    Takes parameter 'id' with the id of the pull request
+    Takes optional parameter 'commentId' to get a single queued comment
+    """
+
+    def initialize(
+        self,
+        manager: "PullRequestsManager",
+        logger: logging.Logger,
+        comment_queue: "CommentQueue",
+        deadline: float = 0,
+    ):
+        super().initialize(manager, logger, deadline)
+        self._comment_queue = comment_queue
+
+    @tornado.web.authenticated
+    async def get(self):
+        pr_id = get_request_attr_value(self, "id")
+        comment_id = self.get_query_argument("commentId", None)
+        if comment_id is None:
+            self.finish(json.dumps(self._comment_queue.get_comments(pr_id)))
+            return
+
+        comment = self._comment_queue.get(comment_id)
+        if comment is None or comment["pullRequestId"] != pr_id:
+            raise tornado.web.HTTPError(
+                status_code=HTTPStatus.NOT_FOUND,
+                reason=f"Queued comment '{comment_id}' not found.",
+            )
+        self.finish(json.dumps(comment))
+
+
+# -----------------------------------------------------------------------------
+# /pullrequests/prs/review Handler
+# -----------------------------------------------------------------------------
+
+
+class PullRequestsReviewHandler(PullRequestsAPIHandler):
+    """
+    Handle the pending review of a pull request
+    Takes parameter 'id' with the id of the pull request
+    GET returns the pending comments
+    POST sends them as a single review; the body may contain a review
+    summary as {"text": str}
+    DELETE discards them; takes optional parameter 'commentId' to discard
+    only one pending comment
+    """
+
+    @tornado.web.authenticated
+    async def get(self):
+        pr_id = get_request_attr_value(self, "id")
+        self.finish(json.dumps(self._manager.get_pending_comments(pr_id)))
+
+    @tornado.web.authenticated
+    async def post(self):
+        pr_id = get_request_attr_value(self, "id")
+        text = None
+        if self.request.body:
+            data = get_body_value(self)
+            text = data.get("text") if isinstance(data, dict) else None
+        count = await self._manager.submit_review(pr_id, text)
+        self.finish(json.dumps({"count": count}))
+
+    @tornado.web.authenticated
+    async def delete(self):
+        pr_id = get_request_attr_value(self, "id")
+        comment_id = self.get_query_argument("commentId", None)
+        self._manager.discard_pending_comments(pr_id, comment_id)
+        self.set_status(204)
+        self.finish()
+
+
+# -----------------------------------------------------------------------------
+# /pullrequests/batch Handler
+# -----------------------------------------------------------------------------
+
+
+def get_operation_value(params: Dict[str, str], arg: str) -> str:
+    param = params.get(arg)
+    if param is None:
+        raise tornado.web.HTTPError(
+            status_code=HTTPStatus.BAD_REQUEST, reason=f"Missing argument '{arg}'."
+        )
+    if not param:
+        raise tornado.web.HTTPError(
+            status_code=HTTPStatus.BAD_REQUEST,
+            reason=f"Invalid argument '{arg}', cannot be blank.",
+        )
+    return str(param)
+
+
+def get_operation_bool_value(params: Dict[str, str], arg: str) -> bool:
+    return str(params.get(arg, "false")).lower() in ("1", "true")
+
+
+def get_operation_int_value(params: Dict[str, str], arg: str) -> int:
+    param = get_operation_value(params, arg)
+    try:
+        return int(param)
+    except ValueError as e:
+        raise tornado.web.HTTPError(
+            status_code=HTTPStatus.BAD_REQUEST,
+            reason=f"Invalid argument '{arg}', expected an integer.",
+        ) from e
+
+
+async def _list_files(manager: "PullRequestsManager", params: Dict[str, str]):
+    return await manager.list_files(get_operation_value(params, "id"))
+
+
+async def _get_file_content(manager: "PullRequestsManager", params: Dict[str, str]):
+    return await PullRequestsFileContentHandler.get_content(
+        manager,
+        get_operation_value(params, "id"),
+        get_operation_value(params, "filename"),
+        params.get("mode", "full"),
+        params.get("outputs", "full"),
+        get_operation_bool_value(params, "refs"),
+        get_operation_bool_value(params, "force"),
+    )
+
+
+async def _get_file_context(manager: "PullRequestsManager", params: Dict[str, str]):
+    side = get_operation_value(params, "side")
+    PullRequestsFileContextHandler.validate_request(side)
+    return await manager.get_file_context(
+        get_operation_value(params, "id"),
+        get_operation_value(params, "filename"),
+        side,
+        get_operation_int_value(params, "start"),
+        get_operation_int_value(params, "end"),
+    )
+
+
+async def _get_threads(manager: "PullRequestsManager", params: Dict[str, str]):
+    pr_id = get_operation_value(params, "id")
+    filename = params.get("filename")
+    # As for PullRequestsCommentsHandler, getting the validator refreshes the
+    # pull request the cached discussions are checked against
+    validator = await manager.get_threads_validator(pr_id, filename)
+    return await manager.fetch_cached("threads", pr_id, filename, validator=validator)
+
+
+# Operations supported by the batch endpoint; the keys are the matching endpoints
+BATCH_OPERATIONS = {
+    "prs/files": _list_files,
+    "files/content": _get_file_content,
+    "files/context": _get_file_context,
+    "files/comments": _get_threads,
+}  # type: Dict[str, Callable[[PullRequestsManager, Dict[str, str]], Awaitable]]
+
+# Maximal number of operations in a batch
+MAX_BATCH_OPERATIONS = 50
+
+
+class PullRequestsBatchHandler(PullRequestsAPIHandler):
+    """
+    Run multiple read operations concurrently
+    Takes a POST body with the list of operations:
+        [{"path": "files/content", "params": {"id": "...", "filename": "..."}}, ...]
+    The supported paths are the GET endpoints 'prs/files', 'files/content',
+    'files/context' and 'files/comments'; params are their query arguments.
+    Returns the list of results; each being {"index": int, "status": int}
+    with "result" on success or "error" on failure.
+    Takes optional parameter 'stream' to send the results as newline-delimited
+    JSON in their completion order.
+    """
+
+    @staticmethod
+    def validate_request(operations):
+        if not isinstance(operations, list) or not all(
+            isinstance(o, dict) for o in operations
+        ):
+            raise tornado.web.HTTPError(
+                status_code=HTTPStatus.BAD_REQUEST,
+                reason="Invalid POST body. Expected a list of operations.",
+            )
+        if len(operations) > MAX_BATCH_OPERATIONS:
+            raise tornado.web.HTTPError(
+                status_code=HTTPStatus.BAD_REQUEST,
+                reason=f"Invalid POST body. Expected at most {MAX_BATCH_OPERATIONS} operations, received {len(operations)}.",
+            )
+
+    async def _run(self, index: int, operation: dict) -> dict:
+        try:
+            path = operation.get("path")
+            if path not in BATCH_OPERATIONS:
+                raise tornado.web.HTTPError(
+                    status_code=HTTPStatus.BAD_REQUEST,
+                    reason=f"Invalid operation path. Expected one of {', '.join(BATCH_OPERATIONS)}, received '{path}'.",
+                )
+            params = operation.get("params") or {}
+            result = await BATCH_OPERATIONS[path](self._manager, params)
+            return {"index": index, "status": HTTPStatus.OK, "result": result}
+        except tornado.web.HTTPError as e:
+            return {"index": index, "status": e.status_code, "error": e.reason}
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._jp_log.error("Batch operation failed", exc_info=e)
+            return {
+                "index": index,
+                "status": HTTPStatus.INTERNAL_SERVER_ERROR,
+                "error": str(e),
+            }
+
+    @tornado.web.authenticated
+    @cancellable
+    async def post(self):
+        operations = get_body_value(self)
+        self.validate_request(operations)
+
+        tasks = [asyncio.ensure_future(self._run(i, o)) for i, o in enumerate(operations)]
+        try:
+            if get_request_bool_value(self, "stream"):
+                self.set_header("Content-Type", "application/x-ndjson")
+                for task in asyncio.as_completed(tasks):
+                    self.write(await self._manager.executor.dumps("encode", await task))
+                    self.write("\n")
+                    await self.flush()
+                self.finish()
+            else:
+                await self.finish_json(await asyncio.gather(*tasks))
+        finally:
+            # Operations left behind by a disconnection or a failed write
+            for task in tasks:
+                task.cancel()
+
+
 # -----------------------------------------------------------------------------
 # Handler utilities
 # -----------------------------------------------------------------------------
@@ -175,6 +895,22 @@ def get_request_attr_value(handler, arg):
         ) from e
 
 
+def get_request_bool_value(handler, arg):
+    return handler.get_query_argument(arg, "false").lower() in ("1", "true")
+
+
+def get_request_int_value(handler, arg):
+    param = get_request_attr_value(handler, arg)
+    try:
+        return int(param)
+    except ValueError as e:
+        get_logger().error(f"Invalid argument '{arg}', expected an integer.")
+        raise tornado.web.HTTPError(
+            status_code=HTTPStatus.BAD_REQUEST,
+            reason=f"Invalid argument '{arg}', expected an integer.",
+        ) from e
+
+
 def get_body_value(handler):
     try:
         if not handler.request.body:
@@ -187,6 +923,64 @@ def get_body_value(handler):
         ) from e
 
 
+# -----------------------------------------------------------------------------
+# Manager
+# -----------------------------------------------------------------------------
+
+
+class LazyManager:
+    """Proxy creating the pull requests manager on first use.
+
+    Loading the manager and its dependencies is postponed from the server
+    start to the first request; or to the background warm-up if enabled.
+
+    Args:
+        entry_point: Manager factory entry point
+        config: Server configuration
+        log: Logger
+    """
+
+    def __init__(
+        self,
+        entry_point: "EntryPoint",
+        config: traitlets.config.Config,
+        log: logging.Logger,
+    ) -> None:
+        self._entry_point = entry_point
+        self._config = config
+        self._log = log
+        self._manager = None  # type: Optional[PullRequestsManager]
+
+    @property
+    def manager(self) -> "PullRequestsManager":
+        """The pull requests manager; created on first access."""
+        if self._manager is None:
+            manager_factory = self._entry_point.load()
+            self._log.info(f"PR Manager Class {manager_factory}")
+            try:
+                self._manager = manager_factory(self._config)
+            except Exception as err:
+                self._log.error("PR Manager Exception", exc_info=err)
+                raise
+        return self._manager
+
+    def __getattr__(self, name: str):
+        return getattr(self.manager, name)
+
+    async def warm_up(self) -> None:
+        """Create the manager and validate the access token.
+
+        The current user is cached by the manager; so the first request
+        does not wait for it. Failures are only logged, they will be
+        reported to the first request.
+        """
+        try:
+            await self.manager.get_current_user()
+        except Exception as e:
+            reason = e.reason if isinstance(e, tornado.web.HTTPError) else str(e)
+            self._log.warning(f"PR Manager warm-up failed: {reason}")
+
+
 # -----------------------------------------------------------------------------
 # URL to handler mappings
 # -----------------------------------------------------------------------------
@@ -194,8 +988,12 @@ def get_body_value(handler):
 default_handlers = [
     ("prs/user", ListPullRequestsUserHandler),
     ("prs/files", ListPullRequestsFilesHandler),
+    ("prs/review", PullRequestsReviewHandler),
     ("files/content", PullRequestsFileContentHandler),
-    ("files/comments", PullRequestsFileCommentsHandler),
+    ("files/context", PullRequestsFileContextHandler),
+    ("files/raw", PullRequestsFileRawHandler),
+    ("files/output", PullRequestsNotebookOutputHandler),
+    ("batch", PullRequestsBatchHandler),
 ]
 
 
@@ -205,28 +1003,81 @@ def setup_handlers(web_app: tornado.web.Application, config: traitlets.config.Co
 
     log = log or logging.getLogger(__name__)
 
-    provider = PRConfig(config=config).provider
-    entry_point = MANAGERS.get(provider)
+    pr_config = PRConfig(config=config)
+    provider = pr_config.provider
+    entry_point = get_managers().get(provider)
     if entry_point is None:
         log.error(f"PR Manager: No manager defined for provider '{provider}'.")
         raise NotImplementedError()
-    manager_factory = entry_point.load()
-    log.info(f"PR Manager Class {manager_factory}")
-    try:
-        manager = manager_factory(config)
-    except Exception as err:
-        import traceback
-        logging.error("PR Manager Exception", exc_info=1)
-        raise err
+    manager = LazyManager(entry_point, config, log)
+    deadline = pr_config.request_deadline
+    if pr_config.warm_up:
+        tornado.ioloop.IOLoop.current().add_callback(manager.warm_up)
+
+    loop_lag_threshold = pr_config.loop_lag_threshold
+    if loop_lag_threshold > 0:
+        from .watchdog import LoopWatchdog
+
+        tornado.ioloop.IOLoop.current().add_callback(
+            LoopWatchdog(loop_lag_threshold).start
+        )
 
     handlers = [
         (
             url_path_join(base_url, pat),
             handler,
-            {"logger": log, "manager": manager},
+            {"logger": log, "manager": manager, "deadline": deadline},
         )
         for pat, handler in default_handlers
     ]
+    # Pollers are shared by all the events streams
+    pollers = PullRequestPollers(manager, pr_config.poll_interval)
+    handlers.append(
+        (
+            url_path_join(base_url, "prs/events"),
+            PullRequestsEventsHandler,
+            {
+                "logger": log,
+                "manager": manager,
+                "deadline": deadline,
+                "pollers": pollers,
+            },
+        )
+    )
+
+    comment_queue = None
+    if pr_config.comment_queue:
+        from .comment_queue import CommentQueue
+
+        comment_queue = CommentQueue(
+            manager, os.path.join(jupyter_runtime_dir(), COMMENT_QUEUE_FILENAME)
+        )
+        # Deliver the comments queued before the last stop
+        tornado.ioloop.IOLoop.current().add_callback(comment_queue.start)
+        handlers.append(
+            (
+                url_path_join(base_url, "files/comments/queue"),
+                PullRequestsCommentQueueHandler,
+                {
+                    "logger": log,
+                    "manager": manager,
+                    "deadline": deadline,
+                    "comment_queue": comment_queue,
+                },
+            )
+        )
+    handlers.append(
+        (
+            url_path_join(base_url, "files/comments"),
+            PullRequestsFileCommentsHandler,
+            {
+                "logger": log,
+                "manager": manager,
+                "deadline": deadline,
+                "comment_queue": comment_queue,
+            },
+        )
+    )
 
     log.debug(f"PR Handlers: {handlers}")
 
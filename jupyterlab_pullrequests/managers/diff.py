@@ -0,0 +1,182 @@
+"""Helpers to handle the unified diffs returned by the providers."""
+import difflib
+import re
+from bisect import bisect_right
+from typing import Dict, List, Optional, Union
+
+HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@ ?(.*)$")
+
+
+def parse_patch(patch: Optional[str]) -> List[Dict[str, Union[int, str, List[str]]]]:
+    """Split a unified diff in hunks.
+
+    Only the hunks are extracted; the file headers (``diff --git``, ``---``, ``+++``)
+    are not provided by the providers for a single file patch.
+
+    Args:
+        patch: Unified diff of a file
+    Returns:
+        The list of hunks; each hunk has the line ranges in the original and the new
+        versions and the diff lines (prefixed by ``" "``, ``"+"``, ``"-"`` or ``"\\"``)
+    """
+    hunks = []
+    hunk = None
+    for line in (patch or "").splitlines():
+        match = HUNK_HEADER.match(line)
+        if match is not None:
+            old_start, old_lines, new_start, new_lines, header = match.groups()
+            hunk = {
+                "oldStart": int(old_start),
+                "oldLines": 1 if old_lines is None else int(old_lines),
+                "newStart": int(new_start),
+                "newLines": 1 if new_lines is None else int(new_lines),
+                "header": header,
+                "lines": [],
+            }
+            hunks.append(hunk)
+        elif hunk is not None:
+            hunk["lines"].append(line)
+
+    return hunks
+
+
+def slice_lines(content: str, start: int, end: int) -> Dict[str, Union[int, List[str]]]:
+    """Extract a range of lines from a file content.
+
+    Args:
+        content: File content
+        start: First line to extract (1-based)
+        end: Last line to extract (included)
+    Returns:
+        The effective range, the extracted lines and the total number of lines
+    """
+    lines = content.splitlines()
+    start = max(start, 1)
+    end = min(end, len(lines))
+    return {
+        "start": start,
+        "end": end,
+        "lines": lines[start - 1 : end] if start <= end else [],
+        "totalLines": len(lines),
+    }
+
+
+class LineMapping:
+    """Mapping between the line numbers of the original and the new versions of a file.
+
+    It is built from the hunks of the file unified diff. The unchanged lines
+    are stored as sorted intervals; so a line number is mapped in O(log n)
+    with n the number of intervals.
+
+    Args:
+        hunks: The hunks of the file diff as returned by ``parse_patch``
+    """
+
+    def __init__(self, hunks: List[Dict[str, Union[int, str, List[str]]]]) -> None:
+        # Intervals of unchanged lines; the last one is unbounded
+        self._old_starts = []  # type: List[int]
+        self._new_starts = []  # type: List[int]
+        self._sizes = []  # type: List[Optional[int]]
+
+        old_line = 1
+        new_line = 1
+        for hunk in hunks:
+            # For an empty range, the start is the line before the hunk
+            old_start = hunk["oldStart"] + (0 if hunk["oldLines"] else 1)
+            new_start = hunk["newStart"] + (0 if hunk["newLines"] else 1)
+            self._add(old_line, new_line, old_start - old_line)
+            old_line = old_start
+            new_line = new_start
+            for line in hunk["lines"]:
+                if line.startswith("-"):
+                    old_line += 1
+                elif line.startswith("+"):
+                    new_line += 1
+                elif not line.startswith("\\"):
+                    self._add(old_line, new_line, 1)
+                    old_line += 1
+                    new_line += 1
+        self._add(old_line, new_line, None)
+
+    @classmethod
+    def from_contents(cls, original: str, new: str) -> "LineMapping":
+        """Build the mapping by diffing the two versions of a file.
+
+        Args:
+            original: Content of the original version
+            new: Content of the new version
+        Returns:
+            The line mapping
+        """
+        matcher = difflib.SequenceMatcher(
+            None, original.splitlines(), new.splitlines(), autojunk=False
+        )
+        hunks = []
+        for tag, old_start, old_end, new_start, new_end in matcher.get_opcodes():
+            if tag == "equal":
+                continue
+            old_lines = old_end - old_start
+            new_lines = new_end - new_start
+            # Unified diff ranges start at the line before when empty
+            hunks.append(
+                {
+                    "oldStart": old_start + (1 if old_lines else 0),
+                    "oldLines": old_lines,
+                    "newStart": new_start + (1 if new_lines else 0),
+                    "newLines": new_lines,
+                    "header": "",
+                    "lines": ["-"] * old_lines + ["+"] * new_lines,
+                }
+            )
+        return cls(hunks)
+
+    def _add(self, old_line: int, new_line: int, size: Optional[int]) -> None:
+        if size is not None and size <= 0:
+            return
+        if self._sizes:
+            last_size = self._sizes[-1]
+            if (
+                self._old_starts[-1] + last_size == old_line
+                and self._new_starts[-1] + last_size == new_line
+            ):
+                self._sizes[-1] = None if size is None else last_size + size
+                return
+        self._old_starts.append(old_line)
+        self._new_starts.append(new_line)
+        self._sizes.append(size)
+
+    @staticmethod
+    def _map(
+        line: int, starts: List[int], targets: List[int], sizes: List[Optional[int]]
+    ) -> Optional[int]:
+        index = bisect_right(starts, line) - 1
+        if index < 0:
+            return None
+        offset = line - starts[index]
+        if sizes[index] is not None and offset >= sizes[index]:
+            return None
+        return targets[index] + offset
+
+    def to_new(self, old_line: int) -> Optional[int]:
+        """Map a line of the original version to the new version.
+
+        Args:
+            old_line: Line number in the original version (1-based)
+        Returns:
+            The line number in the new version; None if the line is modified
+        """
+        return LineMapping._map(
+            old_line, self._old_starts, self._new_starts, self._sizes
+        )
+
+    def to_old(self, new_line: int) -> Optional[int]:
+        """Map a line of the new version to the original version.
+
+        Args:
+            new_line: Line number in the new version (1-based)
+        Returns:
+            The line number in the original version; None if the line is modified
+        """
+        return LineMapping._map(
+            new_line, self._new_starts, self._old_starts, self._sizes
+        )
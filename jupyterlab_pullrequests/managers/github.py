@@ -1,6 +1,9 @@
+import asyncio
+import base64
 import json
-from itertools import chain
-from typing import Dict, List, Optional, Tuple, Union
+from http import HTTPStatus
+from typing import AsyncIterator, Dict, List, Optional, Tuple, Union
+from urllib.parse import quote
 
 import traitlets
 from jupyter_server.utils import url_path_join
@@ -8,6 +11,7 @@ from tornado.httputil import url_concat
 from tornado.web import HTTPError
 
 from ..base import CommentReply, NewComment, PRConfig
+from .diff import parse_patch, slice_lines
 from .manager import PullRequestsManager
 
 
@@ -38,40 +42,210 @@ class GitHubManager(PullRequestsManager):
         Returns:
             JSON description of the user matching the access token
         """
-        git_url = url_path_join(self.base_api_url, "user")
-        data = await self._call_github(git_url, has_pagination=False)
+        if self._current_user is None:
+            git_url = url_path_join(self.base_api_url, "user")
+            data = await self._call_github(git_url, has_pagination=False)
+            self._current_user = {"username": data["login"]}
 
-        return {"username": data["login"]}
+        return self._current_user
 
-    async def get_file_diff(self, pr_id: str, filename: str) -> Dict[str, str]:
+    async def get_file_diff(
+        self, pr_id: str, filename: str, force: bool = False
+    ) -> Dict[str, str]:
         """Get the file diff for the pull request.
 
         Args:
             pr_id: pull request ID endpoint
             filename: The file name
+            force: Whether to download the content whatever its type and size
         Returns:
             The file diff description
         """
         pull_request = await self._get_pull_requests(pr_id)
-
-        base_content = await self.__get_content(
-            pull_request["base"]["repo"]["url"], filename, pull_request["base"]["sha"]
+        entry = await self._get_file_index(pr_id, filename)
+
+        base_file, head_file = await asyncio.gather(
+            *(
+                self._fetch_pipeline.run(
+                    pr_id,
+                    self.__get_file,
+                    pull_request[side]["repo"]["url"],
+                    self._get_file_path(entry, filename, side),
+                    pull_request[side]["sha"],
+                    force,
+                )
+                for side in ("base", "head")
+            )
         )
-        head_content = await self.__get_content(
-            pull_request["head"]["repo"]["url"], filename, pull_request["head"]["sha"]
+
+        return {
+            "base": {
+                "label": pull_request["base"]["label"],
+                "sha": pull_request["base"]["sha"],
+                **base_file,
+            },
+            "head": {
+                "label": pull_request["head"]["label"],
+                "sha": pull_request["head"]["sha"],
+                **head_file,
+            },
+        }
+
+    async def get_file_references(self, pr_id: str, filename: str) -> dict:
+        """Get the references to the file versions for the pull request.
+
+        Args:
+            pr_id: pull request ID endpoint
+            filename: The file name
+        Returns:
+            The file references description
+        """
+        pull_request = await self._get_pull_requests(pr_id)
+        entry = await self._get_file_index(pr_id, filename)
+
+        references = {}
+        for side in ("base", "head"):
+            path = self._get_file_path(entry, filename, side)
+            references[side] = {
+                "label": pull_request[side]["label"],
+                "sha": pull_request[side]["sha"],
+                "reference": None
+                if path is None
+                else {
+                    "repo": pull_request[side]["repo"]["url"],
+                    "sha": pull_request[side]["sha"],
+                    "path": path,
+                },
+            }
+        return references
+
+    async def get_file_raw(self, repo: str, sha: str, path: str) -> bytes:
+        """Get the raw content of a file at a given commit.
+
+        Args:
+            repo: The repository API url
+            sha: The commit SHA
+            path: The file path
+        Returns:
+            The file content
+        """
+        self._validate_raw_request(sha, path)
+        # Never send the access token outside of the provider API
+        if not repo.startswith(url_path_join(self.base_api_url, "repos") + "/"):
+            raise HTTPError(
+                status_code=HTTPStatus.BAD_REQUEST,
+                reason=f"Invalid parameter 'repo'. Expected a repository of {self.base_api_url}, received '{repo}'.",
+            )
+
+        link = url_concat(url_path_join(repo, "contents", quote(path)), {"ref": sha})
+        headers = {
+            "Accept": "application/vnd.github.v3.raw",
+            "Authorization": f"token {self._config.access_token}",
+        }
+        content, _ = await self._fetch_pipeline.run(
+            repo, self._request, link, load_json=False, headers=headers, raw=True
         )
+        return content
+
+    async def get_file_patch(self, pr_id: str, filename: str) -> dict:
+        """Get the hunks of the file diff for the pull request.
+
+        Args:
+            pr_id: pull request ID endpoint
+            filename: The file name
+        Returns:
+            The file diff description
+        """
+        entry = await self._get_file_index(pr_id, filename)
+        patch = None if entry is None else entry["patch"]
+        if not patch:
+            # GitHub does not provide the patch for binary files or large diffs
+            return await self.get_file_diff(pr_id, filename)
 
+        pull_request = await self._get_pull_requests(pr_id)
         return {
             "base": {
                 "label": pull_request["base"]["label"],
                 "sha": pull_request["base"]["sha"],
-                "content": base_content,
             },
             "head": {
                 "label": pull_request["head"]["label"],
                 "sha": pull_request["head"]["sha"],
-                "content": head_content,
             },
+            "hunks": parse_patch(patch),
+        }
+
+    async def get_file_context(
+        self, pr_id: str, filename: str, side: str, start: int, end: int
+    ) -> dict:
+        """Get a range of lines of one version of a file.
+
+        Args:
+            pr_id: pull request ID endpoint
+            filename: The file name
+            side: The file version; ``base`` or ``head``
+            start: First line (1-based)
+            end: Last line (included)
+        Returns:
+            The lines range description
+        """
+        pull_request = await self._get_pull_requests(pr_id)
+        path = self._get_file_path(
+            await self._get_file_index(pr_id, filename), filename, side
+        )
+        content = (
+            ""
+            if path is None
+            else await self._fetch_pipeline.run(
+                pr_id,
+                self.__get_content,
+                pull_request[side]["repo"]["url"],
+                path,
+                pull_request[side]["sha"],
+            )
+        )
+        return slice_lines(content, start, end)
+
+    async def get_pull_request_status(self, pr_id: str) -> Dict[str, Union[str, int]]:
+        """Get the current status of a pull request.
+
+        Args:
+            pr_id: pull request ID endpoint
+        Returns:
+            The pull request status as
+            {"headSha": str, "state": str, "commentsCount": int, "updatedAt": str}
+        """
+        # Conditional requests do not count against GitHub rate limit when not modified
+        pull_request = await self._call_github(
+            pr_id, has_pagination=False, conditional=True
+        )
+        previous = self._pull_requests_cache.get(pr_id)
+        if previous is not None and previous["head"]["sha"] != pull_request["head"]["sha"]:
+            # The modified files may have changed
+            self._drop_files_index(pr_id)
+        self._pull_requests_cache[pr_id] = pull_request
+        state = pull_request["state"]
+        if pull_request.get("merged"):
+            state = "merged"
+        return {
+            "headSha": pull_request["head"]["sha"],
+            "state": state,
+            "commentsCount": pull_request["comments"] + pull_request["review_comments"],
+            "updatedAt": pull_request["updated_at"],
+        }
+
+    async def get_revisions(self, pr_id: str) -> Dict[str, str]:
+        """Get the base and head commit SHAs of a pull request.
+
+        Args:
+            pr_id: pull request ID endpoint
+        Returns:
+            The base and head SHAs
+        """
+        pull_request = await self._get_pull_requests(pr_id)
+        return {
+            "base": pull_request["base"]["sha"],
+            "head": pull_request["head"]["sha"],
         }
 
     def get_search_filter(self, username: str, pr_filter: str) -> str:
@@ -149,61 +323,110 @@ class GitHubManager(PullRequestsManager):
                 for thread in threads
             ]
 
-    async def list_files(self, pr_id: str) -> List[Dict[str, str]]:
-        """Get the list of modified files for a pull request.
+    async def iter_files(
+        self, pr_id: str, start: int = 0
+    ) -> AsyncIterator[List[Dict[str, str]]]:
+        """Iterate over the modified files of a pull request page per page.
 
         Args:
             pr_id: pull request ID endpoint
+            start: Index of the first file
         Returns:
-            The list of modified files
+            Iterator on the lists of modified files
         """
         git_url = url_path_join(pr_id, "/files")
-        results = await self._call_github(git_url)
+        params, skip = self._get_start_page(start)
 
-        data = []
-        for result in results:
-            data.append(
-                {
-                    "name": result["filename"],
+        async for results in self._iter_github(git_url, params):
+            results, skip = results[skip:], 0
+            data = []
+            index = {}
+            for result in results:
+                data.append(
+                    {
+                        "name": result["filename"],
+                        "status": result["status"],
+                    }
+                )
+                index[result["filename"]] = {
                     "status": result["status"],
+                    "previous_name": result.get("previous_filename"),
+                    "sha": result.get("sha"),
+                    "additions": result.get("additions", 0),
+                    "deletions": result.get("deletions", 0),
+                    "patch": result.get("patch"),
                 }
-            )
+            self._files_index.setdefault(pr_id, {}).update(index)
+            yield data
+
+        # All files are indexed once listed from the first one
+        if start == 0:
+            self._files_indexed.add(pr_id)
+
+    async def list_files(self, pr_id: str) -> List[Dict[str, str]]:
+        """Get the list of modified files for a pull request.
 
+        Args:
+            pr_id: pull request ID endpoint
+        Returns:
+            The list of modified files
+        """
+        data = []
+        async for page in self.iter_files(pr_id):
+            data.extend(page)
         return data
 
-    async def list_prs(self, username: str, pr_filter: str) -> List[Dict[str, str]]:
-        """Returns the list of pull requests for the given user.
+    async def iter_prs(
+        self, username: str, pr_filter: str, start: int = 0
+    ) -> AsyncIterator[List[Dict[str, str]]]:
+        """Iterate over the pull requests of the given user page per page.
 
         Args:
             username: User ID for the versioning service
             pr_filter: Filter to add to the pull requests requests
+            start: Index of the first pull request
         Returns:
-            The list of pull requests
+            Iterator on the lists of pull requests
         """
         search_filter = self.get_search_filter(username, pr_filter)
+        params, skip = self._get_start_page(start)
 
         # Use search API to find matching pull requests and return
         git_url = url_path_join(
             self.base_api_url, "/search/issues?q=+state:open+type:pr" + search_filter
         )
 
-        results = await self._call_github(git_url)
-
-        data = []
-        for result in chain(*map(lambda r: r["items"], results)):
-            data.append(
-                {
-                    "id": result["pull_request"]["url"],
-                    "title": result["title"],
-                    "body": result["body"],
-                    "internalId": result["id"],
-                    "link": result["html_url"],
-                }
-            )
-
         # Reset cache
         self._pull_requests_cache = {}
+        self._drop_files_index()
 
+        async for results in self._iter_github(git_url, params):
+            results, skip = results["items"][skip:], 0
+            data = []
+            for result in results:
+                data.append(
+                    {
+                        "id": result["pull_request"]["url"],
+                        "title": result["title"],
+                        "body": result["body"],
+                        "internalId": result["id"],
+                        "link": result["html_url"],
+                    }
+                )
+            yield data
+
+    async def list_prs(self, username: str, pr_filter: str) -> List[Dict[str, str]]:
+        """Returns the list of pull requests for the given user.
+
+        Args:
+            username: User ID for the versioning service
+            pr_filter: Filter to add to the pull requests requests
+        Returns:
+            The list of pull requests
+        """
+        data = []
+        async for page in self.iter_prs(username, pr_filter):
+            data.extend(page)
         return data
 
     async def post_comment(
@@ -240,6 +463,53 @@ class GitHubManager(PullRequestsManager):
 
         return GitHubManager._response_to_comment(response)
 
+    async def post_review(
+        self,
+        pr_id: str,
+        comments: List[Union[CommentReply, NewComment]],
+        text: Optional[str] = None,
+    ) -> None:
+        """Send several comments on a pull request as a single review.
+
+        GitHub reviews only contain new comments on files; replies and pull
+        request comments are posted one by one.
+
+        Args:
+            pr_id: pull request ID endpoint
+            comments: The comments; the sent ones are removed
+            text: The review summary; None if no summary
+        """
+        review_comments = []
+        others = []
+        for body in comments:
+            if isinstance(body, NewComment) and body.filename is not None:
+                review_comments.append(body)
+            else:
+                others.append(body)
+
+        if review_comments or text:
+            data = {
+                "commit_id": (await self._get_pull_requests(pr_id))["head"]["sha"],
+                "event": "COMMENT",
+                "comments": [
+                    {
+                        "body": body.text,
+                        "path": body.filename,
+                        "line": body.line or body.originalLine,
+                        "side": "RIGHT" if body.line is not None else "LEFT",
+                    }
+                    for body in review_comments
+                ],
+            }
+            if text:
+                data["body"] = text
+            await self._call_github(
+                url_path_join(pr_id, "reviews"), method="POST", body=data
+            )
+            comments[:] = others
+
+        await super().post_review(pr_id, comments)
+
     async def _call_github(
         self,
         url: str,
@@ -249,7 +519,9 @@ class GitHubManager(PullRequestsManager):
         params: Optional[Dict[str, str]] = None,
         media_type: str = "application/vnd.github.v3+json",
         has_pagination: bool = True,
-    ) -> Union[dict, str]:
+        conditional: bool = False,
+        raw: bool = False,
+    ) -> Union[dict, str, bytes]:
         """Call GitHub
 
         The request is presumed to support pagination by default if
@@ -265,9 +537,12 @@ class GitHubManager(PullRequestsManager):
             params: Query arguments as dictionary; None if no arguments
             media_type: Type of accepted content
             has_pagination: Whether the pagination query arguments should be appended
+            conditional: Whether to send a conditional request
+            raw: Whether to return the response body bytes
         Returns:
             List or Dict: Create from JSON response body if load_json is True
             str: Raw response body if load_json is False
+            bytes: Response body if raw is True
         """
         headers = {
             "Accept": media_type,
@@ -282,8 +557,31 @@ class GitHubManager(PullRequestsManager):
             params=params,
             headers=headers,
             has_pagination=has_pagination,
+            conditional=conditional,
+            raw=raw,
         )
 
+    def _iter_github(
+        self,
+        url: str,
+        params: Optional[Dict[str, str]] = None,
+        media_type: str = "application/vnd.github.v3+json",
+    ) -> AsyncIterator[Union[dict, list]]:
+        """Iterate over the pages of a GitHub GET request.
+
+        Args:
+            url: Endpoint to request
+            params: Query arguments as dictionary; None if no arguments
+            media_type: Type of accepted content
+        Returns:
+            Iterator on the JSON response body of each page
+        """
+        headers = {
+            "Accept": media_type,
+            "Authorization": f"token {self._config.access_token}",
+        }
+        return super()._iter_provider(url, params=params, headers=headers)
+
     async def _get_pull_requests(self, pr_id: str) -> dict:
         """Get a single pull request information.
 
@@ -319,17 +617,81 @@ class GitHubManager(PullRequestsManager):
         }
         return data
 
-    async def __get_content(self, url: str, filename: str, sha: str) -> str:
+    async def __get_content(
+        self, url: str, filename: str, sha: str, raw: bool = False
+    ) -> Union[str, bytes]:
         link = url_concat(
             url_path_join(url, "contents", filename),
             {"ref": sha},
         )
         try:
             return await self._call_github(
-                link, media_type="application/vnd.github.v3.raw", load_json=False
+                link,
+                media_type="application/vnd.github.v3.raw",
+                load_json=False,
+                raw=raw,
             )
         except HTTPError as e:
             if e.status_code == 404:
-                return ""
+                return b"" if raw else ""
             else:
                 raise e
+
+    async def __get_file(
+        self, url: str, filename: Optional[str], sha: str, force: bool = False
+    ) -> dict:
+        """Get a file content unless it is binary or too large.
+
+        The file metadata are requested first with the object media type;
+        GitHub inlines the content in them for files up to 1 MB.
+
+        Args:
+            url: The repository API url
+            filename: The file name; None if the file does not exist in that version
+            sha: The commit SHA
+            force: Whether to download the content whatever its type and size
+        Returns:
+            {"content": str} or {"content": None, "skipped": dict}
+        """
+        if filename is None:
+            return {"content": ""}
+
+        if force:
+            return {"content": await self.__get_content(url, filename, sha)}
+
+        skipped = self._skip_content(filename)
+        if skipped is not None:
+            return {"content": None, "skipped": skipped}
+
+        link = url_concat(
+            url_path_join(url, "contents", filename),
+            {"ref": sha},
+        )
+        try:
+            # Only the object media type describes the files from 1 MB to 100 MB;
+            # the default one is rejected with 403 too_large
+            metadata = await self._call_github(
+                link, media_type="application/vnd.github.object", has_pagination=False
+            )
+        except HTTPError as e:
+            if e.status_code == 404:
+                return {"content": ""}
+            else:
+                raise e
+
+        size = metadata.get("size")
+        if metadata.get("encoding") == "base64":
+            content = base64.b64decode(metadata["content"])
+            skipped = self._skip_content(filename, size, content)
+            if skipped is None:
+                try:
+                    return {"content": content.decode("utf-8")}
+                except UnicodeDecodeError:
+                    skipped = {"reason": "binary", "size": size}
+        else:
+            skipped = self._skip_content(filename, size)
+            if skipped is None:
+                content = await self.__get_content(url, filename, sha, raw=True)
+                return self._decode_content(filename, content)
+
+        return {"content": None, "skipped": skipped}
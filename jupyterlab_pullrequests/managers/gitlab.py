@@ -1,40 +1,46 @@
 import asyncio
-import difflib
 import http
 import json
-import re
-from hashlib import sha1
-from itertools import chain
-from typing import Dict, List, Optional, Tuple, Union
+from typing import AsyncIterator, Dict, List, Optional, Tuple, Union
 from urllib.parse import quote
 
 import traitlets
 from jupyter_server.utils import url_path_join
-from packaging.version import parse
+from packaging.version import InvalidVersion, parse
 from tornado.httputil import url_concat
 from tornado.web import HTTPError
 
 from ..base import CommentReply, NewComment, PRConfig
 from ..log import get_logger
+from .diff import LineMapping, parse_patch, slice_lines
 from .manager import PullRequestsManager
 
-INVALID_LINE_CODE = re.compile(r'line_code=>\[.*"must be a valid line code".*\]')
-
 
 class GitLabManager(PullRequestsManager):
     """Pull request manager for GitLab."""
 
     MINIMAL_VERSION = "13.1"  # Due to pagination https://docs.gitlab.com/ee/api/README.html#pagination
+    KEYSET_VERSION = "14.0"  # Keyset pagination https://docs.gitlab.com/ee/api/index.html#keyset-based-pagination
+    DIFFS_VERSION = "15.7"  # Paginated merge request diffs https://docs.gitlab.com/ee/api/merge_requests.html#list-merge-request-diffs
+    DRAFT_NOTES_VERSION = "16.0"  # Draft notes publication https://docs.gitlab.com/ee/api/draft_notes.html
 
     def __init__(self, config: traitlets.config.Config) -> None:
         super().__init__(PRConfig(config=config))
 
         # Creating new file discussion required some commit sha's so we will cache them
         self._merge_requests_cache = {}  # Dict[str, Dict]
+        # Discussions per merge request: (validator, threads per file name)
+        self._discussions_cache = {}  # Dict[str, Tuple[tuple, Dict[Optional[str], List[dict]]]]
+        # Resources for which keyset pagination was refused
+        self._keyset_unsupported = set()  # Set[str]
+        # Server version; None if unknown
+        self._server_version = None  # Optional[Version]
+        # Whether the server version was requested
+        self._server_version_checked = False
         # Creating discussion on unmodified line requires to figure out the line number
-        # in the diff file for the original and the new file using Myers algorithm. So
-        # we cache the diff to speed up the process.
-        self._file_diff_cache = {}  # Dict[Tuple[str, str], List[difflib.Match]]
+        # in the original and the new file. So we cache the line mapping built from
+        # the file diff; the key is (pr_id, filename, base_sha, head_sha, start_sha).
+        self._line_mapping_cache = {}  # Dict[Tuple[str, ...], LineMapping]
 
     @property
     def base_api_url(self):
@@ -58,7 +64,13 @@ class GitLabManager(PullRequestsManager):
         """
         url = url_path_join(self.base_api_url, "version")
         data = await self._call_gitlab(url, has_pagination=False)
+        self._server_version_checked = True
         server_version = data.get("version", "")
+        try:
+            # Drop the edition suffix; e.g. 15.7.0-ee
+            self._server_version = parse(server_version.split("-")[0])
+        except InvalidVersion:
+            self._server_version = None
         is_valid = True
         if server_version.split(".") < GitLabManager.MINIMAL_VERSION.split("."):
             is_valid = False
@@ -69,53 +81,246 @@ class GitLabManager(PullRequestsManager):
 
         return is_valid
 
+    async def _supports(self, version: str) -> bool:
+        """Whether the server version is known and at least ``version``.
+
+        The server version is requested on first use.
+
+        Args:
+            version: Minimal server version
+        Returns:
+            Whether the server version is higher or equal to version
+        """
+        if not self._server_version_checked:
+            try:
+                await self.check_server_version()
+            except HTTPError as error:
+                self.log.debug("Failed to get the GitLab server version", exc_info=error)
+        return self._server_version is not None and self._server_version >= parse(
+            version
+        )
+
     async def get_current_user(self) -> Dict[str, str]:
         """Get the current user information.
 
         Returns:
             JSON description of the user matching the access token
         """
-        # Check server compatibility
-        await self.check_server_version()
+        if self._current_user is None:
+            # Check server compatibility
+            await self.check_server_version()
 
-        git_url = url_path_join(self.base_api_url, "user")
-        data = await self._call_gitlab(git_url, has_pagination=False)
+            git_url = url_path_join(self.base_api_url, "user")
+            data = await self._call_gitlab(git_url, has_pagination=False)
+            self._current_user = {"username": data["username"]}
 
-        return {"username": data["username"]}
+        return self._current_user
 
-    async def get_file_diff(self, pr_id: str, filename: str) -> Dict[str, str]:
+    async def get_file_diff(
+        self, pr_id: str, filename: str, force: bool = False
+    ) -> Dict[str, str]:
         """Get the file diff for the pull request.
 
         Args:
             pr_id: pull request ID endpoint
             filename: The file name
+            force: Whether to download the content whatever its type and size
         Returns:
             The file diff description
         """
         merge_request = await self._get_merge_requests(pr_id)
+        entry = await self._get_file_index(pr_id, filename)
+
+        base_file, head_file = await asyncio.gather(
+            *(
+                self._fetch_pipeline.run(
+                    pr_id,
+                    self.__get_file,
+                    merge_request[project],
+                    self._get_file_path(entry, filename, side),
+                    merge_request["diff_refs"][f"{side}_sha"],
+                    force,
+                )
+                for side, project in (
+                    ("base", "target_project_id"),
+                    ("head", "source_project_id"),
+                )
+            )
+        )
+
+        return {
+            "base": {
+                "label": merge_request["target_branch"],
+                "sha": merge_request["diff_refs"]["base_sha"],
+                **base_file,
+            },
+            "head": {
+                "label": merge_request["source_branch"],
+                "sha": merge_request["diff_refs"]["head_sha"],
+                **head_file,
+            },
+        }
+
+    async def get_file_references(self, pr_id: str, filename: str) -> dict:
+        """Get the references to the file versions for the pull request.
+
+        Args:
+            pr_id: pull request ID endpoint
+            filename: The file name
+        Returns:
+            The file references description
+        """
+        merge_request = await self._get_merge_requests(pr_id)
+        entry = await self._get_file_index(pr_id, filename)
+
+        references = {}
+        for side, project, branch in (
+            ("base", "target_project_id", "target_branch"),
+            ("head", "source_project_id", "source_branch"),
+        ):
+            path = self._get_file_path(entry, filename, side)
+            sha = merge_request["diff_refs"][f"{side}_sha"]
+            references[side] = {
+                "label": merge_request[branch],
+                "sha": sha,
+                "reference": None
+                if path is None
+                else {"repo": str(merge_request[project]), "sha": sha, "path": path},
+            }
+        return references
+
+    async def get_file_raw(self, repo: str, sha: str, path: str) -> bytes:
+        """Get the raw content of a file at a given commit.
 
-        # Invalid diff cache
-        self._file_diff_cache[(pr_id, filename)] = None
+        Args:
+            repo: The project ID
+            sha: The commit SHA
+            path: The file path
+        Returns:
+            The file content
+        """
+        self._validate_raw_request(sha, path)
+        if not repo.isdigit():
+            raise HTTPError(
+                status_code=http.HTTPStatus.BAD_REQUEST,
+                reason=f"Invalid parameter 'repo'. Expected a project ID, received '{repo}'.",
+            )
+
+        url = url_concat(
+            url_path_join(
+                self.base_api_url,
+                "projects",
+                repo,
+                "repository/files",
+                quote(path, safe=""),
+                "raw",
+            ),
+            {"ref": sha},
+        )
+        headers = {"Authorization": f"Bearer {self._config.access_token}"}
+        content, _ = await self._fetch_pipeline.run(
+            repo, self._request, url, load_json=False, headers=headers, raw=True
+        )
+        return content
+
+    async def get_file_patch(self, pr_id: str, filename: str) -> dict:
+        """Get the hunks of the file diff for the pull request.
+
+        Args:
+            pr_id: pull request ID endpoint
+            filename: The file name
+        Returns:
+            The file diff description
+        """
+        entry = await self._get_file_index(pr_id, filename)
+        patch = None if entry is None else entry["patch"]
+        if not patch:
+            # GitLab empties the diff of too large or collapsed files
+            return await self.get_file_diff(pr_id, filename)
 
+        merge_request = await self._get_merge_requests(pr_id)
         return {
             "base": {
                 "label": merge_request["target_branch"],
                 "sha": merge_request["diff_refs"]["base_sha"],
-                "content": await self.__get_content(
-                    merge_request["target_project_id"],
-                    filename,
-                    merge_request["diff_refs"]["base_sha"],
-                ),
             },
             "head": {
                 "label": merge_request["source_branch"],
                 "sha": merge_request["diff_refs"]["head_sha"],
-                "content": await self.__get_content(
-                    merge_request["source_project_id"],
-                    filename,
-                    merge_request["diff_refs"]["head_sha"],
-                ),
             },
+            "hunks": parse_patch(patch),
+        }
+
+    async def get_file_context(
+        self, pr_id: str, filename: str, side: str, start: int, end: int
+    ) -> dict:
+        """Get a range of lines of one version of a file.
+
+        Args:
+            pr_id: pull request ID endpoint
+            filename: The file name
+            side: The file version; ``base`` or ``head``
+            start: First line (1-based)
+            end: Last line (included)
+        Returns:
+            The lines range description
+        """
+        merge_request = await self._get_merge_requests(pr_id)
+        project_id = merge_request[
+            "target_project_id" if side == "base" else "source_project_id"
+        ]
+        path = self._get_file_path(
+            await self._get_file_index(pr_id, filename), filename, side
+        )
+        content = (
+            ""
+            if path is None
+            else await self._fetch_pipeline.run(
+                pr_id,
+                self.__get_content,
+                project_id,
+                path,
+                merge_request["diff_refs"][f"{side}_sha"],
+            )
+        )
+        return slice_lines(content, start, end)
+
+    async def get_pull_request_status(self, pr_id: str) -> Dict[str, Union[str, int]]:
+        """Get the current status of a pull request.
+
+        Args:
+            pr_id: pull request ID endpoint
+        Returns:
+            The pull request status as
+            {"headSha": str, "state": str, "commentsCount": int, "updatedAt": str}
+        """
+        merge_request = await self._call_gitlab(
+            pr_id, has_pagination=False, conditional=True
+        )
+        previous = self._merge_requests_cache.get(pr_id)
+        if previous is not None and previous["sha"] != merge_request["sha"]:
+            # The modified files may have changed
+            self._drop_files_index(pr_id)
+        self._merge_requests_cache[pr_id] = merge_request
+        return {
+            "headSha": merge_request["sha"],
+            "state": merge_request["state"],
+            "commentsCount": merge_request["user_notes_count"],
+            "updatedAt": merge_request["updated_at"],
+        }
+
+    async def get_revisions(self, pr_id: str) -> Dict[str, str]:
+        """Get the base and head commit SHAs of a merge request.
+
+        Args:
+            pr_id: pull request ID endpoint
+        Returns:
+            The base and head SHAs
+        """
+        merge_request = await self._get_merge_requests(pr_id)
+        return {
+            "base": merge_request["diff_refs"]["base_sha"],
+            "head": merge_request["diff_refs"]["head_sha"],
         }
 
     def get_search_filter(self, username: str, pr_filter: str) -> str:
@@ -145,42 +350,147 @@ class GitLabManager(PullRequestsManager):
         Returns:
             The discussions
         """
-        git_url = url_path_join(pr_id, "/discussions")
-        results = await self._call_gitlab(git_url)
-        discussions = []
+        validator = self._discussions_validator(await self._get_merge_requests(pr_id))
+        cached = self._discussions_cache.get(pr_id)
+        if cached is None or cached[0] != validator:
+            git_url = url_path_join(pr_id, "/discussions")
+            results = []
+            async for page in self._iter_gitlab(git_url, keyset="discussions", sort="asc"):
+                results.extend(page)
+            cached = (validator, self._index_discussions(pr_id, results))
+            self._discussions_cache[pr_id] = cached
+
+        return list(cached[1].get(filename, []))
+
+    @staticmethod
+    def _discussions_validator(merge_request: dict) -> tuple:
+        """Get the merge request fields changing when its discussions change.
+
+        Args:
+            merge_request: The merge request returned by GitLab
+        Returns:
+            The head SHA, the number of notes and the last update time
+        """
+        return (
+            merge_request["sha"],
+            merge_request["user_notes_count"],
+            merge_request["updated_at"],
+        )
+
+    @staticmethod
+    def _index_discussions(
+        pr_id: str, results: List[dict]
+    ) -> Dict[Optional[str], List[dict]]:
+        """Partition the discussions of a merge request per file.
+
+        Args:
+            pr_id: pull request ID endpoint
+            results: The discussions returned by GitLab
+        Returns:
+            The threads per file name; the key None holds the discussions on the pull request
+        """
+        index = {}  # type: Dict[Optional[str], List[dict]]
         for discussion in results:
-            thread = dict(
-                id=discussion["id"],
-                comments=[],
-                filename=filename,
-                line=None,
-                originalLine=None,
-                pullRequestId=pr_id,
-            )
+            filename = None
+            thread = None
             for note in discussion["notes"]:
-                if (
-                    filename is None
-                    and note["type"] != "DiffNote"
-                    # Remove auto comment on commit
-                    and "[Compare with previous version]" not in note["body"]
-                ):
-                    thread["comments"].append(GitLabManager._response_to_comment(note))
-                elif (
-                    note["type"] == "DiffNote"
-                    and (note["position"]["new_path"] or note["position"]["new_path"])
-                    == filename
-                ):
+                if note["type"] == "DiffNote":
+                    note_filename = (
+                        note["position"]["new_path"] or note["position"]["old_path"]
+                    )
+                # Remove auto comment on commit
+                elif "[Compare with previous version]" not in note["body"]:
+                    note_filename = None
+                else:
+                    break
+
+                if thread is None:
+                    filename = note_filename
+                    thread = dict(
+                        id=discussion["id"],
+                        comments=[],
+                        filename=filename,
+                        line=None,
+                        originalLine=None,
+                        pullRequestId=pr_id,
+                    )
+                elif note_filename != filename:
+                    break
+
+                if filename is not None:
                     if thread["line"] is None:
                         thread["line"] = note["position"]["new_line"]
                     if thread["originalLine"] is None:
                         thread["originalLine"] = note["position"]["old_line"]
-                    thread["comments"].append(GitLabManager._response_to_comment(note))
-                else:
-                    break
+                thread["comments"].append(GitLabManager._response_to_comment(note))
             else:
-                discussions.append(thread)
+                if thread is not None:
+                    index.setdefault(filename, []).append(thread)
+
+        return index
 
-        return discussions
+    async def iter_files(
+        self, pr_id: str, start: int = 0
+    ) -> AsyncIterator[List[Dict[str, str]]]:
+        """Iterate over the modified files of a pull request page per page.
+
+        Args:
+            pr_id: pull request ID endpoint
+            start: Index of the first file
+        Returns:
+            Iterator on the lists of modified files
+        """
+        if await self._supports(GitLabManager.DIFFS_VERSION):
+            # Paginated diffs are not truncated and do not come with the merge request description
+            params, skip = self._get_start_page(start)
+            pages = self._iter_gitlab(url_path_join(pr_id, "diffs"), params)
+        elif pr_id in self._files_indexed and start > 0:
+            # The changes of all files were fetched to list the first ones
+            yield [
+                {"name": name, "status": entry["status"]}
+                for name, entry in list(self._files_index[pr_id].items())[start:]
+            ]
+            return
+        else:
+            # All files come at once; they are all indexed whatever the start
+            skip = start
+            pages = self._iter_gitlab(url_path_join(pr_id, "changes"))
+
+        async for page in pages:
+            results = page if isinstance(page, list) else page["changes"]
+            index = {}
+            for result in results:
+                status = "modified"
+                if result["new_file"]:
+                    status = "added"
+                elif result["renamed_file"]:
+                    status = "renamed"
+                elif result["deleted_file"]:
+                    status = "removed"
+
+                # The diff is kept as is; it is only parsed if the file is opened
+                index[result["new_path"]] = {
+                    "status": status,
+                    "previous_name": result["old_path"] if result["renamed_file"] else None,
+                    "sha": None,
+                    "additions": None,
+                    "deletions": None,
+                    "patch": result["diff"],
+                }
+            self._files_index.setdefault(pr_id, {}).update(index)
+            if not isinstance(page, list):
+                # The changes of all files come in a single response
+                self._files_indexed.add(pr_id)
+            data = [
+                {"name": name, "status": entry["status"]}
+                for name, entry in list(index.items())[skip:]
+            ]
+            skip = max(skip - len(index), 0)
+            yield data
+
+        # All files are indexed once listed from the first one
+        if start == 0:
+            self._files_indexed.add(pr_id)
 
     async def list_files(self, pr_id: str) -> List[Dict[str, str]]:
         """Get the list of modified files for a pull request.
@@ -190,69 +500,79 @@ class GitLabManager(PullRequestsManager):
         Returns:
             The list of modified files
         """
-
-        git_url = url_path_join(pr_id, "changes")
-        results = await self._call_gitlab(git_url)
-
         data = []
-        for result in chain(*map(lambda r: r["changes"], results)):
-            status = "modified"
-            if result["new_file"]:
-                status = "added"
-            elif result["renamed_file"]:
-                status = "renamed"
-            elif result["deleted_file"]:
-                status = "removed"
-
-            data.append(
-                {
-                    "name": result["new_path"],
-                    "status": status,
-                }
-            )
-
+        async for page in self.iter_files(pr_id):
+            data.extend(page)
         return data
 
-    async def list_prs(self, username: str, pr_filter: str) -> List[Dict[str, str]]:
-        """Returns the list of pull requests for the given user.
+    async def iter_prs(
+        self, username: str, pr_filter: str, start: int = 0
+    ) -> AsyncIterator[List[Dict[str, str]]]:
+        """Iterate over the pull requests of the given user page per page.
 
         Args:
             username: User ID for the versioning service
             pr_filter: Filter to add to the pull requests requests
+            start: Index of the first pull request
         Returns:
-            The list of pull requests
+            Iterator on the lists of pull requests
         """
         search_filter = self.get_search_filter(username, pr_filter)
+        params, skip = self._get_start_page(start)
 
         # Use search API to find matching pull requests and return
         git_url = url_path_join(
             self.base_api_url, "/merge_requests?state=opened&" + search_filter
         )
 
-        results = await self._call_gitlab(git_url)
-
-        data = []
-        for result in results:
-            url = url_path_join(
-                self.base_api_url,
-                "projects",
-                str(result["project_id"]),
-                "merge_requests",
-                str(result["iid"]),
-            )
-            data.append(
-                {
-                    "id": url,
-                    "title": result["title"],
-                    "body": result["description"],
-                    "internalId": result["id"],
-                    "link": result["web_url"],
-                }
-            )
-
         # Reset cache
         self._merge_requests_cache = {}
+        self._drop_files_index()
+        self._line_mapping_cache = {}
+        self._discussions_cache = {}
+
+        # Keyset pagination cannot start at an arbitrary page; the newest
+        # merge requests come first with both paginations
+        pages = self._iter_gitlab(
+            git_url,
+            params,
+            keyset="merge_requests" if start == 0 else None,
+            sort="desc",
+        )
+        async for results in pages:
+            results, skip = results[skip:], 0
+            data = []
+            for result in results:
+                url = url_path_join(
+                    self.base_api_url,
+                    "projects",
+                    str(result["project_id"]),
+                    "merge_requests",
+                    str(result["iid"]),
+                )
+                data.append(
+                    {
+                        "id": url,
+                        "title": result["title"],
+                        "body": result["description"],
+                        "internalId": result["id"],
+                        "link": result["web_url"],
+                    }
+                )
+            yield data
+
+    async def list_prs(self, username: str, pr_filter: str) -> List[Dict[str, str]]:
+        """Returns the list of pull requests for the given user.
 
+        Args:
+            username: User ID for the versioning service
+            pr_filter: Filter to add to the pull requests requests
+        Returns:
+            The list of pull requests
+        """
+        data = []
+        async for page in self.iter_prs(username, pr_filter):
+            data.extend(page)
         return data
 
     async def post_comment(
@@ -267,6 +587,8 @@ class GitLabManager(PullRequestsManager):
             The created comment
         """
         filename = body.filename
+        # Invalid the discussions cache
+        self._discussions_cache.pop(pr_id, None)
 
         if isinstance(body, CommentReply):
             data = {"body": body.text}
@@ -275,75 +597,81 @@ class GitLabManager(PullRequestsManager):
             return GitLabManager._response_to_comment(response)
         else:
             data = {"body": body.text}
-            if body.line is not None:
-                data["position"] = {
-                    "position_type": "text",
-                    "new_line": body.line,
-                    "new_path": filename,
-                }
-                data["position"].update(
-                    (await self._get_merge_requests(pr_id))["diff_refs"]
-                )
-            elif body.originalLine is not None:
-                data["position"] = {
-                    "position_type": "text",
-                    "old_line": body.originalLine,
-                    "old_path": filename,
-                }
-                data["position"].update(
-                    (await self._get_merge_requests(pr_id))["diff_refs"].copy()
+            if body.line is not None or body.originalLine is not None:
+                data["position"] = await self._get_position(
+                    pr_id, filename, body.line, body.originalLine
                 )
             else:
                 data["commit_id"] = (await self._get_merge_requests(pr_id))["sha"]
 
             git_url = url_path_join(pr_id, "discussions")
-
-            try:
-                response = await self._call_gitlab(git_url, method="POST", body=data)
-            except HTTPError as error:
-                if (
-                    filename is not None
-                    and error.status_code == http.HTTPStatus.BAD_REQUEST
-                    and INVALID_LINE_CODE.search(error.reason) is not None
-                ):
-                    # When targeting an unmodified line to create a thread, both line and original line needs
-                    # to be passed. So GitLab can compute the infamous line_code that otherwise shows up
-                    # in the unfriendly error message.
-                    #
-                    # To hopefully get a similar diff than GitLab, we start over from the file content. And we
-                    # apply the Myers algorithm
-                    matches = await self._get_file_diff(pr_id, filename)
-                    new_line = body.line
-                    old_line = body.originalLine
-                    if body.line is None:
-                        for m in matches:
-                            if old_line < m.a or old_line >= m.a + m.size:
-                                continue
-                            new_line = old_line - m.a + m.b
-                            break
-                    elif body.originalLine is None:
-                        for m in matches:
-                            if new_line < m.b or new_line >= m.b + m.size:
-                                continue
-                            old_line = new_line + m.a - m.b
-                            break
-
-                    data["position"]["new_line"] = new_line
-                    data["position"]["new_path"] = filename
-                    data["position"]["old_line"] = old_line
-                    data["position"]["old_path"] = None
-
-                    response = await self._call_gitlab(
-                        git_url, method="POST", body=data
-                    )
-                else:
-                    raise error
+            response = await self._call_gitlab(git_url, method="POST", body=data)
 
             comment = GitLabManager._response_to_comment(response["notes"][0])
             # Add the discussion ID created by GitLab
             comment["inReplyTo"] = response["id"]
             return comment
 
+    async def post_review(
+        self,
+        pr_id: str,
+        comments: List[Union[CommentReply, NewComment]],
+        text: Optional[str] = None,
+    ) -> None:
+        """Send several comments on a merge request as a single review.
+
+        The comments are created as draft notes and published at once.
+
+        Args:
+            pr_id: pull request ID endpoint
+            comments: The comments; the sent ones are removed
+            text: The review summary; None if no summary
+        """
+        if not await self._supports(GitLabManager.DRAFT_NOTES_VERSION):
+            await super().post_review(pr_id, comments, text)
+            return
+
+        # Invalid the discussions cache
+        self._discussions_cache.pop(pr_id, None)
+
+        git_url = url_path_join(pr_id, "draft_notes")
+        drafts = []
+        try:
+            for body in comments + ([NewComment(text, None, None, None)] if text else []):
+                data = {"note": body.text}
+                if isinstance(body, CommentReply):
+                    data["in_reply_to_discussion_id"] = body.inReplyTo
+                elif body.line is not None or body.originalLine is not None:
+                    data["position"] = await self._get_position(
+                        pr_id, body.filename, body.line, body.originalLine
+                    )
+                else:
+                    data["commit_id"] = (await self._get_merge_requests(pr_id))["sha"]
+                draft = await self._call_gitlab(git_url, method="POST", body=data)
+                drafts.append(draft["id"])
+
+            # Tornado requires a body for POST requests
+            await self._call_gitlab(
+                url_path_join(git_url, "bulk_publish"),
+                method="POST",
+                body={},
+                load_json=False,
+            )
+        except BaseException:
+            # Drafts left behind would be published with the next review
+            for draft_id in drafts:
+                try:
+                    await self._call_gitlab(
+                        url_path_join(git_url, str(draft_id)),
+                        method="DELETE",
+                        load_json=False,
+                    )
+                except HTTPError as e:
+                    self.log.warning(f"Failed to delete draft note {draft_id}: {e.reason}")
+            raise
+
+        comments.clear()
+
     async def _call_gitlab(
         self,
         url: str,
@@ -352,7 +680,10 @@ class GitLabManager(PullRequestsManager):
         body: Optional[dict] = None,
         params: Optional[Dict[str, str]] = None,
         has_pagination: bool = True,
-    ) -> Union[dict, str]:
+        conditional: bool = False,
+        raw: bool = False,
+        max_size: Optional[int] = None,
+    ) -> Union[dict, str, bytes, None]:
         """Call GitLab
 
         The request is presumed to support pagination by default if
@@ -367,11 +698,15 @@ class GitLabManager(PullRequestsManager):
             body: Request body; None if no body
             params: Query arguments as dictionary; None if no arguments
             has_pagination: Whether the pagination query arguments should be appended
+            conditional: Whether to send a conditional request
+            raw: Whether to return the response body bytes
+            max_size: Maximal size in bytes of the raw response body; the
+                download is aborted past it and None is returned
         Returns:
             List or Dict: Create from JSON response body if load_json is True
             str: Raw response body if load_json is False
+            bytes: Response body if raw is True; None if larger than max_size
         """
-
         headers = {
             "Authorization": f"Bearer {self._config.access_token}",
             "Accept": "application/json",
@@ -384,64 +719,153 @@ class GitLabManager(PullRequestsManager):
             params=params,
             headers=headers,
             has_pagination=has_pagination,
+            conditional=conditional,
+            raw=raw,
+            max_size=max_size,
         )
 
-    async def _get_file_diff(self, pr_id: str, filename: str) -> List[difflib.Match]:
-        """Compute the list of matching snippet in the diff of filename
-        for the given pr_id pull request.
+    async def _iter_gitlab(
+        self,
+        url: str,
+        params: Optional[Dict[str, str]] = None,
+        keyset: Optional[str] = None,
+        sort: Optional[str] = None,
+    ) -> AsyncIterator[Union[dict, list]]:
+        """Iterate over the pages of a GitLab GET request.
+
+        Args:
+            url: Endpoint to request
+            params: Query arguments as dictionary; None if no arguments
+            keyset: Name of the requested resource to use keyset pagination if
+                supported; None to use offset pagination
+            sort: Order of the results by id, "asc" or "desc"; None for the
+                resource default order. Keyset pagination requires an order.
+        Returns:
+            Iterator on the JSON response body of each page
+        """
+        headers = {
+            "Authorization": f"Bearer {self._config.access_token}",
+            "Accept": "application/json",
+        }
+
+        if (
+            keyset is not None
+            and keyset not in self._keyset_unsupported
+            and await self._supports(GitLabManager.KEYSET_VERSION)
+        ):
+            keyset_params = {"pagination": "keyset", "order_by": "id", "sort": sort or "asc"}
+            keyset_params.update(params or {})
+            pages = super()._iter_provider(url, params=keyset_params, headers=headers)
+            try:
+                first_page = await pages.__anext__()
+            except StopAsyncIteration:
+                return
+            except HTTPError as error:
+                # Keyset pagination is only supported on some resources and orders
+                if error.status_code not in (
+                    http.HTTPStatus.BAD_REQUEST,
+                    http.HTTPStatus.METHOD_NOT_ALLOWED,
+                ):
+                    raise error
+                self.log.debug(
+                    f"Keyset pagination is not supported for {keyset}; falling back to offset pagination."
+                )
+                self._keyset_unsupported.add(keyset)
+            else:
+                yield first_page
+                async for page in pages:
+                    yield page
+                return
+
+        if sort is not None:
+            params = {"order_by": "id", "sort": sort, **(params or {})}
+        async for page in super()._iter_provider(url, params=params, headers=headers):
+            yield page
+
+    async def _get_line_mapping(self, pr_id: str, filename: str) -> LineMapping:
+        """Get the line mapping between the original and the new versions of a file.
+
+        The mapping is built from the diff hunks computed by GitLab for the
+        current merge request diff references. GitLab empties the diff of too
+        large or collapsed files; then the file versions are diffed.
 
         Args:
             pr_id: The pull request of interest
             filename: The filename of interest
         Returns:
-            List of matching lines
+            The line mapping
         """
-        try:
-            import diff_match_patch
-        except ImportError as e:
-            self.log.error(
-                "diff-match-patch package is needed by GitLab to post comments.",
-                exc_info=e,
-            )
-            raise HTTPError(
-                status_code=http.HTTPStatus.INTERNAL_SERVER_ERROR,
-                reason=f"diff-match-patch package is needed by GitLab to post comments. Please install it using pip or conda.",
-            ) from e
-
-        file_diff = self._file_diff_cache.get((pr_id, filename))
-        if file_diff is None:
-            content = await self.get_file_diff(pr_id, filename)
-
-            # Compute the diff using Myers algorithm
-            dmp = diff_match_patch.diff_match_patch()
-            (text1, text2, linearray) = dmp.diff_linesToChars(
-                content["base"]["content"],
-                content["head"]["content"],
+        diff_refs = (await self._get_merge_requests(pr_id))["diff_refs"]
+        key = (
+            pr_id,
+            filename,
+            diff_refs["base_sha"],
+            diff_refs["head_sha"],
+            diff_refs["start_sha"],
+        )
+        mapping = self._line_mapping_cache.get(key)
+        if mapping is None:
+            entry = await self._get_file_index(pr_id, filename)
+            patch = None if entry is None else entry["patch"]
+            if patch:
+                mapping = LineMapping(parse_patch(patch))
+            else:
+                file_diff = await self.get_file_diff(pr_id, filename, force=True)
+                base_content = file_diff["base"]["content"] or ""
+                head_content = file_diff["head"]["content"] or ""
+                mapping = await self._executor.run(
+                    "line_mapping",
+                    len(base_content) + len(head_content),
+                    LineMapping.from_contents,
+                    base_content,
+                    head_content,
+                )
+            self._line_mapping_cache[key] = mapping
+
+        return mapping
+
+    async def _get_position(
+        self,
+        pr_id: str,
+        filename: str,
+        line: Optional[int],
+        original_line: Optional[int],
+    ) -> dict:
+        """Compute the position of a new thread on a file.
+
+        When targeting an unmodified line, GitLab requires both the line and the
+        original line to compute the infamous ``line_code``; otherwise it fails
+        with an unfriendly error message. So the missing line number is computed
+        from the file diff if the line is unmodified.
+
+        Args:
+            pr_id: pull request ID endpoint
+            filename: The file name
+            line: Commented line number in the new version; None if not known
+            original_line: Commented line number in the original version; None if not known
+        Returns:
+            The thread position
+        """
+        merge_request = await self._get_merge_requests(pr_id)
+        entry = await self._get_file_index(pr_id, filename)
+        mapping = await self._get_line_mapping(pr_id, filename)
+
+        if original_line is None:
+            original_line = mapping.to_old(line)
+        elif line is None:
+            line = mapping.to_new(original_line)
+
+        position = {"position_type": "text"}
+        if line is not None:
+            position["new_line"] = line
+            position["new_path"] = filename
+        if original_line is not None:
+            position["old_line"] = original_line
+            position["old_path"] = (
+                self._get_file_path(entry, filename, "base") or filename
             )
-            diffs = dmp.diff_main(text1, text2, False)
-            # Convert the diff back to original text.
-            dmp.diff_charsToLines(diffs, linearray)
-            # Eliminate freak matches (e.g. blank lines)
-            dmp.diff_cleanupSemantic(diffs)
-
-            # Convert to Match object
-            file_diff = []
-            a = 0
-            b = 0
-            for diff in diffs:
-                size = diff[1].count("\n")
-                if diff[0] == 0:
-                    file_diff.append(difflib.Match(a=a, b=b, size=size))
-                    a += size
-                    b += size
-                elif diff[0] == -1:
-                    a += size
-                else:  # diff[0] == 1
-                    b += size
-
-            self._file_diff_cache[(pr_id, filename)] = file_diff
-
-        return file_diff
+        position.update(merge_request["diff_refs"])
+        return position
 
     async def _get_merge_requests(self, pr_id: str) -> dict:
         """Get a single merge request information.
@@ -477,7 +901,14 @@ class GitLabManager(PullRequestsManager):
         }
         return data
 
-    async def __get_content(self, project_id: int, filename: str, sha: str) -> str:
+    async def __get_content(
+        self,
+        project_id: int,
+        filename: str,
+        sha: str,
+        raw: bool = False,
+        max_size: Optional[int] = None,
+    ) -> Union[str, bytes, None]:
         url = url_concat(
             url_path_join(
                 self.base_api_url,
@@ -491,6 +922,40 @@ class GitLabManager(PullRequestsManager):
         )
 
         try:
-            return await self._call_gitlab(url, load_json=False)
+            return await self._call_gitlab(
+                url, load_json=False, raw=raw, max_size=max_size
+            )
         except HTTPError:
-            return ""
+            return b"" if raw else ""
+
+    async def __get_file(
+        self, project_id: int, filename: Optional[str], sha: str, force: bool = False
+    ) -> dict:
+        """Get a file content unless it is binary or too large.
+
+        The download is aborted as soon as it exceeds the maximal file size.
+
+        Args:
+            project_id: The project ID
+            filename: The file name; None if the file does not exist in that version
+            sha: The commit SHA
+            force: Whether to download the content whatever its type and size
+        Returns:
+            {"content": str} or {"content": None, "skipped": dict}
+        """
+        if filename is None:
+            return {"content": ""}
+
+        if force:
+            return {"content": await self.__get_content(project_id, filename, sha)}
+
+        skipped = self._skip_content(filename)
+        if skipped is not None:
+            return {"content": None, "skipped": skipped}
+
+        content = await self.__get_content(
+            project_id, filename, sha, raw=True, max_size=self._config.max_file_size
+        )
+        if content is None:
+            return {"content": None, "skipped": {"reason": "oversized", "size": None}}
+        return self._decode_content(filename, content)
@@ -1,20 +1,131 @@
 import abc
+import asyncio
+import functools
 import http
 import json
 import logging
-from typing import Dict, List, Optional, Tuple, Union
+import mimetypes
+import os
+import time
+import uuid
+from collections import OrderedDict
+from itertools import chain
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
-import nbformat
 import tornado
+import tornado.locks
 import traitlets
 from jupyter_server.utils import url_path_join
 
 from .._version import __version__
 from ..log import get_logger
-from ..base import PRConfig
+from ..base import CommentReply, NewComment, PRConfig
+from ..executor import TaskExecutor
+from .diff import slice_lines
 
 import re
 
+# Extensions of binary files common in pull requests; mimetypes does not know
+# them or reports them as application/* like many text formats
+BINARY_EXTENSIONS = {
+    ".arrow",
+    ".bin",
+    ".db",
+    ".gz",
+    ".jar",
+    ".feather",
+    ".h5",
+    ".hdf5",
+    ".joblib",
+    ".npy",
+    ".npz",
+    ".onnx",
+    ".parquet",
+    ".pdf",
+    ".pickle",
+    ".pkl",
+    ".pt",
+    ".pth",
+    ".so",
+    ".sqlite",
+    ".tar",
+    ".whl",
+    ".zip",
+}
+
+T = TypeVar("T")
+
+# Maximal number of notebook diffs kept in memory
+NOTEBOOK_DIFF_CACHE_SIZE = 32
+# Maximal size in bytes of the stubbed notebook outputs kept in memory
+OUTPUTS_CACHE_SIZE = 256 * 1024 * 1024
+# Maximal number of answers kept to be served while revalidated
+REVALIDATION_CACHE_SIZE = 256
+# Maximal number of responses kept to send conditional requests
+CONDITIONAL_CACHE_SIZE = 256
+
+
+class FetchPipeline:
+    """Bounded concurrency pipeline for requests to the versioning service.
+
+    At most ``max_concurrency`` requests run at the same time. To be fair
+    between pull requests, a single key (pull request) cannot hold more than
+    ``max_per_key`` of those slots; so a pull request with lots of files
+    cannot starve the requests of another one.
+
+    Args:
+        max_concurrency: Maximal number of concurrent requests
+        max_per_key: Maximal number of concurrent requests for a key
+    """
+
+    def __init__(self, max_concurrency: int, max_per_key: int) -> None:
+        self._semaphore = tornado.locks.Semaphore(max_concurrency)
+        self._max_per_key = max_per_key
+        # Semaphore and number of pending requests per key
+        self._key_semaphores = {}  # Dict[str, Tuple[tornado.locks.Semaphore, int]]
+
+    async def run(
+        self, key: str, fetch: Callable[..., Awaitable[T]], *args, **kwargs
+    ) -> T:
+        """Wait for a slot and send the request.
+
+        The request is only created once a slot is acquired; so nothing is
+        left unawaited if the wait is cancelled.
+
+        Args:
+            key: The request group (e.g. pull request ID)
+            fetch: Coroutine function sending the request
+            args: Positional arguments of ``fetch``
+            kwargs: Keyword arguments of ``fetch``
+        Returns:
+            The request result
+        """
+        semaphore, pending = self._key_semaphores.get(
+            key, (tornado.locks.Semaphore(self._max_per_key), 0)
+        )
+        self._key_semaphores[key] = (semaphore, pending + 1)
+        try:
+            async with semaphore:
+                async with self._semaphore:
+                    return await fetch(*args, **kwargs)
+        finally:
+            semaphore, pending = self._key_semaphores[key]
+            if pending == 1:
+                del self._key_semaphores[key]
+            else:
+                self._key_semaphores[key] = (semaphore, pending - 1)
+
+
 class PullRequestsManager(abc.ABC):
     """Abstract base class for pull requests manager.
     
@@ -32,12 +143,45 @@ class PullRequestsManager(abc.ABC):
     def __init__(self, config: PRConfig) -> None:
         self._config = config
         self._client = tornado.httpclient.AsyncHTTPClient()
+        # CPU-bound tasks with a large input run off the event loop
+        self._executor = TaskExecutor(
+            config.offload_executor, config.offload_workers, config.offload_threshold
+        )
+        # All file contents requests go through this pipeline
+        self._fetch_pipeline = FetchPipeline(
+            config.max_concurrent_fetches, config.max_concurrent_fetches_per_pr
+        )
+        # Modified files metadata by pull request, filled when listing the files
+        self._files_index = {}  # Dict[str, Dict[str, dict]]
+        # Pull requests whose modified files are all in the index
+        self._files_indexed = set()  # Set[str]
+        # Notebook diffs only depend on the revisions; cache them by (base sha, head sha, filename)
+        self._notebook_diff_cache = OrderedDict()  # Dict[Tuple[str, str, str, bool], dict]
+        # Stubbed notebook outputs by content hash
+        self._outputs_cache = OrderedDict()  # Dict[str, Tuple[dict, int]]
+        self._outputs_cache_size = 0
+        # Comments waiting for the review submission by pull request: (pending ID, comment)
+        self._pending_reviews = {}  # Dict[str, List[Tuple[str, Union[CommentReply, NewComment]]]]
+        # Answers served while revalidated by (endpoint, *key): (time, validator, result)
+        self._revalidation_cache = OrderedDict()  # Dict[tuple, Tuple[float, Optional[str], list]]
+        self._revalidations = {}  # Dict[tuple, asyncio.Future]
+        # GET requests in flight shared by identical calls: [task, number of waiters]
+        self._inflight_requests = {}  # Dict[tuple, List[Union[asyncio.Future, int]]]
+        # Last response of conditional requests by URL: (ETag, result)
+        self._conditional_cache = OrderedDict()  # Dict[str, Tuple[str, Union[dict, str]]]
+        # The access token user does not change; it is requested once
+        self._current_user = None  # Optional[Dict[str, str]]
 
     @property
     def base_api_url(self) -> str:
         """The provider base REST API URL"""
         return self._config.api_base_url
 
+    @property
+    def executor(self) -> TaskExecutor:
+        """The executor of the CPU-bound tasks"""
+        return self._executor
+
     @property
     def log(self) -> logging.Logger:
         return get_logger()
@@ -52,23 +196,395 @@ class PullRequestsManager(abc.ABC):
         """
         return None
 
+    def get_cached(self, endpoint: str, *key: Optional[str]) -> Optional[Tuple[list, float]]:
+        """Get a cached answer to serve while it is revalidated.
+
+        The answer is returned if its age is within the endpoint window of
+        ``PRConfig.stale_while_revalidate``; its revalidation is then started
+        in the background.
+
+        Args:
+            endpoint: The endpoint; ``prs``, ``files`` or ``threads``
+            key: The endpoint arguments (see ``fetch_cached``)
+        Returns:
+            The cached answer and its age in seconds; None if there is no usable answer
+        """
+        window = self._config.stale_while_revalidate.get(endpoint, 0)
+        cached = self._revalidation_cache.get((endpoint, *key))
+        if window <= 0 or cached is None:
+            return None
+        age = time.monotonic() - cached[0]
+        if age > window:
+            return None
+
+        self._revalidation_cache.move_to_end((endpoint, *key))
+        if (endpoint, *key) not in self._revalidations:
+            self._revalidations[(endpoint, *key)] = asyncio.ensure_future(
+                self._revalidate(endpoint, key, cached[1])
+            )
+        return cached[2], age
+
+    async def fetch_cached(
+        self, endpoint: str, *key: Optional[str], validator: Optional[str] = None
+    ) -> list:
+        """Request an answer and cache it to serve it later while revalidating it.
+
+        The endpoints and their arguments are:
+
+        - prs: filter for the current user (see ``list_prs``)
+        - files: pull request ID (see ``list_files``)
+        - threads: pull request ID and file name (see ``get_threads``)
+
+        Args:
+            endpoint: The endpoint
+            key: The endpoint arguments
+            validator: The answer validator if known (see ``get_files_validator``)
+        Returns:
+            The answer
+        """
+        if endpoint == "prs":
+            current_user = await self.get_current_user()
+            result = await self.list_prs(current_user["username"], *key)
+        elif endpoint == "files":
+            result = await self.list_files(*key)
+        else:
+            result = await self.get_threads(*key)
+
+        if self._config.stale_while_revalidate.get(endpoint, 0) > 0:
+            self._revalidation_cache[(endpoint, *key)] = (
+                time.monotonic(),
+                validator,
+                result,
+            )
+            self._revalidation_cache.move_to_end((endpoint, *key))
+            if len(self._revalidation_cache) > REVALIDATION_CACHE_SIZE:
+                self._revalidation_cache.popitem(last=False)
+        return result
+
+    def invalidate_cached(self, endpoint: str, *key: Optional[str]) -> None:
+        """Remove the cached answers of an endpoint.
+
+        Args:
+            endpoint: The endpoint; ``prs``, ``files`` or ``threads``
+            key: The first endpoint arguments; all answers matching them are removed
+        """
+        prefix = (endpoint, *key)
+        for cached_key in list(self._revalidation_cache):
+            if cached_key[: len(prefix)] == prefix:
+                del self._revalidation_cache[cached_key]
+
+    async def _revalidate(
+        self, endpoint: str, key: Tuple[Optional[str], ...], validator: Optional[str]
+    ) -> None:
+        try:
+            if endpoint == "files":
+                new_validator = await self.get_files_validator(*key)
+            elif endpoint == "threads":
+                new_validator = await self.get_threads_validator(*key)
+            else:
+                new_validator = None
+
+            if new_validator is not None and new_validator == validator:
+                # Not modified; the cached answer is fresh again
+                cached = self._revalidation_cache.get((endpoint, *key))
+                if cached is not None:
+                    self._revalidation_cache[(endpoint, *key)] = (
+                        time.monotonic(),
+                        validator,
+                        cached[2],
+                    )
+            else:
+                await self.fetch_cached(endpoint, *key, validator=new_validator)
+        except Exception as e:
+            self.log.warning(f"Failed to revalidate {endpoint} {key}", exc_info=e)
+        finally:
+            del self._revalidations[(endpoint, *key)]
+
     @abc.abstractmethod
     async def get_current_user(self) -> str:
         """Get the current user ID."""
         raise NotImplementedError()
 
     @abc.abstractmethod
-    async def get_file_diff(self, pr_id: str, filename: str) -> dict:
+    async def get_file_diff(
+        self, pr_id: str, filename: str, force: bool = False
+    ) -> dict:
         """Get the file diff for the pull request.
 
+        Binary files and files larger than ``PRConfig.max_file_size`` are not
+        downloaded unless ``force`` is True; their ``content`` is None and
+        a ``skipped`` entry describes the reason (see ``_skip_content``).
+
         Args:
             pr_id: pull request ID endpoint
             filename: The file name
+            force: Whether to download the content whatever its type and size
         Returns:
             The file diff description
         """
         raise NotImplementedError()
 
+    async def get_file_references(self, pr_id: str, filename: str) -> dict:
+        """Get the references to the file versions for the pull request.
+
+        It has the same structure as ``get_file_diff`` but the ``content`` of each
+        version is replaced by a ``reference`` to request it with ``get_file_raw``
+        as {"repo": str, "sha": str, "path": str}; None if the file does not exist
+        in that version.
+
+        Args:
+            pr_id: pull request ID endpoint
+            filename: The file name
+        Returns:
+            The file references description
+        """
+        raise NotImplementedError()
+
+    async def get_file_raw(self, repo: str, sha: str, path: str) -> bytes:
+        """Get the raw content of a file at a given commit.
+
+        As the arguments are provided by the frontend, managers must check
+        that ``repo`` targets the provider API before requesting it.
+
+        Args:
+            repo: The repository as in the file references
+            sha: The commit SHA
+            path: The file path
+        Returns:
+            The file content
+        """
+        raise NotImplementedError()
+
+    def _validate_raw_request(self, sha: str, path: str) -> None:
+        """Check the commit and path of a raw file request.
+
+        Args:
+            sha: The commit SHA
+            path: The file path
+        Raises:
+            HTTPError 400 if the sha is not a commit SHA or the path is not relative
+        """
+        if re.fullmatch(r"[0-9a-fA-F]{7,64}", sha) is None:
+            raise tornado.web.HTTPError(
+                status_code=http.HTTPStatus.BAD_REQUEST,
+                reason=f"Invalid parameter 'sha'. Expected a commit SHA, received '{sha}'.",
+            )
+        if path.startswith("/") or ".." in path.split("/"):
+            raise tornado.web.HTTPError(
+                status_code=http.HTTPStatus.BAD_REQUEST,
+                reason=f"Invalid parameter 'path'. Expected a relative path, received '{path}'.",
+            )
+
+    async def get_file_patch(self, pr_id: str, filename: str) -> dict:
+        """Get the hunks of the file diff for the pull request.
+
+        The returned description has a ``hunks`` entry instead of the
+        ``content`` of each version. If the provider has no patch for
+        the file (e.g. binary or too large diff), the full file diff is
+        returned instead.
+
+        Args:
+            pr_id: pull request ID endpoint
+            filename: The file name
+        Returns:
+            The file diff description
+        """
+        return await self.get_file_diff(pr_id, filename)
+
+    async def get_file_context(
+        self, pr_id: str, filename: str, side: str, start: int, end: int
+    ) -> dict:
+        """Get a range of lines of one version of a file.
+
+        This is used to expand the context around the hunks of a patch.
+
+        Args:
+            pr_id: pull request ID endpoint
+            filename: The file name
+            side: The file version; ``base`` or ``head``
+            start: First line (1-based)
+            end: Last line (included)
+        Returns:
+            The lines range description
+        """
+        file_diff = await self.get_file_diff(pr_id, filename, force=True)
+        return slice_lines(file_diff[side]["content"], start, end)
+
+    async def get_notebook_diff(
+        self, pr_id: str, filename: str, stub_outputs: bool = False
+    ) -> dict:
+        """Get the cells diff of a notebook for the pull request.
+
+        The notebook versions are parsed and diffed on the server so that only
+        the changed cells are sent to the frontend.
+
+        Args:
+            pr_id: pull request ID endpoint
+            filename: The notebook file name
+            stub_outputs: Whether to replace the outputs larger than
+                ``PRConfig.max_output_size`` by stubs; see ``get_notebook_output``
+        Returns:
+            The notebook diff description
+        """
+        from .notebook import diff_notebooks
+
+        revisions = await self.get_revisions(pr_id)
+        key = None
+        if revisions is not None:
+            key = (revisions["base"], revisions["head"], filename, stub_outputs)
+            notebook_diff = self._notebook_diff_cache.get(key)
+            if notebook_diff is not None:
+                self._notebook_diff_cache.move_to_end(key)
+                return notebook_diff
+
+        if stub_outputs:
+            notebook_diff = await self.get_notebook_diff(pr_id, filename)
+            notebook_diff = self._stub_outputs(notebook_diff)
+        else:
+            file_diff = await self.get_file_diff(pr_id, filename, force=True)
+            base_content = file_diff["base"]["content"]
+            head_content = file_diff["head"]["content"]
+            try:
+                cells_diff = await self._executor.run(
+                    "notebook_diff",
+                    len(base_content or "") + len(head_content or ""),
+                    diff_notebooks,
+                    base_content,
+                    head_content,
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.log.error(f"Failed to diff notebook {filename}", exc_info=e)
+                raise tornado.web.HTTPError(
+                    status_code=http.HTTPStatus.BAD_REQUEST,
+                    reason=f"Invalid notebook '{filename}': {e}",
+                ) from e
+
+            notebook_diff = {
+                "base": {
+                    "label": file_diff["base"]["label"],
+                    "sha": file_diff["base"]["sha"],
+                    **cells_diff["base"],
+                },
+                "head": {
+                    "label": file_diff["head"]["label"],
+                    "sha": file_diff["head"]["sha"],
+                    **cells_diff["head"],
+                },
+                "cells": cells_diff["cells"],
+            }
+
+        if key is None:
+            key = (
+                notebook_diff["base"]["sha"],
+                notebook_diff["head"]["sha"],
+                filename,
+                stub_outputs,
+            )
+        self._notebook_diff_cache[key] = notebook_diff
+        if len(self._notebook_diff_cache) > NOTEBOOK_DIFF_CACHE_SIZE:
+            self._notebook_diff_cache.popitem(last=False)
+
+        return notebook_diff
+
+    async def get_notebook_output(
+        self, pr_id: str, filename: str, output_hash: str
+    ) -> dict:
+        """Get a notebook output replaced by a stub in a notebook diff.
+
+        Args:
+            pr_id: pull request ID endpoint
+            filename: The notebook file name
+            output_hash: The output hash provided by the stub
+        Returns:
+            The notebook output
+        """
+        cached = self._outputs_cache.get(output_hash)
+        if cached is None:
+            # The output was evicted; stub the notebook diff again to retrieve it
+            self._stub_outputs(await self.get_notebook_diff(pr_id, filename))
+            cached = self._outputs_cache.get(output_hash)
+            if cached is None:
+                raise tornado.web.HTTPError(
+                    status_code=http.HTTPStatus.NOT_FOUND,
+                    reason=f"Output '{output_hash}' not found in notebook '{filename}'.",
+                )
+        else:
+            self._outputs_cache.move_to_end(output_hash)
+
+        return cached[0]
+
+    async def get_pull_request_status(self, pr_id: str) -> Dict[str, Union[str, int]]:
+        """Get the current status of a pull request.
+
+        This is polled to push updates to the frontend; so managers should
+        use conditional requests and refresh their cached pull request data.
+
+        Args:
+            pr_id: pull request ID endpoint
+        Returns:
+            The pull request status as
+            {"headSha": str, "state": str, "commentsCount": int, "updatedAt": str}
+        """
+        raise NotImplementedError()
+
+    async def get_files_validator(self, pr_id: str) -> Optional[str]:
+        """Get a validator of the list of modified files of a pull request.
+
+        The validator changes when the list may have changed; it is used to
+        answer client conditional requests without listing the files.
+
+        Args:
+            pr_id: pull request ID endpoint
+        Returns:
+            The validator; None if the manager does not support it
+        """
+        try:
+            status = await self.get_pull_request_status(pr_id)
+        except NotImplementedError:
+            return None
+        # The status refreshes the cached pull request
+        revisions = await self.get_revisions(pr_id)
+        if revisions is None:
+            return None
+        return f"{revisions['base']}:{status['headSha']}"
+
+    async def get_threads_validator(
+        self, pr_id: str, filename: Optional[str] = None
+    ) -> Optional[str]:
+        """Get a validator of the discussions on a file or the pull request.
+
+        The validator changes when a comment is added, removed or edited as
+        this updates the pull request. It also changes with the head commit
+        as the comments positions depend on it.
+
+        Args:
+            pr_id: pull request ID endpoint
+            filename: The file name; None for the discussion on the pull request
+        Returns:
+            The validator; None if the manager does not support it
+        """
+        try:
+            status = await self.get_pull_request_status(pr_id)
+        except NotImplementedError:
+            return None
+        return f"{status['headSha']}:{status['commentsCount']}:{status['updatedAt']}"
+
+    async def get_revisions(self, pr_id: str) -> Optional[Dict[str, str]]:
+        """Get the base and head commit SHAs of a pull request.
+
+        Managers should return cached values when available as this is used
+        to look up caches before requesting the provider.
+
+        Args:
+            pr_id: pull request ID endpoint
+        Returns:
+            The base and head SHAs as {"base": str, "head": str};
+            None if the manager does not support it
+        """
+        return None
+
     @abc.abstractmethod
     async def get_threads(
         self, pr_id: str, filename: Optional[str] = None
@@ -83,6 +599,74 @@ class PullRequestsManager(abc.ABC):
         """
         raise NotImplementedError()
 
+    async def get_files_page(
+        self, pr_id: str, limit: int, start: int = 0
+    ) -> Tuple[List[Dict[str, str]], Optional[int]]:
+        """Get a range of the modified files of a pull request.
+
+        Only the provider pages covering the range are requested.
+
+        Args:
+            pr_id: pull request ID endpoint
+            limit: Maximal number of files
+            start: Index of the first file
+        Returns:
+            The modified files and the index of the next file; None if there
+            are no more files
+        """
+        return await self._get_page(self.iter_files(pr_id, start), start, limit)
+
+    async def get_prs_page(
+        self, username: str, pr_filter: str, limit: int, start: int = 0
+    ) -> Tuple[List[Dict[str, str]], Optional[int]]:
+        """Get a range of the pull requests of the given user.
+
+        Only the provider pages covering the range are requested.
+
+        Args:
+            username: User ID for the versioning service
+            pr_filter: Filter to add to the pull requests requests
+            limit: Maximal number of pull requests
+            start: Index of the first pull request
+        Returns:
+            The pull requests and the index of the next pull request; None if
+            there are no more pull requests
+        """
+        return await self._get_page(
+            self.iter_prs(username, pr_filter, start), start, limit
+        )
+
+    async def iter_files(
+        self, pr_id: str, start: int = 0
+    ) -> AsyncIterator[List[Dict[str, str]]]:
+        """Iterate over the modified files of a pull request page per page.
+
+        By default, all files are returned in a single page.
+
+        Args:
+            pr_id: pull request ID endpoint
+            start: Index of the first file
+        Returns:
+            Iterator on the lists of modified files
+        """
+        yield (await self.list_files(pr_id))[start:]
+
+    async def iter_prs(
+        self, username: str, pr_filter: str, start: int = 0
+    ) -> AsyncIterator[List[Dict[str, str]]]:
+        """Iterate over the pull requests of the given user page per page.
+
+        By default, all pull requests are returned in a single page.
+
+        Args:
+            username: User ID for the versioning service
+            pr_filter: Filter to add to the pull requests requests
+            start: Index of the first pull request
+        Returns:
+            Iterator on the lists of pull requests
+        """
+        yield (await self.list_prs(username, pr_filter))[start:]
+
     @abc.abstractmethod
     async def list_files(self, pr_id: str) -> list:
         """Get the list of modified files for a pull request.
@@ -121,6 +705,258 @@ class PullRequestsManager(abc.ABC):
         """
         raise NotImplementedError()
 
+    def add_pending_comment(
+        self, pr_id: str, body: Union[CommentReply, NewComment]
+    ) -> Dict[str, Union[str, int, bool, None]]:
+        """Queue a comment in the pending review of a pull request.
+
+        The comment is sent to the provider when the review is submitted.
+
+        Args:
+            pr_id: pull request ID endpoint
+            body: Comment body
+        Returns:
+            The pending comment
+        """
+        comment_id = f"pending-{uuid.uuid4().hex}"
+        self._pending_reviews.setdefault(pr_id, []).append((comment_id, body))
+        return self._pending_to_comment(comment_id, body)
+
+    def discard_pending_comments(
+        self, pr_id: str, comment_id: Optional[str] = None
+    ) -> None:
+        """Remove comments from the pending review of a pull request.
+
+        Args:
+            pr_id: pull request ID endpoint
+            comment_id: The pending comment ID; None to discard the whole review
+        """
+        if comment_id is None:
+            self._pending_reviews.pop(pr_id, None)
+        else:
+            pending = [
+                (id_, body)
+                for id_, body in self._pending_reviews.get(pr_id, [])
+                if id_ != comment_id
+            ]
+            if pending:
+                self._pending_reviews[pr_id] = pending
+            else:
+                self._pending_reviews.pop(pr_id, None)
+
+    def get_pending_comments(
+        self, pr_id: str
+    ) -> List[Dict[str, Union[str, int, bool, None]]]:
+        """Get the comments of the pending review of a pull request.
+
+        Args:
+            pr_id: pull request ID endpoint
+        Returns:
+            The pending comments
+        """
+        return [
+            self._pending_to_comment(comment_id, body)
+            for comment_id, body in self._pending_reviews.get(pr_id, [])
+        ]
+
+    async def submit_review(self, pr_id: str, text: Optional[str] = None) -> int:
+        """Send the pending review of a pull request.
+
+        If the review cannot be sent, its comments are kept pending.
+
+        Args:
+            pr_id: pull request ID endpoint
+            text: The review summary; None if no summary
+        Returns:
+            The number of sent comments
+        """
+        pending = self._pending_reviews.pop(pr_id, [])
+        if not pending and not text:
+            return 0
+        self.invalidate_cached("threads", pr_id)
+        comments = [body for _, body in pending]
+        try:
+            await self.post_review(pr_id, comments, text)
+        except BaseException:
+            # Keep the comments not sent before the ones added while sending
+            unsent = pending[len(pending) - len(comments) :]
+            self._pending_reviews[pr_id] = unsent + self._pending_reviews.get(pr_id, [])
+            raise
+        return len(pending)
+
+    async def post_review(
+        self,
+        pr_id: str,
+        comments: List[Union[CommentReply, NewComment]],
+        text: Optional[str] = None,
+    ) -> None:
+        """Send several comments on a pull request as a single review.
+
+        By default, the comments are posted one by one.
+
+        The sent comments must be removed from ``comments``; so the remaining
+        ones are kept pending if the review fails.
+
+        Args:
+            pr_id: pull request ID endpoint
+            comments: The comments
+            text: The review summary; None if no summary
+        """
+        while comments:
+            await self.post_comment(pr_id, comments[0])
+            comments.pop(0)
+        if text:
+            await self.post_comment(pr_id, NewComment(text, None, None, None))
+
+    async def _get_file_index(self, pr_id: str, filename: str) -> Optional[dict]:
+        """Get the metadata of a modified file of a pull request.
+
+        The index is filled by ``iter_files``; the whole list of files is only
+        requested if the file is not indexed yet. Each entry has the keys:
+
+        - status: added, modified, removed or renamed
+        - previous_name: The file name in the base version if renamed; None otherwise
+        - sha: The file blob SHA if provided by the service; None otherwise
+        - additions: Number of added lines; None if not provided by the service
+        - deletions: Number of deleted lines; None if not provided by the service
+        - patch: The unified diff if provided by the service; None otherwise
+
+        Args:
+            pr_id: pull request ID endpoint
+            filename: The file name
+        Returns:
+            The file metadata; None if the file is not modified by the pull request
+        """
+        entry = self._files_index.get(pr_id, {}).get(filename)
+        if entry is None and pr_id not in self._files_indexed:
+            await self.list_files(pr_id)
+            entry = self._files_index.get(pr_id, {}).get(filename)
+        return entry
+
+    def _drop_files_index(self, pr_id: Optional[str] = None) -> None:
+        """Drop the modified files metadata.
+
+        Args:
+            pr_id: pull request ID endpoint; None to drop those of all pull requests
+        """
+        if pr_id is None:
+            self._files_index = {}
+            self._files_indexed = set()
+        else:
+            self._files_index.pop(pr_id, None)
+            self._files_indexed.discard(pr_id)
+
+    @staticmethod
+    def _get_file_path(entry: Optional[dict], filename: str, side: str) -> Optional[str]:
+        """Get the path of a file version.
+
+        Args:
+            entry: The file metadata from ``_get_file_index``
+            filename: The file name
+            side: The file version; ``base`` or ``head``
+        Returns:
+            The file path in that version; None if the file does not exist in it
+        """
+        if entry is None:
+            return filename
+        elif side == "base":
+            if entry["status"] == "added":
+                return None
+            return entry["previous_name"] or filename
+        else:
+            return None if entry["status"] == "removed" else filename
+
+    @staticmethod
+    def _pending_to_comment(
+        comment_id: str, body: Union[CommentReply, NewComment]
+    ) -> Dict[str, Union[str, int, bool, None]]:
+        """Format a pending comment to send it to the frontend.
+
+        Args:
+            comment_id: The pending comment ID
+            body: The comment body
+        Returns:
+            The pending comment description
+        """
+        data = {"id": comment_id, "text": body.text, "filename": body.filename, "pending": True}
+        if isinstance(body, CommentReply):
+            data["discussionId"] = body.inReplyTo
+        else:
+            data["line"] = body.line
+            data["originalLine"] = body.originalLine
+        return data
+
+    def _skip_content(
+        self, filename: str, size: Optional[int] = None, content: Optional[bytes] = None
+    ) -> Optional[dict]:
+        """Check if a file content should not be sent to the frontend.
+
+        Args:
+            filename: The file name
+            size: The file size in bytes; None if unknown
+            content: The file content or its beginning; None if unknown
+        Returns:
+            None if the content can be used, otherwise the description
+            {"reason": "binary" | "oversized", "size": Optional[int]}
+        """
+        mimetype, _ = mimetypes.guess_type(filename)
+        binary = os.path.splitext(filename)[1].lower() in BINARY_EXTENSIONS or (
+            mimetype is not None
+            and mimetype != "image/svg+xml"
+            and mimetype.split("/")[0] in ("audio", "font", "image", "video")
+        )
+        if not binary and content is not None:
+            # Same heuristic as git: a NUL byte in the first 8000 bytes
+            binary = b"\0" in content[:8000]
+
+        if binary:
+            return {"reason": "binary", "size": size}
+        elif size is not None and size > self._config.max_file_size:
+            return {"reason": "oversized", "size": size}
+        else:
+            return None
+
+    def _decode_content(self, filename: str, content: bytes) -> dict:
+        """Decode a downloaded file content unless it is binary.
+
+        Args:
+            filename: The file name
+            content: The file content
+        Returns:
+            {"content": str} or {"content": None, "skipped": dict}
+        """
+        skipped = self._skip_content(filename, len(content), content)
+        if skipped is None:
+            try:
+                return {"content": content.decode("utf-8")}
+            except UnicodeDecodeError:
+                skipped = {"reason": "binary", "size": len(content)}
+        return {"content": None, "skipped": skipped}
+
+    def _stub_outputs(self, notebook_diff: dict) -> dict:
+        """Replace the large outputs of a notebook diff by stubs and cache them.
+
+        Args:
+            notebook_diff: The notebook diff with all outputs
+        Returns:
+            The notebook diff with stubs
+        """
+        from .notebook import stub_outputs
+
+        notebook_diff, outputs = stub_outputs(
+            notebook_diff, self._config.max_output_size
+        )
+        for output_hash, (output, size) in outputs.items():
+            if output_hash not in self._outputs_cache:
+                self._outputs_cache[output_hash] = (output, size)
+                self._outputs_cache_size += size
+
+        while self._outputs_cache_size > OUTPUTS_CACHE_SIZE and self._outputs_cache:
+            _, (_, size) = self._outputs_cache.popitem(last=False)
+            self._outputs_cache_size -= size
+
+        return notebook_diff
+
     async def _call_provider(
         self,
         url: str,
@@ -130,7 +966,10 @@ class PullRequestsManager(abc.ABC):
         params: Optional[Dict[str, str]] = None,
         headers: Optional[Dict[str, str]] = None,
         has_pagination: bool = True,
-    ) -> Union[dict, str]:
+        conditional: bool = False,
+        raw: bool = False,
+        max_size: Optional[int] = None,
+    ) -> Union[dict, str, bytes]:
         """Call the third party service
 
         The request is presumed to support pagination by default if
@@ -138,6 +977,10 @@ class PullRequestsManager(abc.ABC):
         - load_json is True
         - The provider returns not None per_page_argument property
 
+        A conditional request sends the ETag of the previous response; if the
+        provider answers 304 Not Modified, the previous result is returned.
+        Conditional requests must not be paginated.
+
         Args:
             url: Endpoint to request
             load_json: Is the response of JSON type
@@ -146,9 +989,250 @@ class PullRequestsManager(abc.ABC):
             params: Query arguments as dictionary; None if no arguments
             headers: Request headers as dictionary; None if no headers
             has_pagination: Whether the pagination query arguments should be appended
+            conditional: Whether to send a conditional request
+            raw: Whether to return the response body bytes
+            max_size: Maximal size in bytes of the raw response body; the
+                download is aborted past it and None is returned
         Returns:
             List or Dict: Create from JSON response body if load_json is True
             str: Raw response body if load_json is False
+            bytes: Response body if raw is True; None if larger than max_size
+            HTTPHeaders: Response headers if method is HEAD
+        """
+        if load_json and not raw and method.upper() == "GET" and not conditional:
+            with_pagination = has_pagination and self.per_page_argument is not None
+            pages = []
+            async for page in self._iter_provider(
+                url, params=params, headers=headers, has_pagination=has_pagination
+            ):
+                pages.append(page)
+
+            if len(pages) == 1 and not with_pagination:
+                return pages[0]
+            return list(
+                chain(*(page if isinstance(page, list) else [page] for page in pages))
+            )
+
+        result, _ = await self._request(
+            self._get_url(url, params),
+            load_json=load_json,
+            method=method,
+            body=body,
+            headers=headers,
+            conditional=conditional,
+            raw=raw,
+            max_size=max_size,
+        )
+        return result
+
+    async def _iter_provider(
+        self,
+        url: str,
+        params: Optional[Dict[str, str]] = None,
+        headers: Optional[Dict[str, str]] = None,
+        has_pagination: bool = True,
+    ) -> AsyncIterator[Union[dict, list]]:
+        """Iterate over the pages of a GET request to the third party service.
+
+        The next page is requested only once the current one is consumed.
+
+        Args:
+            url: Endpoint to request
+            params: Query arguments as dictionary; None if no arguments
+            headers: Request headers as dictionary; None if no headers
+            has_pagination: Whether the pagination query arguments should be appended
+        Returns:
+            Iterator on the JSON response body of each page
+        """
+        if has_pagination and self.per_page_argument is not None:
+            params = params or {}
+            params.update([self.per_page_argument])
+
+        url = self._get_url(url, params)
+        while url is not None:
+            page, next_url = await self._request(url, headers=headers)
+            yield page
+            # Relevant query arguments should be part of the link header
+            url = None if next_url is None else self._get_url(next_url)
+
+    def _get_start_page(self, start: int) -> Tuple[Optional[Dict[str, str]], int]:
+        """Get the pagination query arguments to start at a given item.
+
+        Args:
+            start: Index of the first item
+        Returns:
+            The query arguments requesting the page containing the item; None
+            if not needed. And the number of items to skip in that page.
+        """
+        if start == 0 or self.per_page_argument is None:
+            return None, start
+        per_page = self.per_page_argument[1]
+        return {"page": str(start // per_page + 1)}, start % per_page
+
+    @staticmethod
+    async def _get_page(
+        pages: AsyncIterator[list], start: int, limit: int
+    ) -> Tuple[list, Optional[int]]:
+        """Collect a range of items from pages, stopping as soon as it is complete.
+
+        Args:
+            pages: Iterator on the lists of items starting at ``start``
+            start: Index of the first item
+            limit: Maximal number of items
+        Returns:
+            The items and the index of the next item; None if there are no more items
+        """
+        items = []
+        try:
+            async for page in pages:
+                items.extend(page)
+                # One more item tells if there is a next page
+                if len(items) > limit:
+                    break
+        finally:
+            await pages.aclose()
+
+        next_start = start + limit if len(items) > limit else None
+        return items[:limit], next_start
+
+    def _get_url(self, url: str, params: Optional[Dict[str, str]] = None) -> str:
+        if (not url.startswith(self.base_api_url)) and (not re.search("^https?:", url)):
+            url = url_path_join(self.base_api_url, url)
+
+        if params is not None:
+            url = tornado.httputil.url_concat(url, params)
+
+        return url
+
+    @staticmethod
+    def _get_next_url(link: Optional[str]) -> Optional[str]:
+        """Get the next page URL from a Link header.
+
+        Assume the link to be a comma separated list of <url>; rel="relation"
+        where the next chunk has `relation`=next
+        """
+        if link is not None:
+            for e in link.split(","):
+                args = e.strip().split(";")
+                data = args[0]
+                metadata = {
+                    k.strip(): v.strip().strip('"')
+                    for k, v in map(lambda s: s.strip().split("="), args[1:])
+                }
+                if metadata.get("rel", "") == "next":
+                    return data[1:-1]
+        return None
+
+    async def _request(
+        self,
+        url: str,
+        load_json: bool = True,
+        method: str = "GET",
+        body: Optional[dict] = None,
+        headers: Optional[Dict[str, str]] = None,
+        conditional: bool = False,
+        raw: bool = False,
+        max_size: Optional[int] = None,
+    ) -> Tuple[Union[dict, str, bytes], Optional[str]]:
+        """Send a single request to the third party service.
+
+        Identical GET requests in flight are sent once; the callers share
+        the response (see ``_coalesce``).
+
+        Args:
+            url: Full URL to request
+            load_json: Is the response of JSON type
+            method: HTTP method
+            body: Request body; None if no body
+            headers: Request headers as dictionary; None if no headers
+            conditional: Whether to send a conditional request
+            raw: Whether to return the response body bytes
+            max_size: Maximal size in bytes of the raw response body; the
+                download is aborted past it and None is returned
+        Returns:
+            The response (see ``_call_provider``) and the next page URL if any
+        """
+        send = functools.partial(
+            self._send_request,
+            url,
+            load_json,
+            method,
+            body,
+            headers,
+            conditional,
+            raw,
+            max_size,
+        )
+        if method.upper() != "GET":
+            return await send()
+        key = (
+            url,
+            load_json,
+            conditional,
+            raw,
+            max_size,
+            tuple(sorted((headers or {}).items())),
+        )
+        return await self._coalesce(key, send)
+
+    async def _coalesce(self, key: tuple, factory: Callable[[], Awaitable[T]]) -> T:
+        """Share a request in flight between the identical calls.
+
+        The request runs in its own task. A cancelled caller stops waiting
+        for it; the request itself is only cancelled with its last caller.
+
+        Args:
+            key: The request identifier
+            factory: Coroutine function sending the request
+        Returns:
+            The request result
+        """
+        shared = self._inflight_requests.get(key)
+        if shared is None:
+            shared = [asyncio.ensure_future(factory()), 0]
+            self._inflight_requests[key] = shared
+
+            def forget(_):
+                if self._inflight_requests.get(key) is shared:
+                    del self._inflight_requests[key]
+
+            shared[0].add_done_callback(forget)
+
+        shared[1] += 1
+        try:
+            return await asyncio.shield(shared[0])
+        except asyncio.CancelledError:
+            if shared[1] == 1:
+                shared[0].cancel()
+            raise
+        finally:
+            shared[1] -= 1
+
+    async def _send_request(
+        self,
+        url: str,
+        load_json: bool = True,
+        method: str = "GET",
+        body: Optional[dict] = None,
+        headers: Optional[Dict[str, str]] = None,
+        conditional: bool = False,
+        raw: bool = False,
+        max_size: Optional[int] = None,
+    ) -> Tuple[Union[dict, str, bytes], Optional[str]]:
+        """Send a single request to the third party service.
+
+        Args:
+            url: Full URL to request
+            load_json: Is the response of JSON type
+            method: HTTP method
+            body: Request body; None if no body
+            headers: Request headers as dictionary; None if no headers
+            conditional: Whether to send a conditional request
+            raw: Whether to return the response body bytes
+            max_size: Maximal size in bytes of the raw response body; the
+                download is aborted past it and None is returned
+        Returns:
+            The response (see ``_call_provider``) and the next page URL if any
         """
         if not self._config.access_token:
             raise tornado.web.HTTPError(
@@ -156,28 +1240,24 @@ class PullRequestsManager(abc.ABC):
                 reason="No access token specified. Please set PRConfig.access_token in your user jupyter_server_config file.",
             )
 
+        headers = dict(headers or {})
         if body is not None:
-            if headers is None:
-                headers = {}
             headers["Content-Type"] = "application/json"
             body = tornado.escape.json_encode(body)
 
-        if (not url.startswith(self.base_api_url)) and (not re.search("^https?:", url)):
-            url = url_path_join(self.base_api_url, url)
+        cached = self._conditional_cache.get(url) if conditional else None
+        if cached is not None:
+            headers["If-None-Match"] = cached[0]
 
-        with_pagination = False
-        if (
-            load_json
-            and has_pagination
-            and method.lower() == "get"
-            and self.per_page_argument is not None
-        ):
-            with_pagination = True
-            params = params or {}
-            params.update([self.per_page_argument])
+        chunks = []
+        received = 0
 
-        if params is not None:
-            url = tornado.httputil.url_concat(url, params)
+        def receive(chunk: bytes) -> None:
+            nonlocal received
+            received += len(chunk)
+            if received > max_size:
+                raise ValueError(f"Response body larger than {max_size} bytes")
+            chunks.append(chunk)
 
         # User agents required for Github API, see https://developer.github.com/v3/#user-agent-required
         request = tornado.httpclient.HTTPRequest(
@@ -186,53 +1266,41 @@ class PullRequestsManager(abc.ABC):
             method=method.upper(),
             body=body,
             headers=headers,
+            streaming_callback=receive if max_size is not None else None,
         )
 
         self.log.debug(f"{method.upper()} {url}")
         try:
-            response = await self._client.fetch(request)
-            result = response.body.decode("utf-8")
+            try:
+                response = await self._client.fetch(request)
+            except Exception:
+                if max_size is not None and received > max_size:
+                    # The streaming callback aborted the download
+                    return None, None
+                raise
+            if request.method == "HEAD":
+                return response.headers, None
+            if raw:
+                if max_size is not None:
+                    return b"".join(chunks), None
+                return response.body, None
+            next_url = None
             if load_json:
-                # Handle pagination
-                # Assume the link to be a comma separated list of <url>; rel="relation"
-                # where the next chunk has `relation`=next
-                link = response.headers.get("Link")
-                next_url = None
-                if link is not None:
-                    for e in link.split(","):
-                        args = e.strip().split(";")
-                        data = args[0]
-                        metadata = {
-                            k.strip(): v.strip().strip('"')
-                            for k, v in map(lambda s: s.strip().split("="), args[1:])
-                        }
-                        if metadata.get("rel", "") == "next":
-                            next_url = data[1:-1]
-                            break
-
-                new_ = json.loads(result)
-                if next_url is not None:
-                    next_ = await self._call_provider(
-                        next_url,
-                        load_json=load_json,
-                        method=method,
-                        body=body,
-                        headers=headers,
-                        has_pagination=False,  # Relevant query arguments should be part of the link header
-                    )
-                    if not isinstance(new_, list):
-                        new_ = [new_]
-                    if not isinstance(next_, list):
-                        next_ = [next_]
-                    return new_ + next_
-                else:
-                    if with_pagination and not isinstance(new_, list):
-                        return [new_]
-                    else:
-                        return new_
+                next_url = self._get_next_url(response.headers.get("Link"))
+                result = await self._executor.loads("decode", response.body)
             else:
-                return result
+                result = response.body.decode("utf-8")
+            if conditional and "ETag" in response.headers:
+                self._conditional_cache[url] = (response.headers["ETag"], result)
+                self._conditional_cache.move_to_end(url)
+                if len(self._conditional_cache) > CONDITIONAL_CACHE_SIZE:
+                    self._conditional_cache.popitem(last=False)
+            return result, next_url
         except tornado.httpclient.HTTPClientError as e:
+            if e.code == http.HTTPStatus.NOT_MODIFIED and cached is not None:
+                if url in self._conditional_cache:
+                    self._conditional_cache.move_to_end(url)
+                return cached[1], None
             self.log.debug(
                 f"Failed to fetch {request.method} {request.url}", exc_info=e
             )
@@ -249,6 +1317,8 @@ class PullRequestsManager(abc.ABC):
             raise tornado.web.HTTPError(
                 status_code=e.code, reason=f"Invalid response in '{url}': {message}"
             ) from e
+        except asyncio.CancelledError:
+            raise
         except (json.JSONDecodeError, UnicodeDecodeError) as e:
             self.log.error("Failed to decode the response", exc_info=e)
             raise tornado.web.HTTPError(
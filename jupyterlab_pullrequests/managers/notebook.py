@@ -0,0 +1,191 @@
+"""Helpers to compute the diff of notebooks on the server."""
+import difflib
+import hashlib
+import json
+from typing import Dict, List, Tuple
+
+import nbformat
+
+
+def read_notebook(content: str) -> Tuple[nbformat.NotebookNode, bool]:
+    """Read a notebook content.
+
+    Args:
+        content: Notebook content; empty string for a missing file
+    Returns:
+        The notebook in format version 4 and whether all its cells had an ``id``
+        before conversion (converting may generate random ids)
+    """
+    if not content:
+        return nbformat.v4.new_notebook(), True
+    notebook = nbformat.from_dict(json.loads(content))
+    has_ids = notebook.get("nbformat", 0) >= 4 and all(
+        "id" in cell for cell in notebook.get("cells", [])
+    )
+    return nbformat.convert(notebook, 4), has_ids
+
+
+def _cell_key(cell: dict, use_ids: bool) -> str:
+    if use_ids:
+        return cell["id"]
+    return hashlib.sha1(
+        json.dumps([cell["cell_type"], cell["source"]]).encode("utf-8")
+    ).hexdigest()
+
+
+def _same_cell(base: dict, head: dict) -> bool:
+    # Ignore ids as they may have been generated when converting the notebook
+    return {k: v for k, v in base.items() if k != "id"} == {
+        k: v for k, v in head.items() if k != "id"
+    }
+
+
+def _placeholder(base_index: int, head_index: int, cell: dict) -> dict:
+    placeholder = {
+        "status": "unchanged",
+        "baseIndex": base_index,
+        "headIndex": head_index,
+        "cellType": cell["cell_type"],
+    }
+    if "id" in cell:
+        placeholder["id"] = cell["id"]
+    return placeholder
+
+
+def _removed(base_index: int, cell: dict) -> dict:
+    return {"status": "removed", "baseIndex": base_index, "base": cell}
+
+
+def _added(head_index: int, cell: dict) -> dict:
+    return {"status": "added", "headIndex": head_index, "head": cell}
+
+
+def _modified(base_index: int, head_index: int, base: dict, head: dict) -> dict:
+    return {
+        "status": "modified",
+        "baseIndex": base_index,
+        "headIndex": head_index,
+        "base": base,
+        "head": head,
+    }
+
+
+def _output_mimetypes(output: dict) -> List[str]:
+    output_type = output.get("output_type")
+    if output_type == "stream":
+        return [f"application/vnd.jupyter.{output.get('name', 'stdout')}"]
+    elif output_type == "error":
+        return ["application/vnd.jupyter.error"]
+    else:
+        return list(output.get("data", {}).keys())
+
+
+def stub_outputs(
+    notebook_diff: dict, max_size: int
+) -> Tuple[dict, Dict[str, Tuple[dict, int]]]:
+    """Replace the outputs larger than max_size by stubs in a notebook diff.
+
+    A stub keeps the output type (and execution count) of the original output
+    and has a ``stub`` entry describing it::
+
+        {"output_type": "display_data", "stub": {"hash": str, "size": int, "mimeTypes": [str]}}
+
+    Args:
+        notebook_diff: Notebook diff as returned by ``diff_notebooks``; it is not modified
+        max_size: Size in bytes of the JSON serialized output above which it is stubbed
+    Returns:
+        The notebook diff with stubs and the stubbed outputs as {hash: (output, size)}
+    """
+    outputs = {}  # type: Dict[str, Tuple[dict, int]]
+
+    def stub_cell(cell: dict) -> dict:
+        new_outputs = []
+        for output in cell.get("outputs", []):
+            serialized = json.dumps(output, sort_keys=True)
+            size = len(serialized)
+            if size <= max_size:
+                new_outputs.append(output)
+                continue
+
+            output_hash = hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+            outputs[output_hash] = (output, size)
+            stub = {
+                "output_type": output["output_type"],
+                "stub": {
+                    "hash": output_hash,
+                    "size": size,
+                    "mimeTypes": _output_mimetypes(output),
+                },
+            }
+            if "execution_count" in output:
+                stub["execution_count"] = output["execution_count"]
+            new_outputs.append(stub)
+        return {**cell, "outputs": new_outputs} if "outputs" in cell else cell
+
+    cells = []
+    for cell in notebook_diff["cells"]:
+        cell = cell.copy()
+        for side in ("base", "head"):
+            if side in cell:
+                cell[side] = stub_cell(cell[side])
+        cells.append(cell)
+
+    return {**notebook_diff, "cells": cells}, outputs
+
+
+def diff_notebooks(base: str, head: str) -> Dict[str, object]:
+    """Compute the cells diff between two notebook versions.
+
+    Cells are matched using their ``id`` if all cells have one (nbformat >= 4.5),
+    otherwise using their type and source. Only the changed cells are returned
+    in full; the unchanged ones are replaced by a placeholder with their indexes.
+
+    Args:
+        base: Base notebook content; empty string if the file does not exist
+        head: Head notebook content; empty string if the file does not exist
+    Returns:
+        The notebooks metadata and the list of cells with their status
+        (``unchanged``, ``modified``, ``added`` or ``removed``)
+    """
+    base_nb, base_has_ids = read_notebook(base)
+    head_nb, head_has_ids = read_notebook(head)
+    base_cells = base_nb.cells
+    head_cells = head_nb.cells
+
+    use_ids = base_has_ids and head_has_ids
+    matcher = difflib.SequenceMatcher(
+        None,
+        [_cell_key(c, use_ids) for c in base_cells],
+        [_cell_key(c, use_ids) for c in head_cells],
+        autojunk=False,
+    )
+
+    cells = []  # type: List[dict]
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            for i, j in zip(range(i1, i2), range(j1, j2)):
+                if _same_cell(base_cells[i], head_cells[j]):
+                    cells.append(_placeholder(i, j, head_cells[j]))
+                else:
+                    cells.append(_modified(i, j, base_cells[i], head_cells[j]))
+        elif tag == "replace":
+            # Pair cells of the same type as modified ones
+            for i, j in zip(range(i1, i2), range(j1, j2)):
+                if base_cells[i]["cell_type"] == head_cells[j]["cell_type"]:
+                    cells.append(_modified(i, j, base_cells[i], head_cells[j]))
+                else:
+                    cells.append(_removed(i, base_cells[i]))
+                    cells.append(_added(j, head_cells[j]))
+            paired = min(i2 - i1, j2 - j1)
+            cells.extend(_removed(i, base_cells[i]) for i in range(i1 + paired, i2))
+            cells.extend(_added(j, head_cells[j]) for j in range(j1 + paired, j2))
+        elif tag == "delete":
+            cells.extend(_removed(i, base_cells[i]) for i in range(i1, i2))
+        else:  # tag == "insert"
+            cells.extend(_added(j, head_cells[j]) for j in range(j1, j2))
+
+    return {
+        "base": {"metadata": base_nb.metadata, "cellsCount": len(base_cells)},
+        "head": {"metadata": head_nb.metadata, "cellsCount": len(head_cells)},
+        "cells": cells,
+    }
@@ -0,0 +1,30 @@
+"""
+Prometheus metrics exported by the extension.
+
+They are served with the Jupyter Server metrics on its ``/metrics`` endpoint.
+Read https://prometheus.io/docs/practices/naming/ for naming conventions.
+"""
+from prometheus_client import Counter, Histogram
+
+CPU_TASK_DURATION_SECONDS = Histogram(
+    "jupyterlab_pullrequests_cpu_task_duration_seconds",
+    "duration in seconds of the CPU-bound tasks labeled by task and by where they ran",
+    ["task", "executor"],
+)
+
+EVENT_LOOP_LAG_SECONDS = Histogram(
+    "jupyterlab_pullrequests_event_loop_lag_seconds",
+    "delay in seconds of the event loop watchdog callbacks",
+)
+
+EVENT_LOOP_STALLS_TOTAL = Counter(
+    "jupyterlab_pullrequests_event_loop_stalls_total",
+    "number of event loop stalls labeled by the running handler or manager function",
+    ["section"],
+)
+
+EVENT_LOOP_STALL_SECONDS = Histogram(
+    "jupyterlab_pullrequests_event_loop_stall_seconds",
+    "duration in seconds of the event loop stalls labeled by the running handler or manager function",
+    ["section"],
+)
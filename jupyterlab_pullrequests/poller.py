@@ -0,0 +1,166 @@
+"""
+Background pollers pushing pull request updates to the subscribed clients.
+"""
+import asyncio
+from typing import TYPE_CHECKING
+
+import tornado
+
+from .log import get_logger
+
+if TYPE_CHECKING:
+    from .managers.manager import PullRequestsManager
+
+# Maximal polling interval after consecutive failures, in polling intervals
+MAX_BACKOFF = 16
+
+
+class PullRequestPoller:
+    """Poll the status of a pull request and publish its changes.
+
+    A single poller is shared by all the clients subscribed to a pull request;
+    so the number of requests to the provider does not depend on the number
+    of clients. It only runs while there are subscribers.
+
+    The published events are dictionaries with a ``type`` key:
+
+    - status: the current status when subscribing
+      ({"headSha", "state", "commentsCount", "updatedAt"})
+    - head: the head commit changed ({"headSha"})
+    - state: the pull request state changed, e.g. closed ({"state"})
+    - comments: the number of comments changed ({"commentsCount"})
+    - error: the status cannot be polled ({"error"}); the polling interval
+      doubles with each consecutive failure up to ``MAX_BACKOFF`` intervals
+
+    Args:
+        manager: Pull requests manager
+        pr_id: pull request ID endpoint
+        interval: Polling interval in seconds
+    """
+
+    def __init__(
+        self, manager: "PullRequestsManager", pr_id: str, interval: float
+    ) -> None:
+        self._manager = manager
+        self._pr_id = pr_id
+        self._interval = interval
+        self._status = None  # type: Optional[Dict[str, Union[str, int]]]
+        self._subscribers = set()  # type: Set[asyncio.Queue]
+        self._task = None  # type: Optional[asyncio.Future]
+
+    @property
+    def has_subscribers(self) -> bool:
+        return len(self._subscribers) > 0
+
+    def subscribe(self) -> asyncio.Queue:
+        """Subscribe to the pull request events.
+
+        Returns:
+            The queue receiving the events
+        """
+        queue = asyncio.Queue()
+        if self._status is not None:
+            queue.put_nowait({"type": "status", **self._status})
+        self._subscribers.add(queue)
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        """Unsubscribe from the pull request events.
+
+        Args:
+            queue: The queue returned by ``subscribe``
+        """
+        self._subscribers.discard(queue)
+        if not self._subscribers and self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _publish(self, event: dict) -> None:
+        for queue in self._subscribers:
+            queue.put_nowait(event)
+
+    async def _run(self) -> None:
+        failures = 0
+        while True:
+            try:
+                status = await self._manager.get_pull_request_status(self._pr_id)
+            except NotImplementedError:
+                self._publish(
+                    {"type": "error", "error": "Pull request updates are not supported."}
+                )
+                return
+            except asyncio.CancelledError:
+                raise
+            except tornado.web.HTTPError as e:
+                get_logger().warning(
+                    f"Failed to poll pull request {self._pr_id}: {e.reason}"
+                )
+                self._publish({"type": "error", "error": e.reason})
+                failures += 1
+            except Exception as e:
+                get_logger().error(
+                    f"Failed to poll pull request {self._pr_id}", exc_info=e
+                )
+                self._publish({"type": "error", "error": f"Unknown error: {e}"})
+                failures += 1
+            else:
+                failures = 0
+                if self._status is None:
+                    self._publish({"type": "status", **status})
+                else:
+                    if status["headSha"] != self._status["headSha"]:
+                        self._publish({"type": "head", "headSha": status["headSha"]})
+                    if status["state"] != self._status["state"]:
+                        self._publish({"type": "state", "state": status["state"]})
+                    if status["commentsCount"] != self._status["commentsCount"]:
+                        self._publish(
+                            {"type": "comments", "commentsCount": status["commentsCount"]}
+                        )
+                self._status = status
+
+            await asyncio.sleep(self._interval * min(2 ** failures, MAX_BACKOFF))
+
+
+class PullRequestPollers:
+    """Registry of the pull request pollers.
+
+    Args:
+        manager: Pull requests manager
+        interval: Polling interval in seconds
+    """
+
+    def __init__(self, manager: "PullRequestsManager", interval: float) -> None:
+        self._manager = manager
+        self._interval = interval
+        self._pollers = {}  # type: Dict[str, PullRequestPoller]
+
+    def subscribe(self, pr_id: str) -> asyncio.Queue:
+        """Subscribe to a pull request events.
+
+        Args:
+            pr_id: pull request ID endpoint
+        Returns:
+            The queue receiving the events
+        """
+        poller = self._pollers.get(pr_id)
+        if poller is None:
+            poller = PullRequestPoller(self._manager, pr_id, self._interval)
+            self._pollers[pr_id] = poller
+        return poller.subscribe()
+
+    def unsubscribe(self, pr_id: str, queue: asyncio.Queue) -> None:
+        """Unsubscribe from a pull request events.
+
+        The poller is stopped when it has no more subscribers.
+
+        Args:
+            pr_id: pull request ID endpoint
+            queue: The queue returned by ``subscribe``
+        """
+        poller = self._pollers.get(pr_id)
+        if poller is not None:
+            poller.unsubscribe(queue)
+            if not poller.has_subscribers:
+                del self._pollers[pr_id]
@@ -46,4 +46,6 @@ def pr_gitlab_manger(pr_base_config):
 @pytest.fixture
 def pr_valid_gitlab_manager(pr_gitlab_manger):
     pr_gitlab_manger._config.access_token = "valid"
+    # Unknown server version; tests needing it call check_server_version
+    pr_gitlab_manger._server_version_checked = True
     return pr_gitlab_manger
@@ -0,0 +1,152 @@
+import asyncio
+
+import pytest
+from tornado.web import HTTPError
+
+from jupyterlab_pullrequests.base import CommentReply, NewComment
+from jupyterlab_pullrequests.comment_queue import CommentQueue
+
+
+class FakeManager:
+    base_api_url = "https://api.github.com"
+
+    def __init__(self, results):
+        self.results = list(results)
+        self.posted = []
+
+    def invalidate_cached(self, endpoint, *key):
+        pass
+
+    async def post_comment(self, pr_id, body):
+        self.posted.append((pr_id, body))
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+async def wait_for_status(queue, comment_id, status):
+    for _ in range(100):
+        comment = queue.get(comment_id)
+        if comment["status"] == status:
+            return comment
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"Comment status is {comment['status']}")
+
+
+@pytest.mark.asyncio
+async def test_CommentQueue_retry(tmp_path):
+    manager = FakeManager([HTTPError(502, reason="Bad gateway"), {"id": 42}])
+    queue = CommentQueue(manager, str(tmp_path / "comments.db"), retry_delay=0.01)
+
+    queued = queue.add("pr1", NewComment("text", "a.py", 3, None))
+
+    assert queued["id"].startswith("queued-")
+    assert queued["status"] == "pending"
+    assert queued["text"] == "text"
+    comment = await wait_for_status(queue, queued["id"], "sent")
+    assert comment["comment"] == {"id": 42}
+    assert comment["attempts"] == 2
+    assert comment["error"] is None
+    assert manager.posted == [("pr1", NewComment("text", "a.py", 3, None))] * 2
+    queue.stop()
+
+
+@pytest.mark.asyncio
+async def test_CommentQueue_rejected(tmp_path):
+    manager = FakeManager([HTTPError(422, reason="Invalid line"), {"id": 43}])
+    queue = CommentQueue(manager, str(tmp_path / "comments.db"), retry_delay=0.01)
+
+    rejected = queue.add("pr1", NewComment("text", "a.py", 1000, None))
+    reply = queue.add("pr1", CommentReply("reply", "a.py", "12"))
+
+    # Client errors are not retried and do not block the next comments
+    comment = await wait_for_status(queue, rejected["id"], "failed")
+    assert comment["error"] == "Invalid line"
+    await wait_for_status(queue, reply["id"], "sent")
+    assert [c["id"] for c in queue.get_comments("pr1")] == [rejected["id"], reply["id"]]
+    queue.stop()
+
+
+@pytest.mark.asyncio
+async def test_CommentQueue_order(tmp_path):
+    manager = FakeManager([HTTPError(502, reason="Bad gateway"), {"id": 1}, {"id": 2}, {"id": 3}])
+    queue = CommentQueue(manager, str(tmp_path / "comments.db"), retry_delay=0.05)
+
+    first = queue.add("pr1", NewComment("first", None, None, None))
+    second = queue.add("pr1", NewComment("second", None, None, None))
+    other = queue.add("pr2", NewComment("other", None, None, None))
+
+    await wait_for_status(queue, second["id"], "sent")
+    # A retried comment is not overtaken by the next ones of its pull request
+    assert [(pr_id, body.text) for pr_id, body in manager.posted] == [
+        ("pr1", "first"),
+        ("pr2", "other"),
+        ("pr1", "first"),
+        ("pr1", "second"),
+    ]
+    assert queue.get(first["id"])["comment"] == {"id": 2}
+    assert queue.get(other["id"])["status"] == "sent"
+    queue.stop()
+
+
+@pytest.mark.asyncio
+async def test_CommentQueue_reply_to_queued(tmp_path):
+    manager = FakeManager(
+        [
+            {"id": 42, "inReplyTo": "discussion-id"},
+            {"id": 43, "inReplyTo": None},
+            {"id": 44, "inReplyTo": None},
+        ]
+    )
+    queue = CommentQueue(manager, str(tmp_path / "comments.db"))
+
+    parent = queue.add("pr1", NewComment("text", "a.py", 3, None))
+    reply = queue.add("pr1", CommentReply("reply", "a.py", parent["id"]))
+    nested = queue.add("pr1", CommentReply("reply to reply", "a.py", reply["id"]))
+
+    comment = await wait_for_status(queue, nested["id"], "sent")
+    # The queued IDs are replaced by the discussion of the delivered comment
+    assert [body.inReplyTo for _, body in manager.posted[1:]] == ["discussion-id"] * 2
+    assert comment["inReplyTo"] == "discussion-id"
+    queue.stop()
+
+
+@pytest.mark.asyncio
+async def test_CommentQueue_reply_to_failed(tmp_path):
+    manager = FakeManager([HTTPError(422, reason="Invalid line")])
+    queue = CommentQueue(manager, str(tmp_path / "comments.db"))
+
+    parent = queue.add("pr1", NewComment("text", "a.py", 1000, None))
+    reply = queue.add("pr1", CommentReply("reply", "a.py", parent["id"]))
+
+    comment = await wait_for_status(queue, reply["id"], "failed")
+    assert comment["error"] == f"Replied comment {parent['id']} was not delivered."
+    assert len(manager.posted) == 1
+    queue.stop()
+
+
+class BlockedManager(FakeManager):
+    async def post_comment(self, pr_id, body):
+        await asyncio.Event().wait()
+
+
+@pytest.mark.asyncio
+async def test_CommentQueue_durable(tmp_path):
+    path = str(tmp_path / "comments.db")
+    queue = CommentQueue(BlockedManager([]), path)
+    queued = queue.add("pr1", CommentReply("reply", None, "12"))
+    await wait_for_status(queue, queued["id"], "sending")
+    # Stop the server while sending
+    queue.stop()
+    await asyncio.sleep(0)
+
+    # The comments are delivered after a restart
+    manager = FakeManager([{"id": 44}])
+    restarted = CommentQueue(manager, path)
+    restarted.start()
+
+    comment = await wait_for_status(restarted, queued["id"], "sent")
+    assert comment["comment"] == {"id": 44}
+    assert manager.posted == [("pr1", CommentReply("reply", None, "12"))]
+    restarted.stop()
@@ -0,0 +1,134 @@
+import pytest
+
+from jupyterlab_pullrequests.managers.diff import LineMapping, parse_patch, slice_lines
+
+
+@pytest.mark.parametrize(
+    "patch, expected",
+    (
+        (None, []),
+        ("", []),
+        ("Binary files differ", []),
+        (
+            "@@ -1 +1 @@\n-a\n+b",
+            [
+                {
+                    "oldStart": 1,
+                    "oldLines": 1,
+                    "newStart": 1,
+                    "newLines": 1,
+                    "header": "",
+                    "lines": ["-a", "+b"],
+                }
+            ],
+        ),
+        (
+            "@@ -1,2 +1,3 @@ def foo():\n a\n+b\n c\n\\ No newline at end of file\n@@ -10,0 +11,1 @@\n+d\n",
+            [
+                {
+                    "oldStart": 1,
+                    "oldLines": 2,
+                    "newStart": 1,
+                    "newLines": 3,
+                    "header": "def foo():",
+                    "lines": [" a", "+b", " c", "\\ No newline at end of file"],
+                },
+                {
+                    "oldStart": 10,
+                    "oldLines": 0,
+                    "newStart": 11,
+                    "newLines": 1,
+                    "header": "",
+                    "lines": ["+d"],
+                },
+            ],
+        ),
+    ),
+)
+def test_parse_patch(patch, expected):
+    assert parse_patch(patch) == expected
+
+
+@pytest.mark.parametrize(
+    "start, end, expected",
+    (
+        (1, 2, ["1", "2"]),
+        (0, 1, ["1"]),
+        (3, 10, ["3"]),
+        (4, 10, []),
+    ),
+)
+def test_slice_lines(start, end, expected):
+    result = slice_lines("1\n2\n3\n", start, end)
+    assert result["lines"] == expected
+    assert result["totalLines"] == 3
+
+
+PATCH = """@@ -9,10 +9,12 @@ Section
+ a
+ b
+
++c
++
+ d
+ e
+
+-f
++g
+ h
+
+ i
+"""
+
+
+@pytest.mark.parametrize(
+    "patch, old_line, new_line",
+    (
+        (None, 5, 5),
+        (PATCH, 1, 1),
+        (PATCH, 11, 11),
+        (PATCH, 12, 14),
+        (PATCH, 14, 16),
+        (PATCH, 15, None),
+        (PATCH, None, 17),
+        (PATCH, None, 12),
+        (PATCH, 16, 18),
+        (PATCH, 19, 21),
+        (PATCH, 100, 102),
+        ("@@ -0,0 +1,2 @@\n+a\n+b", None, 1),
+        ("@@ -1,2 +0,0 @@\n-a\n-b", 2, None),
+        ("@@ -5,0 +6,2 @@\n+a\n+b", 5, 5),
+        ("@@ -5,0 +6,2 @@\n+a\n+b", 6, 8),
+        ("@@ -5,0 +6,2 @@\n+a\n+b", None, 7),
+        ("@@ -1 +1 @@\n-a\n\\ No newline at end of file\n+b", 2, 2),
+    ),
+)
+def test_LineMapping(patch, old_line, new_line):
+    mapping = LineMapping(parse_patch(patch))
+
+    if old_line is not None:
+        assert mapping.to_new(old_line) == new_line
+    if new_line is not None:
+        assert mapping.to_old(new_line) == old_line
+
+
+@pytest.mark.parametrize(
+    "old_line, new_line",
+    (
+        (1, 1),
+        (2, None),
+        (None, 2),
+        (3, 3),
+        (4, 4),
+        (None, 5),
+        (None, 6),
+        (5, 7),
+    ),
+)
+def test_LineMapping_from_contents(old_line, new_line):
+    mapping = LineMapping.from_contents("a\nb\nc\nd\ne\n", "a\nx\nc\nd\ny\nz\ne\n")
+
+    if old_line is not None:
+        assert mapping.to_new(old_line) == new_line
+    if new_line is not None:
+        assert mapping.to_old(new_line) == old_line
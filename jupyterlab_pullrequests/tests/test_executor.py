@@ -0,0 +1,132 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+from prometheus_client import REGISTRY
+
+from jupyterlab_pullrequests.executor import TaskExecutor, estimate_size
+
+
+def task_count(task, executor):
+    return (
+        REGISTRY.get_sample_value(
+            "jupyterlab_pullrequests_cpu_task_duration_seconds_count",
+            {"task": task, "executor": executor},
+        )
+        or 0
+    )
+
+
+def current_thread_name():
+    return threading.current_thread().name
+
+
+def test_estimate_size():
+    data = {"base": {"content": "a" * 100}, "head": [1, None, "bc"]}
+
+    assert estimate_size(data, 1000) == pytest.approx(len(json.dumps(data)), rel=0.2)
+    # The estimation stops once the limit is exceeded
+    data = ["a" * 100] * 1000
+    assert estimate_size(data, 200) < len(json.dumps(data)) / 10
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "kind, size, expected",
+    (
+        ("thread", 10, "inline"),
+        ("thread", 100, "thread"),
+        ("none", 100, "inline"),
+    ),
+)
+async def test_TaskExecutor_run(kind, size, expected):
+    executor = TaskExecutor(kind, 1, 100)
+    count = task_count("test_run", expected)
+
+    thread_name = await executor.run("test_run", size, current_thread_name)
+
+    assert (thread_name == threading.current_thread().name) == (expected == "inline")
+    assert task_count("test_run", expected) == count + 1
+
+
+@pytest.mark.asyncio
+async def test_TaskExecutor_process():
+    executor = TaskExecutor("process", 1, 0)
+    count = task_count("test_process", "process")
+
+    result = await executor.run("test_process", 10, json.loads, '{"a": [1, 2]}')
+
+    assert result == {"a": [1, 2]}
+    assert task_count("test_process", "process") == count + 1
+
+
+@pytest.mark.asyncio
+async def test_TaskExecutor_error():
+    executor = TaskExecutor("thread", 1, 0)
+
+    with pytest.raises(json.JSONDecodeError):
+        await executor.run("test_error", 10, json.loads, "{")
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("kind", ("thread", "process"))
+async def test_TaskExecutor_dumps(kind):
+    executor = TaskExecutor(kind, 1, 100)
+    # The JSON encoder holds the GIL; so it runs in a process
+    count = task_count("test_dumps", "process")
+
+    assert await executor.dumps("test_dumps", {"a": 1}) == b'{"a": 1}'
+    assert await executor.dumps("test_dumps", ["a" * 100]) == json.dumps(["a" * 100]).encode()
+    assert task_count("test_dumps", "process") == count + 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("kind", ("thread", "process"))
+async def test_TaskExecutor_loads(kind):
+    executor = TaskExecutor(kind, 1, 10)
+    count = task_count("test_loads", "process")
+
+    assert await executor.loads("test_loads", b'{"a": [1, 2, 3]}') == {"a": [1, 2, 3]}
+    assert task_count("test_loads", "process") == count + 1
+
+
+async def max_loop_gap(awaitable):
+    """Await a task and measure the longest event loop blocking meanwhile."""
+    ticks = {"last": time.perf_counter(), "max": 0.0}
+
+    async def tick():
+        while True:
+            await asyncio.sleep(0.001)
+            now = time.perf_counter()
+            ticks["max"] = max(ticks["max"], now - ticks["last"])
+            ticks["last"] = now
+
+    ticker = asyncio.ensure_future(tick())
+    try:
+        result = await awaitable
+    finally:
+        ticker.cancel()
+    return result, max(ticks["max"], time.perf_counter() - ticks["last"])
+
+
+@pytest.mark.asyncio
+async def test_TaskExecutor_json_frees_loop():
+    # Large file contents; each character is escaped
+    data = {"base": {"content": '"\n' * 2_000_000}, "head": {"content": '\\"' * 2_000_000}}
+    start = time.perf_counter()
+    document = json.dumps(data).encode("utf-8")
+    json.loads(document)
+    inline = time.perf_counter() - start
+    executor = TaskExecutor("thread", 1, 1024)
+    # Start the worker process
+    await executor.loads("test_frees_loop", b"[" + b" " * 1024 + b"]")
+
+    encoded, encode_gap = await max_loop_gap(executor.dumps("test_frees_loop", data))
+    decoded, decode_gap = await max_loop_gap(executor.loads("test_frees_loop", document))
+
+    assert encoded == document
+    assert decoded == data
+    # Only the transfer of the task input and output blocks the loop
+    assert encode_gap + decode_gap < inline / 2
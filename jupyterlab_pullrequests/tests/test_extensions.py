@@ -1,8 +1,26 @@
+import subprocess
+import sys
+
+import pytest
+from mock import AsyncMock, MagicMock
+from traitlets.config import Config
+
 from .. import (
     _jupyter_labextension_paths,
     _jupyter_server_extension_points,
     _load_jupyter_server_extension,
 )
+from ..handlers import LazyManager
+
+# Modules only imported on first use of the manager
+LAZY_MODULES = (
+    "jupyterlab_pullrequests.executor",
+    "jupyterlab_pullrequests.managers.github",
+    "jupyterlab_pullrequests.managers.gitlab",
+    "jupyterlab_pullrequests.managers.manager",
+    "jupyterlab_pullrequests.managers.notebook",
+    "jupyterlab_pullrequests.metrics",
+)
 
 
 def test_labextension():
@@ -15,3 +33,51 @@ def test_server_extension():
 
 def test_load_extension(jp_serverapp):
     _load_jupyter_server_extension(jp_serverapp)
+
+
+def test_LazyManager_creates_manager_on_first_use():
+    config = Config()
+    entry_point = MagicMock()
+    manager = LazyManager(entry_point, config, MagicMock())
+
+    entry_point.load.assert_not_called()
+
+    instance = entry_point.load.return_value.return_value
+    assert manager.base_api_url is instance.base_api_url
+    assert manager.get_current_user is instance.get_current_user
+    entry_point.load.assert_called_once()
+    entry_point.load.return_value.assert_called_once_with(config)
+
+
+@pytest.mark.asyncio
+async def test_LazyManager_warm_up():
+    entry_point = MagicMock()
+    entry_point.load.return_value.return_value.get_current_user = AsyncMock(
+        side_effect=RuntimeError("unreachable")
+    )
+    log = MagicMock()
+    manager = LazyManager(entry_point, Config(), log)
+
+    # Failures are only logged
+    await manager.warm_up()
+
+    entry_point.load.return_value.return_value.get_current_user.assert_awaited_once()
+    log.warning.assert_called_once_with("PR Manager warm-up failed: unreachable")
+
+
+def test_import_lazy():
+    # The managers and their dependencies must only be imported on first use
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys; import jupyter_server.serverapp; import jupyterlab_pullrequests.handlers; print('\\n'.join(sys.modules))",
+        ],
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    modules = set(result.stdout.splitlines())
+
+    assert "jupyterlab_pullrequests.handlers" in modules
+    assert modules.isdisjoint(LAZY_MODULES)
@@ -1,9 +1,11 @@
+import base64
 import json
 import pathlib
 from http import HTTPStatus
 
 import pytest
 from mock import AsyncMock, MagicMock, call, patch
+from tornado.httpclient import HTTPClientError
 from tornado.web import HTTPError
 
 from jupyterlab_pullrequests.base import CommentReply, NewComment
@@ -18,6 +20,20 @@ def read_sample_response(filename):
     )
 
 
+def content_response(content: bytes):
+    """Mock GitHub contents API response for a file inlining its content"""
+    return MagicMock(
+        body=json.dumps(
+            {
+                "type": "file",
+                "size": len(content),
+                "encoding": "base64",
+                "content": base64.b64encode(content).decode("ascii"),
+            }
+        ).encode("utf-8")
+    )
+
+
 @pytest.mark.asyncio
 @patch("tornado.httpclient.AsyncHTTPClient.fetch", new_callable=AsyncMock)
 async def test_GitHubManager_user_pat_empty(mock_call_provider, pr_github_manager):
@@ -35,31 +51,34 @@ async def test_GitHubManager_user_pat_valid(mock_call_provider, pr_valid_github_
     result = await pr_valid_github_manager.get_current_user()
 
     assert result == {"username": "timnlupo"}
+    # The user is requested only once
+    assert await pr_valid_github_manager.get_current_user() == result
+    mock_call_provider.assert_called_once()
 
 
 @pytest.mark.asyncio
-@patch(
-    "jupyterlab_pullrequests.managers.github.GitHubManager._call_github",
-    new_callable=AsyncMock,
-)
+@patch("tornado.httpclient.AsyncHTTPClient.fetch", new_callable=AsyncMock)
 async def test_GitHubManager_list_prs_created(mock_call_provider, pr_valid_github_manager):
+    mock_call_provider.return_value = read_sample_response("github_list_prs.json")
+
     await pr_valid_github_manager.list_prs("octocat", "created")
 
-    mock_call_provider.assert_called_once_with(
-        "https://api.github.com/search/issues?q=+state:open+type:pr+author:octocat",
+    mock_call_provider.assert_called_once()
+    assert mock_call_provider.call_args[0][0].url == (
+        "https://api.github.com/search/issues?q=+state%3Aopen+type%3Apr+author%3Aoctocat&per_page=100"
     )
 
 
 @pytest.mark.asyncio
-@patch(
-    "jupyterlab_pullrequests.managers.github.GitHubManager._call_github",
-    new_callable=AsyncMock,
-)
+@patch("tornado.httpclient.AsyncHTTPClient.fetch", new_callable=AsyncMock)
 async def test_GitHubManager_list_prs_assigned(mock_call_provider, pr_valid_github_manager):
+    mock_call_provider.return_value = read_sample_response("github_list_prs.json")
+
     await pr_valid_github_manager.list_prs("notoctocat", "assigned")
 
-    mock_call_provider.assert_called_once_with(
-        "https://api.github.com/search/issues?q=+state:open+type:pr+assignee:notoctocat",
+    mock_call_provider.assert_called_once()
+    assert mock_call_provider.call_args[0][0].url == (
+        "https://api.github.com/search/issues?q=+state%3Aopen+type%3Apr+assignee%3Anotoctocat&per_page=100"
     )
 
 
@@ -103,11 +122,12 @@ async def test_GitHubManager_list_files_call(mock_call_provider, pr_valid_github
 async def test_GitHubManager_get_file_diff(mock_call_provider, pr_valid_github_manager):
     mock_call_provider.side_effect = [
         read_sample_response("github_pr_links.json"),
-        MagicMock(body=b"test code content"),
-        MagicMock(body=b"test new code content"),
+        read_sample_response("github_list_files.json"),
+        content_response(b"test code content"),
+        content_response(b"test new code content"),
     ]
     result = await pr_valid_github_manager.get_file_diff("valid-prid", "valid-filename")
-    assert mock_call_provider.call_count == 3
+    assert mock_call_provider.call_count == 4
     assert result == {
         "base": {
             "label": "timnlupo:master",
@@ -122,6 +142,76 @@ async def test_GitHubManager_get_file_diff(mock_call_provider, pr_valid_github_m
     }
 
 
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "filename, responses, force, expected",
+    (
+        # Binary from file name; nothing is downloaded
+        ("image.png", [], False, {"reason": "binary", "size": None}),
+        # Binary from content
+        (
+            "model.bin2",
+            [content_response(b"\x00\x01binary"), content_response(b"\x00\x01binary")],
+            False,
+            {"reason": "binary", "size": 8},
+        ),
+        # Too large; GitHub does not inline the content
+        (
+            "large.csv",
+            [
+                MagicMock(body=b'{"type": "file", "size": 104857600, "encoding": "none", "content": ""}'),
+                MagicMock(body=b'{"type": "file", "size": 104857600, "encoding": "none", "content": ""}'),
+            ],
+            False,
+            {"reason": "oversized", "size": 104857600},
+        ),
+        # Larger than 1 MB and not UTF-8; downloaded separately
+        (
+            "data.dat",
+            [
+                MagicMock(body=b'{"type": "file", "size": 2097152, "encoding": "none", "content": ""}'),
+                MagicMock(body=b'{"type": "file", "size": 2097152, "encoding": "none", "content": ""}'),
+                MagicMock(body=b"\xff" * 2097152),
+                MagicMock(body=b"\xff" * 2097152),
+            ],
+            False,
+            {"reason": "binary", "size": 2097152},
+        ),
+        # Explicit download
+        (
+            "image.png",
+            [MagicMock(body=b"png"), MagicMock(body=b"png")],
+            True,
+            None,
+        ),
+    ),
+)
+@patch("tornado.httpclient.AsyncHTTPClient.fetch", new_callable=AsyncMock)
+async def test_GitHubManager_get_file_diff_skipped(
+    mock_call_provider, filename, responses, force, expected, pr_valid_github_manager
+):
+    mock_call_provider.side_effect = [
+        read_sample_response("github_pr_links.json"),
+        read_sample_response("github_list_files.json"),
+        *responses,
+    ]
+
+    result = await pr_valid_github_manager.get_file_diff("valid-prid", filename, force)
+
+    assert mock_call_provider.call_count == 2 + len(responses)
+    if responses and not force:
+        # The metadata of files larger than 1 MB require the object media type
+        request = mock_call_provider.call_args_list[2][0][0]
+        assert request.headers["Accept"] == "application/vnd.github.object"
+    for side in ("base", "head"):
+        if expected is None:
+            assert result[side]["content"] == "png"
+            assert "skipped" not in result[side]
+        else:
+            assert result[side]["content"] is None
+            assert result[side]["skipped"] == expected
+
+
 @pytest.mark.asyncio
 @patch("tornado.httpclient.AsyncHTTPClient.fetch", new_callable=AsyncMock)
 async def test_GitHubManager_get_threads(mock_call_provider, pr_valid_github_manager):
@@ -230,4 +320,363 @@ async def test_GitHubManager_post_comment_valid_new(mock_call_provider, pr_valid
     assert result == expected_result
 
 
+@pytest.mark.asyncio
+@patch("tornado.httpclient.AsyncHTTPClient.fetch", new_callable=AsyncMock)
+async def test_GitHubManager_post_review(mock_call_provider, pr_valid_github_manager):
+    mock_call_provider.side_effect = [
+        read_sample_response("github_pr_links.json"),
+        MagicMock(body=b'{"id": 80}', headers={}),
+        read_sample_response("github_comments_post.json"),
+    ]
+    pr_id = "https://api.github.com/repos/octocat/repo/pulls/1"
+    pr_valid_github_manager.add_pending_comment(pr_id, NewComment("new", "a.py", 3, None))
+    pr_valid_github_manager.add_pending_comment(pr_id, CommentReply("reply", "a.py", 123))
+    pr_valid_github_manager.add_pending_comment(pr_id, NewComment("old", "b.py", None, 2))
+
+    assert await pr_valid_github_manager.submit_review(pr_id, "Looks good") == 3
+
+    assert mock_call_provider.call_count == 3
+    # The new comments are sent in a single review
+    request = mock_call_provider.call_args_list[1][0][0]
+    assert request.url == f"{pr_id}/reviews"
+    assert json.loads(request.body.decode("utf-8")) == {
+        "commit_id": "02fb374e022fbe7aaa4cd69c0dc3928e6422dfaa",
+        "event": "COMMENT",
+        "body": "Looks good",
+        "comments": [
+            {"body": "new", "path": "a.py", "line": 3, "side": "RIGHT"},
+            {"body": "old", "path": "b.py", "line": 2, "side": "LEFT"},
+        ],
+    }
+    # Replies cannot be part of a review
+    request = mock_call_provider.call_args_list[2][0][0]
+    assert request.url == f"{pr_id}/comments"
+    assert json.loads(request.body.decode("utf-8")) == {
+        "body": "reply",
+        "in_reply_to": 123,
+    }
+    assert pr_valid_github_manager.get_pending_comments(pr_id) == []
+
+
 # TODO test pagination
+
+
+@pytest.mark.asyncio
+@patch("tornado.httpclient.AsyncHTTPClient.fetch", new_callable=AsyncMock)
+async def test_GitHubManager_get_file_patch(mock_call_provider, pr_valid_github_manager):
+    mock_call_provider.side_effect = [
+        read_sample_response("github_list_files.json"),
+        read_sample_response("github_pr_links.json"),
+    ]
+    result = await pr_valid_github_manager.get_file_patch("valid-prid", "README.md")
+    assert mock_call_provider.call_count == 2
+    assert result == {
+        "base": {
+            "label": "timnlupo:master",
+            "sha": "a221b6d04be7fff0737c24e1e335a3091eca81e7",
+        },
+        "head": {
+            "label": "timnlupo:dev",
+            "sha": "02fb374e022fbe7aaa4cd69c0dc3928e6422dfaa",
+        },
+        "hunks": [
+            {
+                "oldStart": 0,
+                "oldLines": 0,
+                "newStart": 1,
+                "newLines": 1,
+                "header": "",
+                "lines": ["+test 2"],
+            }
+        ],
+    }
+
+
+@pytest.mark.asyncio
+@patch("tornado.httpclient.AsyncHTTPClient.fetch", new_callable=AsyncMock)
+async def test_GitHubManager_get_file_patch_fallback(mock_call_provider, pr_valid_github_manager):
+    """Check that the full content is returned if GitHub has no patch for the file"""
+    mock_call_provider.side_effect = [
+        read_sample_response("github_list_files.json"),
+        read_sample_response("github_pr_links.json"),
+        content_response(b"test code content"),
+        content_response(b"test new code content"),
+    ]
+    result = await pr_valid_github_manager.get_file_patch("valid-prid", "data.csv")
+    assert mock_call_provider.call_count == 4
+    assert result["base"]["content"] == "test code content"
+    assert result["head"]["content"] == "test new code content"
+    assert "hunks" not in result
+
+
+@pytest.mark.asyncio
+@patch("tornado.httpclient.AsyncHTTPClient.fetch", new_callable=AsyncMock)
+async def test_GitHubManager_get_file_context(mock_call_provider, pr_valid_github_manager):
+    mock_call_provider.side_effect = [
+        read_sample_response("github_pr_links.json"),
+        read_sample_response("github_list_files.json"),
+        MagicMock(body=b"line 1\nline 2\nline 3\nline 4\n"),
+    ]
+    result = await pr_valid_github_manager.get_file_context(
+        "valid-prid", "valid-filename", "head", 2, 10
+    )
+    assert mock_call_provider.call_count == 3
+    assert mock_call_provider.call_args[0][0].url.endswith(
+        "contents/valid-filename?ref=02fb374e022fbe7aaa4cd69c0dc3928e6422dfaa"
+    )
+    assert result == {
+        "start": 2,
+        "end": 4,
+        "lines": ["line 2", "line 3", "line 4"],
+        "totalLines": 4,
+    }
+
+
+@pytest.mark.asyncio
+@patch("tornado.httpclient.AsyncHTTPClient.fetch", new_callable=AsyncMock)
+async def test_GitHubManager_get_notebook_diff(mock_call_provider, pr_valid_github_manager):
+    notebook = {
+        "cells": [
+            {
+                "cell_type": "markdown",
+                "id": "first",
+                "metadata": {},
+                "source": "# Title",
+            }
+        ],
+        "metadata": {},
+        "nbformat": 4,
+        "nbformat_minor": 5,
+    }
+    mock_call_provider.side_effect = [
+        read_sample_response("github_pr_links.json"),
+        read_sample_response("github_list_files.json"),
+        MagicMock(body=json.dumps(notebook).encode("utf-8")),
+        MagicMock(body=json.dumps(notebook).encode("utf-8")),
+    ]
+
+    result = await pr_valid_github_manager.get_notebook_diff("valid-prid", "test.ipynb")
+
+    assert mock_call_provider.call_count == 4
+    assert result["base"]["sha"] == "a221b6d04be7fff0737c24e1e335a3091eca81e7"
+    assert result["head"]["sha"] == "02fb374e022fbe7aaa4cd69c0dc3928e6422dfaa"
+    assert result["cells"] == [
+        {
+            "status": "unchanged",
+            "baseIndex": 0,
+            "headIndex": 0,
+            "cellType": "markdown",
+            "id": "first",
+        }
+    ]
+
+    # The diff is cached for the pull request revisions
+    cached = await pr_valid_github_manager.get_notebook_diff("valid-prid", "test.ipynb")
+    assert mock_call_provider.call_count == 4
+    assert cached == result
+
+
+@pytest.mark.asyncio
+@patch("tornado.httpclient.AsyncHTTPClient.fetch", new_callable=AsyncMock)
+async def test_GitHubManager_get_notebook_output(mock_call_provider, pr_valid_github_manager):
+    output = {
+        "output_type": "display_data",
+        "data": {"image/png": "A" * 200},
+        "metadata": {},
+    }
+    notebook = {
+        "cells": [
+            {
+                "cell_type": "code",
+                "execution_count": None,
+                "id": "plot",
+                "metadata": {},
+                "outputs": [output],
+                "source": "plot()",
+            }
+        ],
+        "metadata": {},
+        "nbformat": 4,
+        "nbformat_minor": 5,
+    }
+    mock_call_provider.side_effect = [
+        read_sample_response("github_pr_links.json"),
+        read_sample_response("github_list_files.json"),
+        MagicMock(body=b""),
+        MagicMock(body=json.dumps(notebook).encode("utf-8")),
+    ]
+    pr_valid_github_manager._config.max_output_size = 100
+
+    result = await pr_valid_github_manager.get_notebook_diff(
+        "valid-prid", "test.ipynb", stub_outputs=True
+    )
+
+    stub = result["cells"][0]["head"]["outputs"][0]["stub"]
+    assert stub["mimeTypes"] == ["image/png"]
+
+    # Retrieve the output after it was evicted from the cache
+    pr_valid_github_manager._outputs_cache.clear()
+    assert (
+        await pr_valid_github_manager.get_notebook_output(
+            "valid-prid", "test.ipynb", stub["hash"]
+        )
+        == output
+    )
+    assert mock_call_provider.call_count == 4
+
+    with pytest.raises(HTTPError) as e:
+        await pr_valid_github_manager.get_notebook_output(
+            "valid-prid", "test.ipynb", "unknown"
+        )
+    assert e.value.status_code == HTTPStatus.NOT_FOUND
+
+
+@pytest.mark.asyncio
+@patch("tornado.httpclient.AsyncHTTPClient.fetch", new_callable=AsyncMock)
+async def test_GitHubManager_get_pull_request_status(mock_call_provider, pr_valid_github_manager):
+    pr_response = read_sample_response("github_pr_links.json")
+    pr_response.headers = {"ETag": '"pr-etag"'}
+    mock_call_provider.side_effect = [
+        pr_response,
+        HTTPClientError(HTTPStatus.NOT_MODIFIED),
+    ]
+
+    expected = {
+        "headSha": "02fb374e022fbe7aaa4cd69c0dc3928e6422dfaa",
+        "state": "open",
+        "commentsCount": 5,
+        "updatedAt": "2019-06-21T21:51:17Z",
+    }
+    pr_id = "https://api.github.com/repos/octocat/repo/pulls/1"
+    assert await pr_valid_github_manager.get_pull_request_status(pr_id) == expected
+    # Not modified; the previous response is used
+    assert await pr_valid_github_manager.get_pull_request_status(pr_id) == expected
+
+    request = mock_call_provider.call_args_list[1][0][0]
+    assert request.headers["If-None-Match"] == '"pr-etag"'
+
+
+@pytest.mark.asyncio
+@patch("tornado.httpclient.AsyncHTTPClient.fetch", new_callable=AsyncMock)
+async def test_GitHubManager_iter_files(mock_call_provider, pr_valid_github_manager):
+    mock_call_provider.side_effect = [
+        MagicMock(
+            body=b'[{"filename": "a.py", "status": "added"}]',
+            headers={"Link": '<https://api.github.com/next-page>; rel="next"'},
+        ),
+        MagicMock(body=b'[{"filename": "b.py", "status": "removed"}]', headers={}),
+    ]
+    pr_id = "https://api.github.com/repos/octocat/repo/pulls/1"
+
+    pages = pr_valid_github_manager.iter_files(pr_id)
+    first = await pages.__anext__()
+    # Pages are requested lazily
+    assert mock_call_provider.call_count == 1
+    assert first == [{"name": "a.py", "status": "added"}]
+    # The files are indexed page per page
+    assert set(pr_valid_github_manager._files_index[pr_id]) == {"a.py"}
+    assert pr_id not in pr_valid_github_manager._files_indexed
+
+    assert [page async for page in pages] == [[{"name": "b.py", "status": "removed"}]]
+    assert mock_call_provider.call_args[0][0].url == "https://api.github.com/next-page"
+    assert set(pr_valid_github_manager._files_index[pr_id]) == {"a.py", "b.py"}
+    assert pr_id in pr_valid_github_manager._files_indexed
+
+
+@pytest.mark.asyncio
+@patch("tornado.httpclient.AsyncHTTPClient.fetch", new_callable=AsyncMock)
+async def test_GitHubManager_get_file_raw(mock_call_provider, pr_valid_github_manager):
+    mock_call_provider.return_value = MagicMock(body=b"\x89PNG")
+
+    result = await pr_valid_github_manager.get_file_raw(
+        "https://api.github.com/repos/jupyterlab/pull-requests",
+        "1f5d7a5",
+        "docs/logo.png",
+    )
+
+    assert result == b"\x89PNG"
+    request = mock_call_provider.call_args[0][0]
+    assert (
+        request.url
+        == "https://api.github.com/repos/jupyterlab/pull-requests/contents/docs/logo.png?ref=1f5d7a5"
+    )
+    assert request.headers["Accept"] == "application/vnd.github.v3.raw"
+
+
+@pytest.mark.asyncio
+@patch("tornado.httpclient.AsyncHTTPClient.fetch", new_callable=AsyncMock)
+async def test_GitHubManager_get_file_raw_repo_invalid(
+    mock_call_provider, pr_valid_github_manager
+):
+    with pytest.raises(HTTPError) as e:
+        await pr_valid_github_manager.get_file_raw(
+            "https://api.github.com.evil.com/repos/jupyterlab/pull-requests",
+            "1f5d7a5",
+            "README.md",
+        )
+
+    assert e.value.status_code == HTTPStatus.BAD_REQUEST
+    mock_call_provider.assert_not_called()
+
+
+@pytest.mark.asyncio
+@patch("tornado.httpclient.AsyncHTTPClient.fetch", new_callable=AsyncMock)
+async def test_GitHubManager_get_files_validator(mock_call_provider, pr_valid_github_manager):
+    pr_response = read_sample_response("github_pr_links.json")
+    pr_response.headers = {"ETag": '"pr-etag"'}
+    mock_call_provider.side_effect = [
+        pr_response,
+        HTTPClientError(HTTPStatus.NOT_MODIFIED),
+    ]
+    pr_id = "https://api.github.com/repos/octocat/repo/pulls/1"
+
+    validator = await pr_valid_github_manager.get_files_validator(pr_id)
+
+    assert validator == (
+        "a221b6d04be7fff0737c24e1e335a3091eca81e7:02fb374e022fbe7aaa4cd69c0dc3928e6422dfaa"
+    )
+    # Not modified upstream; same validator
+    assert await pr_valid_github_manager.get_files_validator(pr_id) == validator
+    assert mock_call_provider.call_count == 2
+
+
+@pytest.mark.asyncio
+@patch("tornado.httpclient.AsyncHTTPClient.fetch", new_callable=AsyncMock)
+async def test_GitHubManager_get_files_page(mock_call_provider, pr_valid_github_manager):
+    def page(first, last):
+        return json.dumps(
+            [{"filename": f"{i}.py", "status": "added"} for i in range(first, last)]
+        ).encode("utf-8")
+
+    mock_call_provider.side_effect = [
+        MagicMock(
+            body=page(100, 200),
+            headers={"Link": '<https://api.github.com/next-page>; rel="next"'},
+        ),
+        MagicMock(body=page(200, 250), headers={}),
+    ]
+    pr_id = "https://api.github.com/repos/octocat/repo/pulls/1"
+
+    files, next_start = await pr_valid_github_manager.get_files_page(pr_id, 60, 150)
+
+    assert [f["name"] for f in files] == [f"{i}.py" for i in range(150, 210)]
+    assert next_start == 210
+    assert mock_call_provider.call_count == 2
+    assert (
+        mock_call_provider.call_args_list[0][0][0].url
+        == f"{pr_id}/files?page=2&per_page=100"
+    )
+    # A partial list is indexed without being complete
+    assert set(pr_valid_github_manager._files_index[pr_id]) == {
+        f"{i}.py" for i in range(150, 250)
+    }
+    assert pr_id not in pr_valid_github_manager._files_indexed
+    # Its entries are used without listing all files
+    assert await pr_valid_github_manager._get_file_index(pr_id, "150.py") is not None
+    assert mock_call_provider.call_count == 2
+
+    mock_call_provider.side_effect = [MagicMock(body=page(200, 250), headers={})]
+    files, next_start = await pr_valid_github_manager.get_files_page(pr_id, 60, 210)
+
+    assert [f["name"] for f in files] == [f"{i}.py" for i in range(210, 250)]
+    assert next_start is None
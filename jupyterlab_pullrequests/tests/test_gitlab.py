@@ -1,7 +1,7 @@
-import difflib
 import json
 import pathlib
 from http import HTTPStatus
+from urllib.parse import quote
 
 import pytest
 from mock import AsyncMock, MagicMock, patch
@@ -10,17 +10,48 @@ from tornado.httpclient import HTTPClientError
 from tornado.web import HTTPError
 
 from jupyterlab_pullrequests.base import CommentReply, NewComment
+from jupyterlab_pullrequests.handlers import BATCH_OPERATIONS
 from jupyterlab_pullrequests.managers.gitlab import GitLabManager
 
 HERE = pathlib.Path(__file__).parent.resolve()
 
 
+BASE_SHA = "e616d1a1a2a95416178b1494fa08a69694132c96"
+HEAD_SHA = "5cbd51cf3b89aaa1a2444cd4d4ce68fae299f592"
+
+
 def read_sample_response(filename):
     return MagicMock(
         body=(HERE / "sample_responses" / "gitlab" / filename).read_bytes()
     )
 
 
+def file_responses(first, files):
+    """Mock fetch answering the file requests whatever their order.
+
+    Args:
+        first: Responses to the first requests in order
+        files: Responses by (method, sha) to the file requests
+    """
+    first = list(first)
+    files = dict(files)
+
+    def fetch(request):
+        if first:
+            return first.pop(0)
+        response = files.pop((request.method, request.url.rsplit("ref=", 1)[1]))
+        if isinstance(response, Exception):
+            raise response
+        if request.streaming_callback is not None:
+            # Stream the body by chunks of 1 kB
+            body, response.body = response.body, b""
+            for start in range(0, len(body), 1024):
+                request.streaming_callback(body[start : start + 1024])
+        return response
+
+    return fetch
+
+
 @pytest.mark.asyncio
 @pytest.mark.parametrize(
     "token, data, code",
@@ -45,6 +76,28 @@ async def test_GitLabManager_get_current_user(mock_call_provider, token, data, c
         assert data in e.value.reason
 
 
+@pytest.mark.asyncio
+@patch("tornado.httpclient.AsyncHTTPClient.fetch", new_callable=AsyncMock)
+async def test_GitLabManager_get_prs_page(mock_call_provider, pr_valid_gitlab_manager):
+    mock_call_provider.side_effect = [
+        MagicMock(body=b'{"version": "14.1.0-ee"}'),
+        read_sample_response("get_prs.json"),
+    ]
+
+    await pr_valid_gitlab_manager.check_server_version()
+    prs, next_start = await pr_valid_gitlab_manager.get_prs_page(
+        "octocat", "created", 1, 101
+    )
+
+    assert len(prs) == 1
+    assert next_start == 102
+    # Keyset pagination cannot start at an arbitrary page
+    assert (
+        mock_call_provider.call_args[0][0].url
+        == f"{pr_valid_gitlab_manager.base_api_url}/merge_requests?state=opened&author_username=octocat&order_by=id&sort=desc&page=2&per_page=100"
+    )
+
+
 @pytest.mark.asyncio
 @pytest.mark.parametrize(
     "user, filter, expected",
@@ -62,7 +115,7 @@ async def test_GitLabManager_list_prs(mock_call_provider, user, filter, expected
     mock_call_provider.assert_called_once()
     assert (
         mock_call_provider.call_args[0][0].url
-        == f"{pr_valid_gitlab_manager.base_api_url}/merge_requests?state=opened&{expected}&per_page=100"
+        == f"{pr_valid_gitlab_manager.base_api_url}/merge_requests?state=opened&{expected}&order_by=id&sort=desc&per_page=100"
     )
 
     assert isinstance(result, list)
@@ -76,6 +129,48 @@ async def test_GitLabManager_list_prs(mock_call_provider, user, filter, expected
         assert isinstance(item["link"], str)
 
 
+@pytest.mark.asyncio
+@patch("tornado.httpclient.AsyncHTTPClient.fetch", new_callable=AsyncMock)
+async def test_GitLabManager_list_prs_keyset(mock_call_provider, pr_valid_gitlab_manager):
+    mock_call_provider.side_effect = [
+        MagicMock(body=b'{"version": "14.1.0-ee"}'),
+        read_sample_response("get_prs.json"),
+    ]
+
+    await pr_valid_gitlab_manager.check_server_version()
+    await pr_valid_gitlab_manager.list_prs("octocat", "created")
+
+    assert (
+        mock_call_provider.call_args[0][0].url
+        == f"{pr_valid_gitlab_manager.base_api_url}/merge_requests?state=opened&author_username=octocat&pagination=keyset&order_by=id&sort=desc&per_page=100"
+    )
+
+
+@pytest.mark.asyncio
+@patch("tornado.httpclient.AsyncHTTPClient.fetch", new_callable=AsyncMock)
+async def test_GitLabManager_list_prs_keyset_fallback(mock_call_provider, pr_valid_gitlab_manager):
+    mock_call_provider.side_effect = [
+        MagicMock(body=b'{"version": "14.1.0-ee"}'),
+        HTTPClientError(HTTPStatus.METHOD_NOT_ALLOWED),
+        read_sample_response("get_prs.json"),
+        read_sample_response("get_prs.json"),
+    ]
+
+    await pr_valid_gitlab_manager.check_server_version()
+    await pr_valid_gitlab_manager.list_prs("octocat", "created")
+
+    assert mock_call_provider.call_count == 3
+    assert (
+        mock_call_provider.call_args[0][0].url
+        == f"{pr_valid_gitlab_manager.base_api_url}/merge_requests?state=opened&author_username=octocat&order_by=id&sort=desc&per_page=100"
+    )
+
+    # The fallback is remembered
+    await pr_valid_gitlab_manager.list_prs("octocat", "created")
+    assert mock_call_provider.call_count == 4
+    assert "pagination=keyset" not in mock_call_provider.call_args[0][0].url
+
+
 @pytest.mark.asyncio
 @pytest.mark.parametrize(
     "user, filter, expected",
@@ -104,6 +199,75 @@ async def test_GitLabManager_list_files(mock_call_provider, user, filter, expect
         assert item["status"] in ("added", "modified", "removed", "renamed")
 
 
+@pytest.mark.asyncio
+@patch("tornado.httpclient.AsyncHTTPClient.fetch", new_callable=AsyncMock)
+async def test_GitLabManager_list_files_diffs(mock_call_provider, pr_valid_gitlab_manager):
+    changes = json.loads(read_sample_response("get_pr_changes.json").body)["changes"]
+    mock_call_provider.side_effect = [
+        MagicMock(body=b'{"version": "15.7.2-ee", "revision": "6ab8a41fd10"}'),
+        MagicMock(body=json.dumps(changes).encode("utf-8")),
+    ]
+
+    url = f"{pr_valid_gitlab_manager.base_api_url}/merge_requests/1"
+
+    await pr_valid_gitlab_manager.check_server_version()
+    result = await pr_valid_gitlab_manager.list_files(url)
+
+    assert mock_call_provider.call_args[0][0].url == url_path_join(
+        url, "diffs?per_page=100"
+    )
+    assert result == [
+        {"name": change["new_path"], "status": status}
+        for change, status in zip(
+            changes, ("modified", "added", "removed", "added", "modified", "renamed")
+        )
+    ]
+
+
+@pytest.mark.asyncio
+@patch("tornado.httpclient.AsyncHTTPClient.fetch", new_callable=AsyncMock)
+async def test_GitLabManager_list_files_lazy_version(mock_call_provider, pr_gitlab_manger):
+    pr_gitlab_manger._config.access_token = "valid"
+    changes = json.loads(read_sample_response("get_pr_changes.json").body)["changes"]
+    mock_call_provider.side_effect = [
+        MagicMock(body=b'{"version": "15.7.2-ee", "revision": "6ab8a41fd10"}'),
+        MagicMock(body=json.dumps(changes).encode("utf-8")),
+        MagicMock(body=json.dumps(changes).encode("utf-8")),
+    ]
+
+    url = f"{pr_gitlab_manger.base_api_url}/merge_requests/1"
+
+    await pr_gitlab_manger.list_files(url)
+    await pr_gitlab_manger.list_files(url)
+
+    # The version is requested once by the first request needing it
+    urls = [c[0][0].url for c in mock_call_provider.call_args_list]
+    assert urls == [
+        url_path_join(pr_gitlab_manger.base_api_url, "version"),
+        url_path_join(url, "diffs?per_page=100"),
+        url_path_join(url, "diffs?per_page=100"),
+    ]
+
+
+@pytest.mark.asyncio
+@patch("tornado.httpclient.AsyncHTTPClient.fetch", new_callable=AsyncMock)
+async def test_GitLabManager_get_files_page_changes(mock_call_provider, pr_valid_gitlab_manager):
+    mock_call_provider.return_value = read_sample_response("get_pr_changes.json")
+
+    url = f"{pr_valid_gitlab_manager.base_api_url}/merge_requests/1"
+
+    first, next_start = await pr_valid_gitlab_manager.get_files_page(url, 4)
+    second, last_start = await pr_valid_gitlab_manager.get_files_page(url, 4, next_start)
+
+    # The changes of all files are fetched once
+    mock_call_provider.assert_called_once()
+    assert next_start == 4
+    assert last_start is None
+    assert [f["name"] for f in first + second] == [
+        f["name"] for f in await pr_valid_gitlab_manager.list_files(url)
+    ]
+
+
 @pytest.mark.asyncio
 @pytest.mark.parametrize(
     "change, status",
@@ -162,12 +326,11 @@ async def test_GitLabManager_list_files(mock_call_provider, user, filter, expect
         ),
     ),
 )
-@patch(
-    "jupyterlab_pullrequests.managers.gitlab.GitLabManager._call_gitlab",
-    new_callable=AsyncMock,
-)
+@patch("tornado.httpclient.AsyncHTTPClient.fetch", new_callable=AsyncMock)
 async def test_GitLabManager_list_files_status(mock_call_provider, change, status, pr_valid_gitlab_manager):
-    mock_call_provider.return_value = [{"changes": [change]}]
+    mock_call_provider.return_value = MagicMock(
+        body=json.dumps({"changes": [change]}).encode("utf-8")
+    )
 
     url = f"{pr_valid_gitlab_manager.base_api_url}/merge_requests/1"
 
@@ -191,19 +354,20 @@ async def test_GitLabManager_list_files_status(mock_call_provider, change, statu
 async def test_GitLabManager_get_file_diff(
     mock_call_provider, old_content, new_content, pr_valid_gitlab_manager
 ):
-    mock_call_provider.return_value = read_sample_response("get_pr_changes.json")
-
-    mock_call_provider.side_effect = [
+    first = [
         read_sample_response("get_pr.json"),
-        old_content
-        if isinstance(old_content, Exception)
-        else MagicMock(body=bytes(old_content, encoding="utf-8")),
-        new_content
-        if isinstance(new_content, Exception)
-        else MagicMock(body=bytes(new_content, encoding="utf-8")),
+        read_sample_response("get_pr_changes.json"),
     ]
+    files = {}
+    for sha, content in ((BASE_SHA, old_content), (HEAD_SHA, new_content)):
+        if isinstance(content, Exception):
+            files[("GET", sha)] = content
+        else:
+            files[("GET", sha)] = MagicMock(body=bytes(content, encoding="utf-8"))
+    mock_call_provider.side_effect = file_responses(first, files)
     result = await pr_valid_gitlab_manager.get_file_diff("valid-prid", "valid-filename")
-    assert mock_call_provider.call_count == 3
+    # A single request per file version
+    assert mock_call_provider.call_count == len(first) + len(files)
     assert result == {
         "base": {
             "label": "master",
@@ -218,6 +382,74 @@ async def test_GitLabManager_get_file_diff(
     }
 
 
+@pytest.mark.asyncio
+@patch("tornado.httpclient.AsyncHTTPClient.fetch", new_callable=AsyncMock)
+async def test_GitLabManager_get_file_diff_oversized(mock_call_provider, pr_valid_gitlab_manager):
+    pr_valid_gitlab_manager._config.max_file_size = 4096
+    streamed = []
+
+    def chunks():
+        # Infinite body; the download must be aborted
+        while True:
+            streamed.append(1024)
+            yield b"a," * 512
+
+    def fetch(request):
+        if mock_call_provider.call_count <= 2:
+            return read_sample_response(
+                "get_pr.json" if mock_call_provider.call_count == 1 else "get_pr_changes.json"
+            )
+        assert request.method == "GET"
+        for chunk in chunks():
+            request.streaming_callback(chunk)
+
+    mock_call_provider.side_effect = fetch
+    result = await pr_valid_gitlab_manager.get_file_diff("valid-prid", "large.csv")
+    assert mock_call_provider.call_count == 4
+    # Aborted right past the limit
+    assert sum(streamed) == 2 * 5 * 1024
+    for side in ("base", "head"):
+        assert result[side]["content"] is None
+        assert result[side]["skipped"] == {"reason": "oversized", "size": None}
+
+
+@pytest.mark.asyncio
+@patch("tornado.httpclient.AsyncHTTPClient.fetch", new_callable=AsyncMock)
+async def test_GitLabManager_get_file_diff_not_utf8(mock_call_provider, pr_valid_gitlab_manager):
+    files = {}
+    for sha in (BASE_SHA, HEAD_SHA):
+        files[("GET", sha)] = MagicMock(body=b"\xff\xfe\xfd\xfc")
+    mock_call_provider.side_effect = file_responses(
+        [read_sample_response("get_pr.json"), read_sample_response("get_pr_changes.json")],
+        files,
+    )
+
+    result = await pr_valid_gitlab_manager.get_file_diff("valid-prid", "data.dat")
+
+    for side in ("base", "head"):
+        assert result[side]["content"] is None
+        assert result[side]["skipped"] == {"reason": "binary", "size": 4}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("filename", ("archive.zip", "archive.tar.gz", "doc.pdf", "lib.so"))
+@patch("tornado.httpclient.AsyncHTTPClient.fetch", new_callable=AsyncMock)
+async def test_GitLabManager_get_file_diff_binary_extension(
+    mock_call_provider, filename, pr_valid_gitlab_manager
+):
+    mock_call_provider.side_effect = [
+        read_sample_response("get_pr.json"),
+        read_sample_response("get_pr_changes.json"),
+    ]
+
+    result = await pr_valid_gitlab_manager.get_file_diff("valid-prid", filename)
+
+    # Nothing is downloaded
+    assert mock_call_provider.call_count == 2
+    for side in ("base", "head"):
+        assert result[side]["skipped"] == {"reason": "binary", "size": None}
+
+
 @pytest.mark.asyncio
 @pytest.mark.parametrize(
     "filename, expected",
@@ -298,19 +530,92 @@ async def test_GitLabManager_get_file_diff(
 )
 @patch("tornado.httpclient.AsyncHTTPClient.fetch", new_callable=AsyncMock)
 async def test_GitLabManager_get_threads(mock_call_provider, filename, expected, pr_valid_gitlab_manager):
-    mock_call_provider.return_value = read_sample_response("get_pr_comments.json")
+    mock_call_provider.side_effect = [
+        read_sample_response("get_pr.json"),
+        read_sample_response("get_pr_comments.json"),
+    ]
 
     result = await pr_valid_gitlab_manager.get_threads("mergerequests-id", filename)
 
-    mock_call_provider.assert_called_once()
+    assert mock_call_provider.call_count == 2
     assert (
         mock_call_provider.call_args[0][0].url
-        == f"{pr_valid_gitlab_manager.base_api_url}/mergerequests-id/discussions?per_page=100"
+        == f"{pr_valid_gitlab_manager.base_api_url}/mergerequests-id/discussions?order_by=id&sort=asc&per_page=100"
     )
 
     assert result == expected
 
 
+@pytest.mark.asyncio
+@patch("tornado.httpclient.AsyncHTTPClient.fetch", new_callable=AsyncMock)
+async def test_GitLabManager_get_threads_cache(mock_call_provider, pr_valid_gitlab_manager):
+    mock_call_provider.side_effect = [
+        read_sample_response("get_pr.json"),
+        read_sample_response("get_pr_comments.json"),
+        read_sample_response("posted_reply_pr_comment.json"),
+        read_sample_response("get_pr_comments.json"),
+    ]
+
+    general = await pr_valid_gitlab_manager.get_threads("mergerequests-id")
+    on_file = await pr_valid_gitlab_manager.get_threads("mergerequests-id", "test.ipynb")
+    # The discussions are requested once per merge request
+    assert mock_call_provider.call_count == 2
+    assert len(general) == 2
+    assert len(on_file) == 3
+
+    # Posting a comment invalids the cache
+    await pr_valid_gitlab_manager.post_comment(
+        "mergerequests-id", CommentReply("Reply", None, "discussion-id")
+    )
+    await pr_valid_gitlab_manager.get_threads("mergerequests-id")
+    assert mock_call_provider.call_count == 4
+
+
+@pytest.mark.asyncio
+@patch("tornado.httpclient.AsyncHTTPClient.fetch", new_callable=AsyncMock)
+async def test_GitLabManager_get_threads_cache_new_note(mock_call_provider, pr_valid_gitlab_manager):
+    merge_request = json.loads(read_sample_response("get_pr.json").body)
+    merge_request["user_notes_count"] += 1
+    merge_request["updated_at"] = "2021-03-05T10:00:00.000Z"
+    mock_call_provider.side_effect = [
+        read_sample_response("get_pr.json"),
+        read_sample_response("get_pr_comments.json"),
+        MagicMock(body=json.dumps(merge_request).encode(), headers={}),
+        read_sample_response("get_pr_comments.json"),
+    ]
+
+    await pr_valid_gitlab_manager.get_threads("mergerequests-id")
+    # A note posted by someone else is noticed by the status poll
+    await pr_valid_gitlab_manager.get_pull_request_status("mergerequests-id")
+    await pr_valid_gitlab_manager.get_threads("mergerequests-id")
+    assert mock_call_provider.call_count == 4
+
+
+@pytest.mark.asyncio
+@patch("tornado.httpclient.AsyncHTTPClient.fetch", new_callable=AsyncMock)
+async def test_GitLabManager_get_threads_batch(mock_call_provider, pr_valid_gitlab_manager):
+    merge_request = json.loads(read_sample_response("get_pr.json").body)
+    merge_request["user_notes_count"] += 1
+    merge_request["updated_at"] = "2021-03-05T10:00:00.000Z"
+    mock_call_provider.side_effect = [
+        MagicMock(body=read_sample_response("get_pr.json").body, headers={}),
+        read_sample_response("get_pr_comments.json"),
+        MagicMock(body=json.dumps(merge_request).encode(), headers={}),
+        read_sample_response("get_pr_comments.json"),
+        MagicMock(body=json.dumps(merge_request).encode(), headers={}),
+    ]
+    get_threads = BATCH_OPERATIONS["files/comments"]
+    params = {"id": "mergerequests-id", "filename": "test.ipynb"}
+
+    assert len(await get_threads(pr_valid_gitlab_manager, params)) == 3
+    # A note posted by someone else is noticed without a status poll
+    assert len(await get_threads(pr_valid_gitlab_manager, params)) == 3
+    assert mock_call_provider.call_count == 4
+    # Unchanged merge request; the discussions are served from the cache
+    await get_threads(pr_valid_gitlab_manager, params)
+    assert mock_call_provider.call_count == 5
+
+
 @pytest.mark.asyncio
 @pytest.mark.parametrize(
     "filename, body, position, response, expected",
@@ -394,6 +699,8 @@ async def test_GitLabManager_post_comment(
             0,
             read_sample_response("get_pr.json"),
         )
+        if body.filename is not None:
+            side_effect.insert(1, read_sample_response("get_pr_changes.json"))
     mock_call_provider.side_effect = side_effect
 
     result = await pr_valid_gitlab_manager.post_comment("mergerequest-id", body)
@@ -416,35 +723,23 @@ async def test_GitLabManager_post_comment(
 
 @pytest.mark.asyncio
 @patch("tornado.httpclient.AsyncHTTPClient.fetch", new_callable=AsyncMock)
-async def test_GitLabManager_post_comment_invalid_line_code(
-    mock_call_provider, monkeypatch, pr_valid_gitlab_manager
+@pytest.mark.parametrize(
+    "line, original_line",
+    ((21, None), (None, 19), (21, 19)),
+)
+async def test_GitLabManager_post_comment_unmodified_line(
+    mock_call_provider, line, original_line, pr_valid_gitlab_manager
 ):
-
-    async def fake_file_diff(*args):
-        # Fake that the 20 first lines are identical
-        return [difflib.Match(a=0, b=0, size=20)]
-
-    monkeypatch.setattr(pr_valid_gitlab_manager, "_get_file_diff", fake_file_diff)
-
-    body = NewComment("New discussion on plain text", "README.md", 17, None)
+    body = NewComment("New discussion on plain text", "README.md", line, original_line)
 
     mock_call_provider.side_effect = [
         read_sample_response("get_pr.json"),
-        HTTPClientError(
-            HTTPStatus.BAD_REQUEST,
-            None,
-            MagicMock(
-                body=bytes(
-                    json.dumps({"message": 'line_code=>["must be a valid line code"]'}),
-                    encoding="utf-8",
-                )
-            ),
-        ),
+        read_sample_response("get_pr_changes.json"),
         read_sample_response("posted_new_file_comment.json"),
     ]
-
     result = await pr_valid_gitlab_manager.post_comment("mergerequest-id", body)
 
+    # Single POST request
     assert mock_call_provider.call_count == 3
     # 1 = last call; 0 = args of call; 0 = first argument
     request = mock_call_provider.call_args_list[-1][0][0]
@@ -454,10 +749,10 @@ async def test_GitLabManager_post_comment_invalid_line_code(
         "body": body.text,
         "position": {
             "position_type": "text",
-            "new_line": 17,
-            "old_line": 17,
+            "new_line": 21,
+            "old_line": 19,
             "new_path": "README.md",
-            "old_path": None,
+            "old_path": "README.md",
             "base_sha": "e616d1a1a2a95416178b1494fa08a69694132c96",
             "head_sha": "5cbd51cf3b89aaa1a2444cd4d4ce68fae299f592",
             "start_sha": "e616d1a1a2a95416178b1494fa08a69694132c96",
@@ -472,3 +767,155 @@ async def test_GitLabManager_post_comment_invalid_line_code(
         "userPicture": "https://gitlab.example.com/uploads/-/system/user/avatar/149/avatar.png",
         "inReplyTo": "7cd51262f86ad99f85f5a2ad30f76aeb39de7696",
     }
+
+
+@pytest.mark.asyncio
+@patch("tornado.httpclient.AsyncHTTPClient.fetch", new_callable=AsyncMock)
+async def test_GitLabManager_post_comment_unmodified_line_without_diff(
+    mock_call_provider, pr_valid_gitlab_manager
+):
+    changes = json.loads(read_sample_response("get_pr_changes.json").body)
+    # GitLab empties the diff of too large files
+    changes["changes"][0]["diff"] = ""
+    mock_call_provider.side_effect = file_responses(
+        [read_sample_response("get_pr.json"), MagicMock(body=json.dumps(changes).encode())],
+        {
+            ("GET", BASE_SHA): MagicMock(body=b"a\nb\nc\n"),
+            ("GET", HEAD_SHA): MagicMock(body=b"a\nx\nb\nc\n"),
+        },
+    )
+    position = await pr_valid_gitlab_manager._get_position(
+        "mergerequest-id", "README.md", 3, None
+    )
+
+    assert position["new_line"] == 3
+    assert position["old_line"] == 2
+
+
+@pytest.mark.asyncio
+@patch("tornado.httpclient.AsyncHTTPClient.fetch", new_callable=AsyncMock)
+async def test_GitLabManager_post_review(mock_call_provider, pr_valid_gitlab_manager):
+    mock_call_provider.side_effect = [
+        MagicMock(body=b'{"version": "16.1.0-ee"}'),
+        MagicMock(body=b'{"id": 1}', headers={}),
+        read_sample_response("get_pr.json"),
+        MagicMock(body=b'{"id": 2}', headers={}),
+        MagicMock(body=b"", headers={}),
+    ]
+    await pr_valid_gitlab_manager.check_server_version()
+    pr_valid_gitlab_manager.add_pending_comment(
+        "mergerequest-id", CommentReply("reply", "README.md", "discussion-id")
+    )
+
+    assert await pr_valid_gitlab_manager.submit_review("mergerequest-id", "Summary") == 1
+
+    drafts_url = f"{pr_valid_gitlab_manager.base_api_url}/mergerequest-id/draft_notes"
+    requests = [c[0][0] for c in mock_call_provider.call_args_list]
+    assert requests[1].url == drafts_url
+    assert json.loads(requests[1].body.decode("utf-8")) == {
+        "note": "reply",
+        "in_reply_to_discussion_id": "discussion-id",
+    }
+    assert requests[3].url == drafts_url
+    assert json.loads(requests[3].body.decode("utf-8")) == {
+        "note": "Summary",
+        "commit_id": "5cbd51cf3b89aaa1a2444cd4d4ce68fae299f592",
+    }
+    # The drafts are published at once
+    assert requests[4].url == f"{drafts_url}/bulk_publish"
+    assert requests[4].method == "POST"
+    assert requests[4].body == b"{}"
+
+
+@pytest.mark.asyncio
+@patch("tornado.httpclient.AsyncHTTPClient.fetch", new_callable=AsyncMock)
+async def test_GitLabManager_post_review_failed(mock_call_provider, pr_valid_gitlab_manager):
+    mock_call_provider.side_effect = [
+        MagicMock(body=b'{"version": "16.1.0-ee"}'),
+        MagicMock(body=b'{"id": 1}', headers={}),
+        HTTPClientError(HTTPStatus.INTERNAL_SERVER_ERROR),
+        MagicMock(body=b"", headers={}),
+    ]
+    await pr_valid_gitlab_manager.check_server_version()
+    for text in ("first", "second"):
+        pr_valid_gitlab_manager.add_pending_comment(
+            "mergerequest-id", CommentReply(text, "README.md", "discussion-id")
+        )
+
+    with pytest.raises(HTTPError):
+        await pr_valid_gitlab_manager.submit_review("mergerequest-id")
+
+    # The created draft is deleted and all comments are kept pending
+    request = mock_call_provider.call_args[0][0]
+    assert request.method == "DELETE"
+    assert request.url == f"{pr_valid_gitlab_manager.base_api_url}/mergerequest-id/draft_notes/1"
+    assert [
+        c["text"] for c in pr_valid_gitlab_manager.get_pending_comments("mergerequest-id")
+    ] == ["first", "second"]
+
+
+@pytest.mark.asyncio
+@patch("tornado.httpclient.AsyncHTTPClient.fetch", new_callable=AsyncMock)
+async def test_GitLabManager_get_file_patch(mock_call_provider, pr_valid_gitlab_manager):
+    mock_call_provider.side_effect = [
+        read_sample_response("get_pr_changes.json"),
+        read_sample_response("get_pr.json"),
+    ]
+    result = await pr_valid_gitlab_manager.get_file_patch("valid-prid", "test.ipynb")
+    assert mock_call_provider.call_count == 2
+    assert result["base"] == {
+        "label": "master",
+        "sha": "e616d1a1a2a95416178b1494fa08a69694132c96",
+    }
+    assert result["head"] == {
+        "label": "mr",
+        "sha": "5cbd51cf3b89aaa1a2444cd4d4ce68fae299f592",
+    }
+    assert [
+        (h["oldStart"], h["oldLines"], h["newStart"], h["newLines"])
+        for h in result["hunks"]
+    ] == [(3, 21, 3, 22), (27, 7, 28, 7), (77, 7, 78, 7)]
+    assert result["hunks"][1]["lines"][3] == '-    "print(\\"hello\\")"'
+
+    # The changes are cached
+    await pr_valid_gitlab_manager.get_file_patch("valid-prid", "new_file.py")
+    assert mock_call_provider.call_count == 2
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "filename, fetched",
+    (
+        ("new_file.py", [("head", "new_file.py")]),
+        ("dummy/to_be_deleted.ipynb", [("base", "dummy/to_be_deleted.ipynb")]),
+        ("renamed.py", [("base", "to_rename.py"), ("head", "renamed.py")]),
+    ),
+)
+@patch("tornado.httpclient.AsyncHTTPClient.fetch", new_callable=AsyncMock)
+async def test_GitLabManager_get_file_diff_status(
+    mock_call_provider, filename, fetched, pr_valid_gitlab_manager
+):
+    first = [
+        read_sample_response("get_pr.json"),
+        read_sample_response("get_pr_changes.json"),
+    ]
+    shas = {"base": BASE_SHA, "head": HEAD_SHA}
+    files = {}
+    for side, _ in fetched:
+        files[("GET", shas[side])] = MagicMock(body=b"content")
+    mock_call_provider.side_effect = file_responses(first, files)
+
+    result = await pr_valid_gitlab_manager.get_file_diff("valid-prid", filename)
+
+    assert mock_call_provider.call_count == len(first) + len(files)
+    urls = {
+        c[0][0].url for c in mock_call_provider.call_args_list if c[0][0].method == "GET"
+    }
+    for side, path in fetched:
+        assert any(
+            url.endswith(f"repository/files/{quote(path, safe='')}/raw?ref={shas[side]}")
+            for url in urls
+        )
+    for side in ("base", "head"):
+        expected = "content" if side in dict(fetched) else ""
+        assert result[side]["content"] == expected
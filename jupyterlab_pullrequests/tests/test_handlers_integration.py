@@ -1,15 +1,25 @@
+import asyncio
+import json
 import sys
-from unittest.mock import patch
 
 import pytest
 import tornado
+from mock import AsyncMock, patch
 
 valid_prid = "https://api.github.com/repos/timnlupo/juypterlabpr-test/pulls/1"
 valid_prfilename = "test.ipynb"
 
 
 @pytest.mark.flaky
-@patch("jupyterlab_pullrequests.base.PRConfig.access_token", "")
+@pytest.mark.parametrize(
+    "jp_server_config",
+    [
+        {
+            "ServerApp": {"jpserver_extensions": {"jupyterlab_pullrequests": True}},
+            "PRConfig": {"access_token": ""},
+        }
+    ],
+)
 async def test_ListPullRequests_pat_empty(jp_fetch):
     with pytest.raises(
         tornado.httpclient.HTTPClientError, match=r"No access token specified"
@@ -153,6 +163,192 @@ async def test_GetFiles_id_invalid(jp_fetch):
     assert exc_info.value.code >= 400
 
 
+# Test invalid mode
+async def test_GetFiles_mode_invalid(jp_fetch):
+    with pytest.raises(
+        tornado.httpclient.HTTPClientError, match=r"Invalid parameter 'mode'"
+    ) as exc_info:
+        await jp_fetch(
+            "pullrequests",
+            "files",
+            "content",
+            params={"filename": valid_prfilename, "id": valid_prid, "mode": "invalid"},
+        )
+    assert exc_info.value.code == 400
+
+
+# Test notebook mode on a plain file
+async def test_GetFiles_mode_notebook_invalid(jp_fetch):
+    with pytest.raises(
+        tornado.httpclient.HTTPClientError, match=r"Mode 'notebook' requires a notebook"
+    ) as exc_info:
+        await jp_fetch(
+            "pullrequests",
+            "files",
+            "content",
+            params={"filename": "README.md", "id": valid_prid, "mode": "notebook"},
+        )
+    assert exc_info.value.code == 400
+
+
+# Test get file context
+
+# Test invalid side
+async def test_GetContext_side_invalid(jp_fetch):
+    with pytest.raises(
+        tornado.httpclient.HTTPClientError, match=r"Invalid parameter 'side'"
+    ) as exc_info:
+        await jp_fetch(
+            "pullrequests",
+            "files",
+            "context",
+            params={
+                "filename": valid_prfilename,
+                "id": valid_prid,
+                "side": "left",
+                "start": 1,
+                "end": 10,
+            },
+        )
+    assert exc_info.value.code == 400
+
+
+# Test invalid line range
+async def test_GetContext_start_invalid(jp_fetch):
+    with pytest.raises(
+        tornado.httpclient.HTTPClientError, match=r"Invalid argument 'start'"
+    ) as exc_info:
+        await jp_fetch(
+            "pullrequests",
+            "files",
+            "context",
+            params={
+                "filename": valid_prfilename,
+                "id": valid_prid,
+                "side": "base",
+                "start": "one",
+                "end": 10,
+            },
+        )
+    assert exc_info.value.code == 400
+
+
+# Test invalid page range
+@pytest.mark.parametrize(
+    "params, message",
+    (
+        ({"limit": "ten"}, "Invalid argument 'limit'"),
+        ({"limit": "0"}, "Invalid parameter 'limit'"),
+        ({"limit": "10", "cursor": "-1"}, "Invalid parameter 'cursor'"),
+    ),
+)
+async def test_ListPullRequests_page_invalid(params, message, jp_fetch):
+    with pytest.raises(tornado.httpclient.HTTPClientError, match=message) as exc_info:
+        await jp_fetch(
+            "pullrequests",
+            "prs",
+            "files",
+            params={"id": valid_prid, **params},
+        )
+    assert exc_info.value.code == 400
+
+
+# Test client conditional request
+@patch(
+    "jupyterlab_pullrequests.managers.github.GitHubManager.list_files",
+    new_callable=AsyncMock,
+)
+@patch(
+    "jupyterlab_pullrequests.managers.github.GitHubManager.get_files_validator",
+    new_callable=AsyncMock,
+)
+async def test_ListFiles_not_modified(mock_validator, mock_list_files, jp_fetch):
+    mock_validator.return_value = "base-sha:head-sha"
+    mock_list_files.return_value = [{"name": "a.py", "status": "added"}]
+
+    response = await jp_fetch("pullrequests", "prs", "files", params={"id": valid_prid})
+    etag = response.headers["Etag"]
+
+    with pytest.raises(tornado.httpclient.HTTPClientError) as exc_info:
+        await jp_fetch(
+            "pullrequests",
+            "prs",
+            "files",
+            params={"id": valid_prid},
+            headers={"If-None-Match": etag},
+        )
+    assert exc_info.value.code == 304
+    # The files are not listed again
+    assert mock_list_files.call_count == 1
+
+    mock_validator.return_value = "base-sha:new-head-sha"
+    response = await jp_fetch(
+        "pullrequests",
+        "prs",
+        "files",
+        params={"id": valid_prid},
+        headers={"If-None-Match": etag},
+    )
+    assert response.code == 200
+    assert response.headers["Etag"] != etag
+
+
+# Test get raw file
+
+# Test invalid sha
+async def test_GetRaw_sha_invalid(jp_fetch):
+    with pytest.raises(
+        tornado.httpclient.HTTPClientError, match=r"Invalid parameter 'sha'"
+    ) as exc_info:
+        await jp_fetch(
+            "pullrequests",
+            "files",
+            "raw",
+            params={
+                "repo": "https://api.github.com/repos/jupyterlab/pull-requests",
+                "sha": "master",
+                "path": valid_prfilename,
+            },
+        )
+    assert exc_info.value.code == 400
+
+
+# Test invalid path
+async def test_GetRaw_path_invalid(jp_fetch):
+    with pytest.raises(
+        tornado.httpclient.HTTPClientError, match=r"Invalid parameter 'path'"
+    ) as exc_info:
+        await jp_fetch(
+            "pullrequests",
+            "files",
+            "raw",
+            params={
+                "repo": "https://api.github.com/repos/jupyterlab/pull-requests",
+                "sha": "1f5d7a5",
+                "path": "../../user",
+            },
+        )
+    assert exc_info.value.code == 400
+
+
+# Test repository outside of the provider
+async def test_GetRaw_repo_invalid(jp_fetch):
+    with pytest.raises(
+        tornado.httpclient.HTTPClientError, match=r"Invalid parameter 'repo'"
+    ) as exc_info:
+        await jp_fetch(
+            "pullrequests",
+            "files",
+            "raw",
+            params={
+                "repo": "https://google.com/repos/jupyterlab/pull-requests",
+                "sha": "1f5d7a5",
+                "path": valid_prfilename,
+            },
+        )
+    assert exc_info.value.code == 400
+
+
 # Test get PR comments
 
 # Test missing id
@@ -292,3 +488,204 @@ async def test_post_comment_id_invalid(jp_fetch):
             body='{"in_reply_to": 123, "text": "test"}',
         )
     assert exc_info.value.code >= 400
+
+
+# Test pending review
+async def test_review_pending(jp_fetch):
+    response = await jp_fetch(
+        "pullrequests",
+        "files",
+        "comments",
+        params={"id": valid_prid, "filename": valid_prfilename},
+        method="POST",
+        body=json.dumps({"text": "Later", "line": 3, "pending": True}),
+    )
+    assert response.code == 201
+    comment = json.loads(response.body)
+    assert comment["pending"]
+
+    response = await jp_fetch("pullrequests", "prs", "review", params={"id": valid_prid})
+    assert json.loads(response.body) == [comment]
+
+    response = await jp_fetch(
+        "pullrequests", "prs", "review", params={"id": valid_prid}, method="DELETE"
+    )
+    assert response.code == 204
+    response = await jp_fetch("pullrequests", "prs", "review", params={"id": valid_prid})
+    assert json.loads(response.body) == []
+
+
+# Test batch
+
+# Test invalid body
+async def test_batch_body_invalid(jp_fetch):
+    with pytest.raises(
+        tornado.httpclient.HTTPClientError, match=r"Expected a list of operations"
+    ) as exc_info:
+        await jp_fetch(
+            "pullrequests",
+            "batch",
+            method="POST",
+            body=json.dumps({"path": "prs/files"}),
+        )
+    assert exc_info.value.code == 400
+
+
+# Test per operation errors
+@pytest.mark.parametrize("stream", (False, True))
+async def test_batch_operations_invalid(jp_fetch, stream):
+    response = await jp_fetch(
+        "pullrequests",
+        "batch",
+        params={"stream": "1"} if stream else {},
+        method="POST",
+        body=json.dumps(
+            [
+                {"path": "unknown"},
+                {"path": "prs/files", "params": {}},
+                {
+                    "path": "files/context",
+                    "params": {"id": valid_prid, "filename": valid_prfilename, "side": "invalid"},
+                },
+            ]
+        ),
+    )
+    assert response.code == 200
+    body = response.body.decode("utf-8")
+    if stream:
+        assert response.headers["Content-Type"] == "application/x-ndjson"
+        results = sorted(
+            (json.loads(line) for line in body.splitlines()), key=lambda r: r["index"]
+        )
+    else:
+        results = json.loads(body)
+
+    assert [r["index"] for r in results] == [0, 1, 2]
+    assert all(r["status"] == 400 for r in results)
+    assert "Invalid operation path" in results[0]["error"]
+    assert "Missing argument 'id'" in results[1]["error"]
+    assert "Invalid parameter 'side'" in results[2]["error"]
+
+
+@pytest.mark.parametrize(
+    "jp_server_config",
+    [
+        {
+            "ServerApp": {"jpserver_extensions": {"jupyterlab_pullrequests": True}},
+            "PRConfig": {"access_token": "valid", "request_deadline": 0.1},
+        }
+    ],
+)
+@patch(
+    "jupyterlab_pullrequests.managers.github.GitHubManager.get_file_diff",
+    new_callable=AsyncMock,
+)
+async def test_GetFileContent_deadline(mock_get_file_diff, jp_fetch):
+    cancelled = asyncio.Event()
+
+    async def get_file_diff(*args, **kwargs):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    mock_get_file_diff.side_effect = get_file_diff
+
+    with pytest.raises(
+        tornado.httpclient.HTTPClientError, match=r"Request not completed within"
+    ) as exc_info:
+        await jp_fetch(
+            "pullrequests",
+            "files",
+            "content",
+            params={"id": valid_prid, "filename": valid_prfilename},
+        )
+    assert exc_info.value.code == 504
+    assert cancelled.is_set()
+
+
+@pytest.mark.parametrize(
+    "jp_server_config",
+    [
+        {
+            "ServerApp": {"jpserver_extensions": {"jupyterlab_pullrequests": True}},
+            "PRConfig": {"access_token": "valid", "request_deadline": 0.1},
+        }
+    ],
+)
+@patch(
+    "jupyterlab_pullrequests.managers.github.GitHubManager.get_file_diff",
+    new_callable=AsyncMock,
+)
+async def test_batch_stream_deadline(mock_get_file_diff, jp_fetch):
+    cancelled = asyncio.Event()
+
+    async def get_file_diff(*args, **kwargs):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    mock_get_file_diff.side_effect = get_file_diff
+
+    response = await jp_fetch(
+        "pullrequests",
+        "batch",
+        params={"stream": "1"},
+        method="POST",
+        body=json.dumps(
+            [
+                {"path": "unknown"},
+                {
+                    "path": "files/content",
+                    "params": {"id": valid_prid, "filename": valid_prfilename},
+                },
+            ]
+        ),
+    )
+    # The stream ends at the deadline and the pending operations are cancelled
+    assert [json.loads(line)["index"] for line in response.body.splitlines()] == [0]
+    await asyncio.wait_for(cancelled.wait(), 1)
+
+
+@patch(
+    "jupyterlab_pullrequests.managers.github.GitHubManager.get_file_diff",
+    new_callable=AsyncMock,
+)
+async def test_GetFileContent_client_disconnect(
+    mock_get_file_diff,
+    jp_serverapp,
+    http_server_client,
+    jp_base_url,
+    jp_auth_header,
+    jp_http_port,
+):
+    started = asyncio.Event()
+    cancelled = asyncio.Event()
+
+    async def get_file_diff(*args, **kwargs):
+        started.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    mock_get_file_diff.side_effect = get_file_diff
+
+    stream = await tornado.tcpclient.TCPClient().connect("localhost", jp_http_port)
+    path = tornado.httputil.url_concat(
+        f"{jp_base_url}pullrequests/files/content",
+        {"id": valid_prid, "filename": valid_prfilename},
+    )
+    headers = "".join(f"{k}: {v}\r\n" for k, v in jp_auth_header.items())
+    await stream.write(
+        f"GET {path} HTTP/1.1\r\nHost: localhost\r\n{headers}\r\n".encode("utf-8")
+    )
+    await asyncio.wait_for(started.wait(), 1)
+
+    # The manager call is cancelled once the client is gone
+    stream.close()
+    await asyncio.wait_for(cancelled.wait(), 1)
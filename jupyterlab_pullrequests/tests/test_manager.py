@@ -1,3 +1,4 @@
+import asyncio
 import json
 import pathlib
 from http import HTTPStatus
@@ -7,7 +8,12 @@ from mock import AsyncMock, MagicMock, patch
 from tornado.httpclient import HTTPClientError
 from tornado.web import HTTPError
 
+from jupyterlab_pullrequests.base import CommentReply
 from jupyterlab_pullrequests.managers.github import GitHubManager
+from jupyterlab_pullrequests.managers.manager import (
+    CONDITIONAL_CACHE_SIZE,
+    FetchPipeline,
+)
 
 HERE = pathlib.Path(__file__).parent.resolve()
 
@@ -106,3 +112,217 @@ async def test_GitHubManager_call_provider_pagination_dict(mock_fetch, pr_valid_
     result = await pr_valid_github_manager._call_provider("valid-link")
 
     assert result == expected_data
+
+
+@pytest.mark.asyncio
+async def test_FetchPipeline_bounded_concurrency():
+    pipeline = FetchPipeline(3, 2)
+    running = {"total": 0, "max": 0, "pr1": 0, "pr1_max": 0}
+    completed = []
+
+    async def fetch(key):
+        running["total"] += 1
+        running[key] = running.get(key, 0) + 1
+        running["max"] = max(running["max"], running["total"])
+        running[f"{key}_max"] = max(running.get(f"{key}_max", 0), running[key])
+        await asyncio.sleep(0.01)
+        running["total"] -= 1
+        running[key] -= 1
+        completed.append(key)
+        return key
+
+    results = await asyncio.gather(
+        *(pipeline.run(key, fetch, key) for key in ["pr1"] * 6 + ["pr2"] * 2)
+    )
+
+    assert results == ["pr1"] * 6 + ["pr2"] * 2
+    assert running["max"] == 3
+    assert running["pr1_max"] == 2
+    # pr1 cannot hold all slots so pr2 is not starved
+    assert completed.index("pr2") < 3
+    # Unused keys are released
+    assert pipeline._key_semaphores == {}
+
+
+@pytest.mark.asyncio
+async def test_FetchPipeline_cancelled_while_waiting():
+    pipeline = FetchPipeline(1, 1)
+    release = asyncio.Event()
+    fetched = []
+
+    async def fetch(key):
+        fetched.append(key)
+        await release.wait()
+        return key
+
+    first = asyncio.ensure_future(pipeline.run("pr1", fetch, "first"))
+    waiting = asyncio.ensure_future(pipeline.run("pr2", fetch, "waiting"))
+    await asyncio.sleep(0)
+    waiting.cancel()
+    release.set()
+
+    assert await first == "first"
+    with pytest.raises(asyncio.CancelledError):
+        await waiting
+    # The request waiting for a slot is never sent
+    assert fetched == ["first"]
+    assert pipeline._key_semaphores == {}
+
+
+@pytest.mark.asyncio
+async def test_PullRequestsManager_submit_review_keeps_unsent(pr_valid_github_manager):
+    pr_id = "https://api.github.com/repos/octocat/repo/pulls/1"
+    first = pr_valid_github_manager.add_pending_comment(
+        pr_id, CommentReply("first", "a.py", "1")
+    )
+    second = pr_valid_github_manager.add_pending_comment(
+        pr_id, CommentReply("second", "a.py", "1")
+    )
+    third = pr_valid_github_manager.add_pending_comment(
+        pr_id, CommentReply("third", "a.py", "1")
+    )
+    assert first["pending"] and first["discussionId"] == "1"
+    assert [c["id"] for c in pr_valid_github_manager.get_pending_comments(pr_id)] == [
+        first["id"],
+        second["id"],
+        third["id"],
+    ]
+
+    with patch.object(
+        pr_valid_github_manager,
+        "post_comment",
+        AsyncMock(side_effect=[{}, HTTPError(500)]),
+    ):
+        with pytest.raises(HTTPError):
+            await pr_valid_github_manager.submit_review(pr_id)
+
+    # Only the sent comment is removed
+    assert [c["id"] for c in pr_valid_github_manager.get_pending_comments(pr_id)] == [
+        second["id"],
+        third["id"],
+    ]
+
+    pr_valid_github_manager.discard_pending_comments(pr_id, second["id"])
+    assert [c["id"] for c in pr_valid_github_manager.get_pending_comments(pr_id)] == [
+        third["id"]
+    ]
+    pr_valid_github_manager.discard_pending_comments(pr_id)
+    assert pr_valid_github_manager.get_pending_comments(pr_id) == []
+
+
+@pytest.mark.asyncio
+async def test_PullRequestsManager_stale_while_revalidate(pr_valid_github_manager):
+    manager = pr_valid_github_manager
+    manager._config.stale_while_revalidate = {"files": 60}
+    pr_id = "https://api.github.com/repos/octocat/repo/pulls/1"
+
+    with patch.object(
+        manager, "list_files", AsyncMock(side_effect=[["a.py"], ["a.py", "b.py"]])
+    ) as list_files, patch.object(
+        manager, "get_files_validator", AsyncMock(side_effect=["v1", "v2", "v2"])
+    ):
+        assert manager.get_cached("files", pr_id) is None
+        assert await manager.fetch_cached("files", pr_id, validator="v1") == ["a.py"]
+
+        # Not modified; the cached answer is kept
+        result, age = manager.get_cached("files", pr_id)
+        assert result == ["a.py"]
+        assert 0 <= age < 60
+        await manager._revalidations[("files", pr_id)]
+        assert list_files.call_count == 1
+
+        # Modified; the cached answer is replaced
+        assert manager.get_cached("files", pr_id)[0] == ["a.py"]
+        await manager._revalidations[("files", pr_id)]
+        assert list_files.call_count == 2
+        assert manager.get_cached("files", pr_id)[0] == ["a.py", "b.py"]
+        await manager._revalidations[("files", pr_id)]
+
+    # Other endpoints are not cached
+    assert manager.get_cached("threads", pr_id, None) is None
+
+
+@pytest.mark.asyncio
+async def test_PullRequestsManager_coalesce_requests(pr_valid_github_manager):
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def fetch(request):
+        started.set()
+        await release.wait()
+        return MagicMock(body=b'{"login": "jsmith"}', headers={})
+
+    with patch(
+        "tornado.httpclient.AsyncHTTPClient.fetch", side_effect=fetch
+    ) as mock_fetch:
+        first = asyncio.ensure_future(
+            pr_valid_github_manager._request("https://api.github.com/user")
+        )
+        second = asyncio.ensure_future(
+            pr_valid_github_manager._request("https://api.github.com/user")
+        )
+        await started.wait()
+
+        # A cancelled caller does not cancel the request shared with another one
+        first.cancel()
+        await asyncio.sleep(0)
+        release.set()
+
+        assert await second == ({"login": "jsmith"}, None)
+        assert first.cancelled()
+        assert mock_fetch.call_count == 1
+    assert pr_valid_github_manager._inflight_requests == {}
+
+
+@pytest.mark.asyncio
+@patch("tornado.httpclient.AsyncHTTPClient.fetch", new_callable=AsyncMock)
+async def test_PullRequestsManager_conditional_cache_bounded(mock_fetch, pr_valid_github_manager):
+    urls = [f"https://api.github.com/pulls/{i}" for i in range(CONDITIONAL_CACHE_SIZE + 1)]
+    mock_fetch.side_effect = [
+        MagicMock(body=b'{"state": "open"}', headers={"ETag": '"a"'}),
+        *(
+            MagicMock(body=b'{"state": "open"}', headers={"ETag": '"b"'})
+            for _ in urls[1:-1]
+        ),
+        # The first response is used again, so it is kept
+        HTTPClientError(HTTPStatus.NOT_MODIFIED),
+        MagicMock(body=b'{"state": "open"}', headers={"ETag": '"b"'}),
+    ]
+
+    for url in urls[:-1]:
+        await pr_valid_github_manager._request(url, conditional=True)
+    await pr_valid_github_manager._request(urls[0], conditional=True)
+    await pr_valid_github_manager._request(urls[-1], conditional=True)
+
+    cache = pr_valid_github_manager._conditional_cache
+    assert len(cache) == CONDITIONAL_CACHE_SIZE
+    assert urls[0] in cache
+    assert urls[1] not in cache
+    assert list(cache)[-1] == urls[-1]
+
+
+@pytest.mark.asyncio
+async def test_PullRequestsManager_cancel_request(pr_valid_github_manager):
+    started = asyncio.Event()
+    cancelled = asyncio.Event()
+
+    async def fetch(request):
+        started.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    with patch("tornado.httpclient.AsyncHTTPClient.fetch", side_effect=fetch):
+        caller = asyncio.ensure_future(
+            pr_valid_github_manager._request("https://api.github.com/user")
+        )
+        await started.wait()
+
+        # The request is cancelled with its last caller
+        caller.cancel()
+        await asyncio.wait_for(cancelled.wait(), 1)
+
+    with pytest.raises(asyncio.CancelledError):
+        await caller
@@ -0,0 +1,129 @@
+import json
+
+import nbformat
+import pytest
+
+from jupyterlab_pullrequests.managers.notebook import diff_notebooks, stub_outputs
+
+
+def make_notebook(*sources, with_ids=True, minor=5):
+    nb = nbformat.v4.new_notebook()
+    nb.nbformat_minor = minor
+    for index, source in enumerate(sources):
+        if isinstance(source, tuple):
+            cell_id, source = source
+        else:
+            cell_id = f"cell-{index}"
+        cell = nbformat.v4.new_code_cell(source)
+        if with_ids:
+            cell["id"] = cell_id
+        else:
+            del cell["id"]
+        nb.cells.append(cell)
+    return json.dumps(nb)
+
+
+def test_diff_notebooks_unchanged():
+    content = make_notebook("a = 1", "b = 2")
+
+    result = diff_notebooks(content, content)
+
+    assert result["base"]["cellsCount"] == 2
+    assert result["head"]["cellsCount"] == 2
+    assert result["cells"] == [
+        {
+            "status": "unchanged",
+            "baseIndex": 0,
+            "headIndex": 0,
+            "cellType": "code",
+            "id": "cell-0",
+        },
+        {
+            "status": "unchanged",
+            "baseIndex": 1,
+            "headIndex": 1,
+            "cellType": "code",
+            "id": "cell-1",
+        },
+    ]
+
+
+def test_diff_notebooks_with_ids():
+    base = make_notebook(("a", "a = 1"), ("b", "b = 2"), ("c", "c = 3"))
+    head = make_notebook(("a", "a = 1"), ("c", "c = 4"), ("d", "d = 5"))
+
+    result = diff_notebooks(base, head)
+
+    assert [(c["status"], c.get("baseIndex"), c.get("headIndex")) for c in result["cells"]] == [
+        ("unchanged", 0, 0),
+        ("removed", 1, None),
+        ("modified", 2, 1),
+        ("added", None, 2),
+    ]
+    assert result["cells"][2]["base"]["source"] == "c = 3"
+    assert result["cells"][2]["head"]["source"] == "c = 4"
+
+
+@pytest.mark.parametrize("minor", (4, 5))
+def test_diff_notebooks_without_ids(minor):
+    base = make_notebook("a = 1", "b = 2", "c = 3", with_ids=False, minor=minor)
+    head = make_notebook("a = 1", "b = 3", "c = 3", "d = 4", with_ids=False, minor=minor)
+
+    result = diff_notebooks(base, head)
+
+    assert [c["status"] for c in result["cells"]] == [
+        "unchanged",
+        "modified",
+        "unchanged",
+        "added",
+    ]
+
+
+@pytest.mark.parametrize(
+    "base, head, status",
+    (("", make_notebook("a = 1"), "added"), (make_notebook("a = 1"), "", "removed")),
+)
+def test_diff_notebooks_missing_file(base, head, status):
+    result = diff_notebooks(base, head)
+
+    assert [c["status"] for c in result["cells"]] == [status]
+
+
+def test_stub_outputs():
+    base = nbformat.v4.new_notebook()
+    cell = nbformat.v4.new_code_cell("plot()")
+    cell["id"] = "plot"
+    base.cells.append(cell)
+    head = nbformat.v4.new_notebook()
+    cell = nbformat.v4.new_code_cell("plot()", execution_count=1)
+    cell["id"] = "plot"
+    cell.outputs = [
+        nbformat.v4.new_output("stream", name="stdout", text="small"),
+        nbformat.v4.new_output(
+            "execute_result",
+            data={"image/png": "A" * 1000, "text/plain": "<Figure>"},
+            execution_count=1,
+        ),
+    ]
+    head.cells.append(cell)
+    notebook_diff = diff_notebooks(json.dumps(base), json.dumps(head))
+
+    result, outputs = stub_outputs(notebook_diff, 500)
+
+    assert len(outputs) == 1
+    output_hash, (output, size) = next(iter(outputs.items()))
+    assert output["data"]["image/png"] == "A" * 1000
+    assert size > 1000
+    head_outputs = result["cells"][0]["head"]["outputs"]
+    assert head_outputs[0]["text"] == "small"
+    assert head_outputs[1] == {
+        "output_type": "execute_result",
+        "execution_count": 1,
+        "stub": {
+            "hash": output_hash,
+            "size": size,
+            "mimeTypes": ["image/png", "text/plain"],
+        },
+    }
+    # The original diff is untouched
+    assert "stub" not in notebook_diff["cells"][0]["head"]["outputs"][1]
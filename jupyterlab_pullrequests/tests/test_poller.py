@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+from tornado.web import HTTPError
+
+from jupyterlab_pullrequests.poller import PullRequestPollers
+
+
+class FakeManager:
+    def __init__(self, statuses):
+        self.statuses = list(statuses)
+        self.calls = 0
+
+    async def get_pull_request_status(self, pr_id):
+        self.calls += 1
+        status = self.statuses.pop(0) if len(self.statuses) > 1 else self.statuses[0]
+        if isinstance(status, Exception):
+            raise status
+        return status
+
+
+def status(head="a", state="open", comments=0):
+    return {"headSha": head, "state": state, "commentsCount": comments}
+
+
+async def next_events(queue, n):
+    return [await asyncio.wait_for(queue.get(), 1) for _ in range(n)]
+
+
+@pytest.mark.asyncio
+async def test_PullRequestPollers_events():
+    manager = FakeManager(
+        [
+            status(),
+            status(),
+            status(comments=2),
+            HTTPError(502, reason="Bad gateway"),
+            status(head="b", state="closed", comments=2),
+        ]
+    )
+    pollers = PullRequestPollers(manager, 0.01)
+
+    queue = pollers.subscribe("pr1")
+    events = await next_events(queue, 5)
+
+    assert events == [
+        {"type": "status", **status()},
+        {"type": "comments", "commentsCount": 2},
+        {"type": "error", "error": "Bad gateway"},
+        {"type": "head", "headSha": "b"},
+        {"type": "state", "state": "closed"},
+    ]
+
+    pollers.unsubscribe("pr1", queue)
+
+
+@pytest.mark.asyncio
+async def test_PullRequestPollers_shared():
+    manager = FakeManager([status()])
+    pollers = PullRequestPollers(manager, 0.05)
+
+    first = pollers.subscribe("pr1")
+    assert await next_events(first, 1) == [{"type": "status", **status()}]
+    # Late subscribers get the current status without polling
+    calls = manager.calls
+    second = pollers.subscribe("pr1")
+    assert second.get_nowait() == {"type": "status", **status()}
+    assert manager.calls == calls
+
+    pollers.unsubscribe("pr1", first)
+    pollers.unsubscribe("pr1", second)
+    # The poller is stopped without subscribers
+    assert pollers._pollers == {}
+    calls = manager.calls
+    await asyncio.sleep(0.1)
+    assert manager.calls == calls
+
+
+@pytest.mark.asyncio
+async def test_PullRequestPollers_unknown_error():
+    manager = FakeManager(
+        [RuntimeError("boom"), RuntimeError("boom"), status(comments=1), status()]
+    )
+    pollers = PullRequestPollers(manager, 0.01)
+
+    queue = pollers.subscribe("pr1")
+    events = await next_events(queue, 4)
+
+    # The poller keeps polling after an unexpected error
+    assert events == [
+        {"type": "error", "error": "Unknown error: boom"},
+        {"type": "error", "error": "Unknown error: boom"},
+        {"type": "status", **status(comments=1)},
+        {"type": "comments", "commentsCount": 0},
+    ]
+
+    pollers.unsubscribe("pr1", queue)
+
+
+@pytest.mark.asyncio
+async def test_PullRequestPollers_not_implemented():
+    manager = FakeManager([NotImplementedError()])
+    pollers = PullRequestPollers(manager, 0.01)
+
+    queue = pollers.subscribe("pr1")
+    events = await next_events(queue, 1)
+    assert events[0]["type"] == "error"
+    await asyncio.sleep(0.05)
+    assert manager.calls == 1
+
+    pollers.unsubscribe("pr1", queue)
@@ -0,0 +1,55 @@
+import asyncio
+import sys
+import time
+
+import pytest
+from mock import patch
+from prometheus_client import REGISTRY
+
+from jupyterlab_pullrequests.watchdog import OTHER_SECTION, LoopWatchdog, get_section
+
+
+def stalls_count(section):
+    return (
+        REGISTRY.get_sample_value(
+            "jupyterlab_pullrequests_event_loop_stalls_total", {"section": section}
+        )
+        or 0
+    )
+
+
+def test_get_section_other():
+    assert get_section(sys._getframe()) == OTHER_SECTION
+    assert get_section(None) == OTHER_SECTION
+
+
+@pytest.mark.asyncio
+async def test_LoopWatchdog_stall(pr_valid_github_manager):
+    section = getattr(
+        pr_valid_github_manager._stub_outputs.__code__,
+        "co_qualname",
+        "_stub_outputs",
+    )
+    count = stalls_count(section)
+    watchdog = LoopWatchdog(0.05)
+    watchdog.start()
+    try:
+        await asyncio.sleep(0.1)
+        with patch(
+            "jupyterlab_pullrequests.managers.notebook.stub_outputs",
+            side_effect=lambda *args: time.sleep(0.3) or ({}, {}),
+        ):
+            pr_valid_github_manager._stub_outputs({})
+        # Let the watchdog record the stall end
+        await asyncio.sleep(0.1)
+    finally:
+        watchdog.stop()
+
+    assert stalls_count(section) == count + 1
+    assert (
+        REGISTRY.get_sample_value(
+            "jupyterlab_pullrequests_event_loop_stall_seconds_count",
+            {"section": section},
+        )
+        == count + 1
+    )
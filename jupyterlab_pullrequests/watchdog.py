@@ -0,0 +1,117 @@
+"""
+Watchdog measuring the event loop lag and attributing its stalls.
+"""
+import sys
+import threading
+import time
+import traceback
+from types import FrameType
+from typing import Optional
+
+import tornado.ioloop
+
+from .log import get_logger
+from .metrics import (
+    EVENT_LOOP_LAG_SECONDS,
+    EVENT_LOOP_STALL_SECONDS,
+    EVENT_LOOP_STALLS_TOTAL,
+)
+
+# Modules whose functions are reported as stall sections
+SECTION_MODULES = ("jupyterlab_pullrequests.handlers", "jupyterlab_pullrequests.managers")
+# Section of the stalls occurring outside of the extension handlers and managers
+OTHER_SECTION = "other"
+
+
+def get_section(frame: Optional[FrameType]) -> str:
+    """Get the extension section running a frame.
+
+    The section is the innermost handler or manager function in the stack;
+    e.g. "PullRequestsManager.get_notebook_diff". Only the code objects are
+    read as the frame is running in another thread.
+
+    Args:
+        frame: The innermost frame
+    Returns:
+        The section name; ``OTHER_SECTION`` if no handler or manager is running
+    """
+    while frame is not None:
+        if frame.f_globals.get("__name__", "").startswith(SECTION_MODULES):
+            # Qualified names are available from Python 3.11
+            return getattr(frame.f_code, "co_qualname", frame.f_code.co_name)
+        frame = frame.f_back
+    return OTHER_SECTION
+
+
+class LoopWatchdog:
+    """Measure the event loop lag and report the long synchronous sections.
+
+    A periodic callback on the event loop records its own delay as the loop
+    lag. A thread checks that callback: when the loop has been blocked for
+    more than ``threshold``, it samples the loop thread stack, attributes the
+    stall to the running handler or manager function and logs the stack. The
+    stall duration is recorded once the loop runs again.
+
+    Args:
+        threshold: Blocking duration in seconds from which a stall is reported
+    """
+
+    def __init__(self, threshold: float) -> None:
+        self._threshold = threshold
+        self._interval = threshold / 2
+        self._tick = time.monotonic()
+        self._thread_id = None  # type: Optional[int]
+        # Section and start time of the ongoing stall
+        self._stall = None  # type: Optional[Tuple[str, float]]
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._callback = None  # type: Optional[tornado.ioloop.PeriodicCallback]
+
+    def start(self) -> None:
+        """Start watching the current event loop."""
+        self._thread_id = threading.get_ident()
+        self._tick = time.monotonic()
+        self._stopped.clear()
+        self._callback = tornado.ioloop.PeriodicCallback(
+            self._beat, self._interval * 1000
+        )
+        self._callback.start()
+        threading.Thread(
+            target=self._watch, name="jupyterlab_pullrequests-watchdog", daemon=True
+        ).start()
+
+    def stop(self) -> None:
+        """Stop watching the event loop."""
+        self._stopped.set()
+        if self._callback is not None:
+            self._callback.stop()
+            self._callback = None
+
+    def _beat(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            lag = max(now - self._tick - self._interval, 0)
+            self._tick = now
+            stall, self._stall = self._stall, None
+        EVENT_LOOP_LAG_SECONDS.observe(lag)
+        if stall is not None:
+            section, start = stall
+            EVENT_LOOP_STALL_SECONDS.labels(section).observe(now - start)
+            get_logger().warning(
+                f"Event loop blocked for {now - start:.3f}s by {section}"
+            )
+
+    def _watch(self) -> None:
+        while not self._stopped.wait(self._interval):
+            with self._lock:
+                blocked = time.monotonic() - self._tick - self._interval
+                if self._stall is not None or blocked < self._threshold:
+                    continue
+                frame = sys._current_frames().get(self._thread_id)
+                section = get_section(frame)
+                stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+                self._stall = (section, self._tick + self._interval)
+            EVENT_LOOP_STALLS_TOTAL.labels(section).inc()
+            get_logger().warning(
+                f"Event loop blocked for more than {self._threshold}s by {section}:\n{stack}"
+            )